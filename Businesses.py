@@ -1,5 +1,10 @@
 import pg8000
 import pandas as pd
+from bulk_loader import copy_dataframe
+from incremental_loader import incremental_load
+from index_manager import build_indexes
+from metrics import METRICS_PATH, configure, count_round_trips, print_summary, stage, timed
+from shadow_loader import shadow_load
 
 class BusinessesDataProcessor:
     def __init__(self, db_config, csv_path):
@@ -9,19 +14,20 @@ class BusinessesDataProcessor:
     def connect(self):
         """Kết nối đến PostgreSQL."""
         try:
-            conn = pg8000.connect(**self.db_config)
+            conn = count_round_trips(pg8000.connect(**self.db_config))
             print("✅ Kết nối đến PostgreSQL thành công!")
             return conn
         except Exception as e:
             print(f"❌ Lỗi kết nối: {e}")
 
-    def create_table(self, conn):
-        """Tạo bảng Businesses nếu chưa tồn tại."""
+    def create_table(self, conn, drop=True):
+        """Tạo bảng Businesses nếu chưa tồn tại (drop=False giữ lại bảng cũ cho chế độ nạp tăng dần)."""
         # Xóa bảng cũ nếu có
-        drop_table_query = "DROP TABLE IF EXISTS Businesses;"
-        with conn.cursor() as cur:
-            cur.execute(drop_table_query)
-            conn.commit()
+        if drop:
+            drop_table_query = "DROP TABLE IF EXISTS Businesses;"
+            with conn.cursor() as cur:
+                cur.execute(drop_table_query)
+                conn.commit()
         
         # Tạo bảng mới
         create_table_query = """
@@ -78,41 +84,39 @@ class BusinessesDataProcessor:
 
         return df
 
-    def insert_data(self, conn):
-        """Chèn dữ liệu từ CSV vào bảng."""
+    # Các cột của bảng Businesses theo đúng thứ tự
+    columns = [
+        'industry_code', 'industry_name', 'sa2_code', 'sa2_name',
+        '0_to_50k_businesses', '50k_to_200k_businesses',
+        '200k_to_500k_businesses', '500k_to_2m_businesses',
+        '2m_to_5m_businesses', '5m_to_10m_businesses', '10m_or_more_businesses', 'total_businesses'
+    ]
+
+    @timed('read', rows=len)
+    def read_table_frame(self):
+        """Đọc CSV, chuẩn hóa và trả về DataFrame với đúng các cột/kiểu của bảng."""
         df = pd.read_csv(self.csv_path)
         
         # Chuẩn hóa dữ liệu
         df = self.normalize_data(df)
-        
-        insert_query = """
-        INSERT INTO Businesses (industry_code, industry_name, sa2_code, sa2_name,
-                                "0_to_50k_businesses", "50k_to_200k_businesses",
-                                "200k_to_500k_businesses", "500k_to_2m_businesses",
-                                "2m_to_5m_businesses", "5m_to_10m_businesses", "10m_or_more_businesses", total_businesses)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ON CONFLICT (sa2_code) DO NOTHING;
-        """
-        
-        with conn.cursor() as cur:
-            for _, row in df.iterrows():
-                data = (
-                    row['industry_code'],
-                    row['industry_name'],
-                    str(row['sa2_code']),
-                    str(row['sa2_name']),
-                    int(row['0_to_50k_businesses']),
-                    int(row['50k_to_200k_businesses']),
-                    int(row['200k_to_500k_businesses']),
-                    int(row['500k_to_2m_businesses']),
-                    int(row['2m_to_5m_businesses']),
-                    int(row['5m_to_10m_businesses']),
-                    int(row['10m_or_more_businesses']),
-                    int(row['total_businesses'])
-                )
-                cur.execute(insert_query, data)
-            conn.commit()
-            print("✅ Chèn dữ liệu thành công!")
+        df['sa2_code'] = df['sa2_code'].astype(str)
+        df['sa2_name'] = df['sa2_name'].astype(str)
+        return df[self.columns]
+
+    def insert_data(self, conn):
+        """Chèn dữ liệu từ CSV vào bảng."""
+        copy_dataframe(conn, self.read_table_frame(), 'Businesses', self.columns, conflict_key='sa2_code')
+        print("✅ Chèn dữ liệu thành công!")
+
+    def load_incremental(self, conn):
+        """Nạp tăng dần: bỏ qua nếu file CSV không đổi, ngược lại chỉ thêm/sửa/xóa các dòng thay đổi."""
+        self.create_table(conn, drop=False)
+        incremental_load(conn, 'Businesses', [self.csv_path], self.read_table_frame, self.columns, 'sa2_code')
+
+    def load_shadow(self, conn):
+        """Nạp lại toàn bộ vào bảng shadow UNLOGGED rồi đổi bảng nguyên tử (người đọc không thấy bảng rỗng)."""
+        self.create_table(conn, drop=False)
+        shadow_load(conn, 'Businesses', self.read_table_frame(), self.columns, key='sa2_code')
 
 # Cấu hình database
 db_config = {
@@ -124,9 +128,34 @@ db_config = {
 }
 
 csv_path = 'data/Businesses.csv'
-processor = BusinessesDataProcessor(db_config, csv_path)
-conn = processor.connect()
-if conn:
-    processor.create_table(conn)
-    processor.insert_data(conn)
-    conn.close()
+# Chế độ nạp: 'incremental' (chỉ áp dụng thay đổi), 'shadow' (nạp bảng phụ rồi đổi bảng)
+# hoặc 'full' (xóa bảng và nạp lại)
+LOAD_MODES = ('full', 'incremental', 'shadow')
+load_mode = 'full'
+
+
+def run(conn, load_mode=load_mode):
+    """Nạp bảng Businesses trên kết nối có sẵn (được pipeline.py gọi)."""
+    if load_mode not in LOAD_MODES:
+        raise ValueError(f"Businesses không hỗ trợ chế độ nạp {load_mode!r} (chỉ {LOAD_MODES})")
+    with stage('businesses'):
+        processor = BusinessesDataProcessor(db_config, csv_path)
+        if load_mode == 'incremental':
+            processor.load_incremental(conn)
+        elif load_mode == 'shadow':
+            processor.load_shadow(conn)
+        else:
+            processor.create_table(conn)
+            processor.insert_data(conn)
+        # Cập nhật thống kê cho planner (sa2_code đã có index của khóa chính)
+        build_indexes(conn, 'Businesses', [], concurrently=load_mode != 'full')
+
+
+if __name__ == '__main__':
+    # Ghi bản ghi đo của từng bước ra data/metrics.jsonl
+    configure(METRICS_PATH)
+    conn = BusinessesDataProcessor(db_config, csv_path).connect()
+    if conn:
+        run(conn)
+        conn.close()
+        print_summary()
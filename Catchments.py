@@ -1,11 +1,21 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import geopandas as gpd
 import pandas as pd
 import pg8000
+import pyogrio
+from bulk_loader import WORKING_SRID, copy_geodataframe, geodataframe_to_frame, to_working_crs
+from incremental_loader import ensure_geometry_column, incremental_load
+from geometry_resolution import PRECISION_GRID, SIMPLIFY_TOLERANCE, ensure_resolution_columns
+from shadow_loader import shadow_load
+from index_manager import build_indexes
+from metrics import METRICS_PATH, configure, count_round_trips, print_summary, stage, timed
+from utils import shapefile_sources
 
 # Hàm kết nối đến PostgreSQL
 def connect():
     try:
-        conn = pg8000.connect(**db_config)
+        conn = count_round_trips(pg8000.connect(**db_config))
         print("✅ Kết nối đến PostgreSQL thành công!")
         return conn
     except Exception as e:
@@ -14,7 +24,7 @@ def connect():
 
 # Hàm tạo bảng 'schools' trong PostgreSQL
 def create_schools_table(conn):
-    create_table_query = """
+    create_table_query = f"""
     CREATE TABLE IF NOT EXISTS schools (
         USE_ID INT PRIMARY KEY,
         CATCH_TYPE VARCHAR(255),
@@ -35,34 +45,87 @@ def create_schools_table(conn):
         YEAR12 VARCHAR(255),
         PRIORITY VARCHAR(255),
         level VARCHAR(50),
-        geometry GEOMETRY(MultiPolygon, 4326)
+        geometry GEOMETRY(MultiPolygon, {WORKING_SRID})
     );
     """
     try:
         with conn.cursor() as cur:
             cur.execute(create_table_query)
             conn.commit()
-            print("✅ Tạo bảng 'schools' thành công!")
+        # Bảng tạo trước khi chuẩn hóa CRS (SRID 4326) được chuyển sang SRID làm việc
+        ensure_geometry_column(conn, 'schools', 'geometry', 'MultiPolygon', WORKING_SRID)
+        # Bản đơn giản hóa và vùng lõi (GENERATED) cho phép join thô trước, chính xác sau
+        ensure_resolution_columns(conn, 'schools', 'geometry', SCHOOL_SIMPLIFY_TOLERANCE, SCHOOL_PRECISION_GRID)
+        print("✅ Tạo bảng 'schools' thành công!")
     except Exception as e:
         print(f"❌ Lỗi khi tạo bảng: {e}")
         conn.rollback()
+        raise
+
+# Các shapefile catchments và cột 'level' tương ứng (theo thứ tự ưu tiên khi trùng USE_ID)
+CATCHMENT_SHAPEFILES = [
+    ('future', "data/Catchments/catchments/catchments_future.shp"),
+    ('primary', "data/Catchments/catchments/catchments_primary.shp"),
+    ('secondary', "data/Catchments/catchments/catchments_secondary.shp"),
+]
+
+# Đọc theo thuộc tính trước: chỉ parse geometry của các bản ghi được giữ lại sau khi bỏ trùng USE_ID
+attribute_first = True
+
+# Đọc USE_ID của một shapefile (không đọc geometry), index là FID của bản ghi
+def read_catchment_ids(shapefile_path):
+    return pyogrio.read_dataframe(shapefile_path, columns=['USE_ID'], read_geometry=False,
+                                  fid_as_index=True, use_arrow=True)['USE_ID']
+
+# FID được giữ lại của từng shapefile: USE_ID xuất hiện lần đầu theo thứ tự ưu tiên
+def surviving_fids(id_series):
+    ids = pd.concat(id_series, keys=range(len(id_series)), names=['file', 'fid'])
+    kept = ids[~ids.duplicated(keep='first')].index
+    return [
+        kept[kept.get_level_values('file') == i].get_level_values('fid').sort_values().to_numpy()
+        for i in range(len(id_series))
+    ]
+
+# Đọc đầy đủ (kèm geometry) chỉ các FID được giữ lại của một shapefile (fids=None: cả file)
+def read_catchment_features(shapefile_path, level, fids):
+    gdf = gpd.read_file(shapefile_path, engine="pyogrio", fids=fids)
+    gdf['level'] = level
+    return gdf
 
 # Đọc dữ liệu từ các shapefile
-def read_and_combine_shapefiles():
+# attribute_first: đọc song song USE_ID của cả 3 file, xác định bản ghi được giữ, rồi song song
+# đọc geometry của riêng các bản ghi đó (không parse các polygon sẽ bị loại vì trùng USE_ID)
+@timed('read', rows=len)
+def read_and_combine_shapefiles(attribute_first=attribute_first, max_workers=len(CATCHMENT_SHAPEFILES)):
     print("🌍 Đang xử lý và kết hợp dữ liệu từ các shapefiles...")
-    
+
+    if attribute_first:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            id_series = list(executor.map(read_catchment_ids, [path for _, path in CATCHMENT_SHAPEFILES]))
+            fids = surviving_fids(id_series)
+            skipped = sum(len(ids) for ids in id_series) - sum(len(f) for f in fids)
+            print(f"✅ Đã xác định {sum(len(f) for f in fids)} USE_ID cần đọc (bỏ qua {skipped} bản ghi trùng)")
+            # File không có bản ghi bị loại thì đọc tuần tự cả file (nhanh hơn đọc theo từng FID)
+            fids = [None if len(f) == len(ids) else f for f, ids in zip(fids, id_series)]
+            gdfs = list(executor.map(
+                read_catchment_features,
+                [path for _, path in CATCHMENT_SHAPEFILES],
+                [level for level, _ in CATCHMENT_SHAPEFILES],
+                fids,
+            ))
+        combined_gdf = pd.concat(gdfs, ignore_index=True)
+        print("✅ Đã kết hợp và làm sạch dữ liệu từ các shapefiles!")
+        return combined_gdf
+
     # Đọc các shapefiles và thêm cột 'level' để phân biệt
-    gdf_future = gpd.read_file("data/Catchments/catchments/catchments_future.shp", engine="pyogrio")
-    gdf_future['level'] = 'future'
-    
-    gdf_primary = gpd.read_file("data/Catchments/catchments/catchments_primary.shp", engine="pyogrio")
-    gdf_primary['level'] = 'primary'
-    
-    gdf_secondary = gpd.read_file("data/Catchments/catchments/catchments_secondary.shp", engine="pyogrio")
-    gdf_secondary['level'] = 'secondary'
-    
+    gdfs = []
+    for level, path in CATCHMENT_SHAPEFILES:
+        gdf = gpd.read_file(path, engine="pyogrio")
+        gdf['level'] = level
+        gdfs.append(gdf)
+
     # Kết hợp tất cả GeoDataFrame
-    combined_gdf = pd.concat([gdf_future, gdf_primary, gdf_secondary], ignore_index=True)
+    combined_gdf = pd.concat(gdfs, ignore_index=True)
     
     # Loại bỏ các bản ghi trùng USE_ID
     combined_gdf = combined_gdf.drop_duplicates(subset=['USE_ID'])
@@ -72,13 +135,16 @@ def read_and_combine_shapefiles():
     return combined_gdf
 
 # Chèn dữ liệu vào bảng 'schools' với xử lý trùng khóa chính
-def insert_data_into_schools(conn, gdf):
+def insert_data_into_schools(conn, gdf, geometry_mode='wkb'):
+    if geometry_mode == 'wkb':
+        return insert_data_into_schools_wkb(conn, gdf)
+    gdf = to_working_crs(gdf)
     try:
         with conn.cursor() as cur:
             # Sử dụng UPSERT để xử lý trùng khóa chính
-            insert_query = """
+            insert_query = f"""
             INSERT INTO schools (USE_ID, CATCH_TYPE, USE_DESC, ADD_DATE, KINDERGART, YEAR1, YEAR2, YEAR3, YEAR4, YEAR5, YEAR6, YEAR7, YEAR8, YEAR9, YEAR10, YEAR11, YEAR12, PRIORITY, level, geometry)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, ST_SetSRID(ST_GeomFromText(%s), 4326))
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, ST_SetSRID(ST_GeomFromText(%s), {WORKING_SRID}))
             ON CONFLICT (USE_ID) DO UPDATE SET
                 CATCH_TYPE = EXCLUDED.CATCH_TYPE,
                 USE_DESC = EXCLUDED.USE_DESC,
@@ -127,6 +193,57 @@ def insert_data_into_schools(conn, gdf):
     except Exception as e:
         print(f"❌ Lỗi khi chèn dữ liệu: {e}")
         conn.rollback()
+        raise
+
+# Các cột của bảng 'schools' theo đúng thứ tự (tên cột trong bảng là chữ thường)
+SCHOOL_COLUMNS = [
+    'use_id', 'catch_type', 'use_desc', 'add_date', 'kindergart', 'year1', 'year2', 'year3',
+    'year4', 'year5', 'year6', 'year7', 'year8', 'year9', 'year10', 'year11', 'year12',
+    'priority', 'level', 'geometry'
+]
+
+# Index tạo sau khi nạp (use_id đã có index btree của khóa chính)
+SCHOOL_INDEXES = [('gist', 'geometry'), ('gist', 'geometry_simple')]
+
+# Sai số của cột geometry_simple (đơn vị độ của SRID làm việc)
+SCHOOL_SIMPLIFY_TOLERANCE = SIMPLIFY_TOLERANCE
+SCHOOL_PRECISION_GRID = PRECISION_GRID
+
+# Đổi tên cột sang chữ thường cho khớp với bảng (USE_ID -> use_id)
+def to_schools_frame(gdf):
+    return gdf.rename(columns={col: col.lower() for col in gdf.columns if col != gdf.geometry.name})
+
+# Chèn dữ liệu bằng COPY, geometry gửi dạng hex EWKB (Polygon -> MultiPolygon hàng loạt)
+def insert_data_into_schools_wkb(conn, gdf):
+    try:
+        copy_geodataframe(conn, to_schools_frame(gdf), 'schools', SCHOOL_COLUMNS, srid=WORKING_SRID,
+                          conflict_key='use_id', on_conflict='update')
+        print("✅ Đã chèn dữ liệu vào bảng 'schools' thành công!")
+    except Exception as e:
+        print(f"❌ Lỗi khi chèn dữ liệu: {e}")
+        raise
+
+# Nạp tăng dần: bỏ qua nếu các shapefile không đổi, ngược lại chỉ thêm/sửa/xóa các USE_ID thay đổi
+def load_schools_incremental(conn):
+    sources = [path for _, shapefile in CATCHMENT_SHAPEFILES for path in shapefile_sources(shapefile)]
+    try:
+        incremental_load(
+            conn, 'schools', sources,
+            lambda: geodataframe_to_frame(to_schools_frame(read_and_combine_shapefiles()), SCHOOL_COLUMNS, srid=WORKING_SRID),
+            SCHOOL_COLUMNS, 'use_id',
+        )
+    except Exception as e:
+        print(f"❌ Lỗi khi nạp tăng dần: {e}")
+        raise
+
+# Nạp lại toàn bộ vào bảng shadow UNLOGGED rồi đổi bảng nguyên tử (người đọc không thấy bảng dở dang)
+def load_schools_shadow(conn):
+    try:
+        frame = geodataframe_to_frame(to_schools_frame(read_and_combine_shapefiles()), SCHOOL_COLUMNS, srid=WORKING_SRID)
+        shadow_load(conn, 'schools', frame, SCHOOL_COLUMNS, key='use_id')
+    except Exception as e:
+        print(f"❌ Lỗi khi nạp bảng shadow: {e}")
+        raise
 
 # Cấu hình kết nối với PostgreSQL
 db_config = {
@@ -137,10 +254,36 @@ db_config = {
     'database': 'postgres'
 }
 
-# Kết nối và xử lý dữ liệu
-conn = connect()
-if conn:
-    create_schools_table(conn)
-    combined_gdf = read_and_combine_shapefiles()
-    insert_data_into_schools(conn, combined_gdf)
-    conn.close()
+# Chế độ nạp: 'incremental' (chỉ áp dụng thay đổi), 'shadow' (nạp bảng phụ rồi đổi bảng)
+# hoặc 'full' (đọc và upsert toàn bộ)
+LOAD_MODES = ('full', 'incremental', 'shadow')
+load_mode = 'full'
+
+
+def run(conn, load_mode=load_mode):
+    """Nạp bảng Schools trên kết nối có sẵn (được pipeline.py gọi)."""
+    if load_mode not in LOAD_MODES:
+        raise ValueError(f"Catchments không hỗ trợ chế độ nạp {load_mode!r} (chỉ {LOAD_MODES})")
+    with stage('catchments'):
+        create_schools_table(conn)
+        if load_mode == 'incremental':
+            load_schools_incremental(conn)
+        elif load_mode == 'shadow':
+            load_schools_shadow(conn)
+        else:
+            combined_gdf = read_and_combine_shapefiles()
+            insert_data_into_schools(conn, combined_gdf)
+
+        # Bảng schools không bị xóa ở chế độ nào nên luôn tạo index concurrently
+        build_indexes(conn, 'schools', SCHOOL_INDEXES, concurrently=True)
+
+
+if __name__ == '__main__':
+    # Ghi bản ghi đo của từng bước ra data/metrics.jsonl
+    configure(METRICS_PATH)
+    # Kết nối và xử lý dữ liệu
+    conn = connect()
+    if conn:
+        run(conn)
+        conn.close()
+        print_summary()
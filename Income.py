@@ -1,5 +1,10 @@
 import pg8000
 import pandas as pd
+from bulk_loader import copy_dataframe
+from incremental_loader import incremental_load
+from index_manager import build_indexes
+from metrics import METRICS_PATH, configure, count_round_trips, print_summary, stage, timed
+from shadow_loader import shadow_load
 
 class IncomeDataProcessor:
     def __init__(self, db_config, csv_path):
@@ -9,15 +14,15 @@ class IncomeDataProcessor:
     def connect(self):
         """Kết nối đến PostgreSQL và trả về đối tượng kết nối."""
         try:
-            conn = pg8000.connect(**self.db_config)
+            conn = count_round_trips(pg8000.connect(**self.db_config))
             print("✅ Kết nối đến PostgreSQL thành công!")
             return conn
         except Exception as e:
             print(f"❌ Lỗi kết nối: {e}")
             return None
 
-    def create_table(self, conn):
-        """Tạo bảng Income nếu chưa tồn tại."""
+    def create_table(self, conn, drop=True):
+        """Tạo bảng Income nếu chưa tồn tại (drop=False giữ lại bảng cũ cho chế độ nạp tăng dần)."""
         drop_table_query = "DROP TABLE IF EXISTS Income;"
         create_table_query = """
         CREATE TABLE IF NOT EXISTS Income (
@@ -32,13 +37,15 @@ class IncomeDataProcessor:
 
         try:
             with conn.cursor() as cur:
-                cur.execute(drop_table_query)
+                if drop:
+                    cur.execute(drop_table_query)
                 cur.execute(create_table_query)
                 conn.commit()
                 print("✅ Tạo bảng Income thành công!")
         except Exception as e:
             print(f"❌ Lỗi khi tạo bảng: {e}")
             conn.rollback()
+            raise
 
     def clean_data(self, df):
         """Chuẩn hóa dữ liệu từ CSV."""
@@ -57,31 +64,47 @@ class IncomeDataProcessor:
         print(f"✅ Đã chuẩn hóa dữ liệu:\n{df.head()}")
         return df
 
+    # Các cột của bảng Income theo đúng thứ tự
+    columns = ['sa2_code21', 'sa2_name', 'earners', 'median_age', 'median_income', 'mean_income']
+
+    def to_table_frame(self, df):
+        """DataFrame với đúng các cột/kiểu của bảng Income."""
+        df = df.copy()
+        df['sa2_code21'] = df['sa2_code21'].astype(str)
+        return df[self.columns]
+
     def insert_data(self, conn, df):
-        """Chèn dữ liệu từ DataFrame vào bảng."""
-        insert_query = """
-        INSERT INTO Income (sa2_code21, sa2_name, earners, median_age, median_income, mean_income)
-        VALUES (%s, %s, %s, %s, %s, %s)
-        ON CONFLICT (sa2_code21) DO NOTHING;
-        """
+        """Chèn dữ liệu từ DataFrame vào bảng bằng COPY."""
         try:
-            with conn.cursor() as cur:
-                for _, row in df.iterrows():
-                    data = (
-                        str(row['sa2_code21']),
-                        row['sa2_name'],
-                        int(row['earners']),
-                        int(row['median_age']),
-                        int(row['median_income']),
-                        int(row['mean_income'])
-                    )
-                    cur.execute(insert_query, data)
-                conn.commit()
-                print("✅ Chèn dữ liệu thành công!")
+            copy_dataframe(conn, self.to_table_frame(df), 'Income', self.columns, conflict_key='sa2_code21')
+            print("✅ Chèn dữ liệu thành công!")
         except Exception as e:
             print(f"❌ Lỗi khi chèn dữ liệu: {e}")
-            conn.rollback()
+            raise
 
+    def load_incremental(self, conn):
+        """Nạp tăng dần: bỏ qua nếu file CSV không đổi, ngược lại chỉ thêm/sửa/xóa các dòng thay đổi."""
+        self.create_table(conn, drop=False)
+        try:
+            incremental_load(
+                conn, 'Income', [self.csv_path],
+                lambda: self.to_table_frame(self.process_data()),
+                self.columns, 'sa2_code21',
+            )
+        except Exception as e:
+            print(f"❌ Lỗi khi nạp tăng dần: {e}")
+            raise
+
+    def load_shadow(self, conn):
+        """Nạp lại toàn bộ vào bảng shadow UNLOGGED rồi đổi bảng nguyên tử (người đọc không thấy bảng rỗng)."""
+        self.create_table(conn, drop=False)
+        try:
+            shadow_load(conn, 'Income', self.to_table_frame(self.process_data()), self.columns, key='sa2_code21')
+        except Exception as e:
+            print(f"❌ Lỗi khi nạp bảng shadow: {e}")
+            raise
+
+    @timed('read', rows=len)
     def process_data(self):
         """Quy trình xử lý toàn bộ dữ liệu từ CSV."""
         print(f"📂 Đang xử lý file {self.csv_path}")
@@ -104,18 +127,42 @@ db_config = {
 
 csv_path = 'data/Income.csv'
 
-# Khởi tạo đối tượng xử lý dữ liệu
-processor = IncomeDataProcessor(db_config, csv_path)
-
-# Kết nối đến database
-conn = processor.connect()
-if conn:
-    # Xử lý dữ liệu từ CSV
-    df = processor.process_data()
-    
-    # Tạo bảng và chèn dữ liệu
-    processor.create_table(conn)
-    processor.insert_data(conn, df)
-    
-    # Đóng kết nối
-    conn.close()
+# Chế độ nạp: 'incremental' (chỉ áp dụng thay đổi), 'shadow' (nạp bảng phụ rồi đổi bảng)
+# hoặc 'full' (xóa bảng và nạp lại)
+LOAD_MODES = ('full', 'incremental', 'shadow')
+load_mode = 'full'
+
+
+def run(conn, load_mode=load_mode):
+    """Nạp bảng Income trên kết nối có sẵn (được pipeline.py gọi)."""
+    if load_mode not in LOAD_MODES:
+        raise ValueError(f"Income không hỗ trợ chế độ nạp {load_mode!r} (chỉ {LOAD_MODES})")
+    with stage('income'):
+        processor = IncomeDataProcessor(db_config, csv_path)
+        if load_mode == 'incremental':
+            processor.load_incremental(conn)
+        elif load_mode == 'shadow':
+            processor.load_shadow(conn)
+        else:
+            # Xử lý dữ liệu từ CSV
+            df = processor.process_data()
+
+            # Tạo bảng và chèn dữ liệu
+            processor.create_table(conn)
+            processor.insert_data(conn, df)
+
+        # Cập nhật thống kê cho planner (sa2_code21 đã có index của khóa chính)
+        build_indexes(conn, 'Income', [], concurrently=load_mode != 'full')
+
+
+if __name__ == '__main__':
+    # Ghi bản ghi đo của từng bước ra data/metrics.jsonl
+    configure(METRICS_PATH)
+    # Kết nối đến database
+    conn = IncomeDataProcessor(db_config, csv_path).connect()
+    if conn:
+        run(conn)
+
+        # Đóng kết nối
+        conn.close()
+        print_summary()
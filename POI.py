@@ -1,18 +1,26 @@
 import pg8000
+import pandas as pd
+from bulk_loader import WORKING_SRID, copy_dataframe, quote_ident
+from incremental_loader import ensure_geometry_column
+from index_manager import build_indexes
+from metrics import METRICS_PATH, configure, count_round_trips, print_summary, stage, timed
+
+# Index của bảng points_of_interest (tạo cùng bảng, ANALYZE lại sau mỗi lần thu thập POI)
+POI_INDEXES = [('gist', 'shape')]
 
 def create_poi_table(conn):
     """Tạo bảng points_of_interest nếu chưa tồn tại."""
-    create_table_query = """
+    create_table_query = f"""
     CREATE TABLE IF NOT EXISTS points_of_interest (
+        objectid BIGINT PRIMARY KEY,
         poigroup VARCHAR(255),
         poitype VARCHAR(255),
         poiname VARCHAR(255),
         poilabel VARCHAR(255),
-        shape geometry,
+        shape geometry(Point, {WORKING_SRID}),
         startdate DATE,
         enddate DATE,
-        lastupdate TIMESTAMP,
-        PRIMARY KEY (poigroup)
+        lastupdate TIMESTAMP
     );
     """
     
@@ -20,10 +28,129 @@ def create_poi_table(conn):
         with conn.cursor() as cur:
             cur.execute(create_table_query)
             conn.commit()
-            print("✅ Tạo bảng points_of_interest thành công!")
+        # Bảng tạo trước khi chuẩn hóa CRS (geometry không SRID) được chuyển sang SRID làm việc
+        ensure_geometry_column(conn, 'points_of_interest', 'shape', 'Point', WORKING_SRID)
+        print("✅ Tạo bảng points_of_interest thành công!")
     except Exception as e:
         print(f"❌ Lỗi khi tạo bảng: {e}")
         conn.rollback()
+        raise
+
+def ensure_poi_key(conn, journal=None):
+    """Đảm bảo khóa chính là objectid của NSW POI (bảng cũ dùng poigroup, chỉ giữ được một POI mỗi nhóm).
+
+    Được gọi bởi nơi thu thập POI (task2.py, main.py) trước khi ghi. Dòng cũ không
+    có objectid bị xóa; ``journal`` (HarvestJournal của lần thu thập) được xóa theo
+    để lần thu thập tới lấy lại các vùng đó. Trả về True nếu bảng bị sửa.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT c.conname, array_agg(a.attname::text)
+            FROM pg_constraint c
+            JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = ANY(c.conkey)
+            WHERE c.conrelid = 'points_of_interest'::regclass AND c.contype = 'p'
+            GROUP BY c.conname;
+        """)
+        primary = cur.fetchall()
+        if len(primary) == 1 and list(primary[0][1]) == ['objectid']:
+            conn.commit()
+            return False
+
+        cur.execute("ALTER TABLE points_of_interest ADD COLUMN IF NOT EXISTS objectid BIGINT;")
+        cur.execute("DELETE FROM points_of_interest WHERE objectid IS NULL;")
+        dropped = cur.rowcount
+        for name, _ in primary:
+            cur.execute(f"ALTER TABLE points_of_interest DROP CONSTRAINT {quote_ident(name)};")
+        cur.execute("ALTER TABLE points_of_interest ADD PRIMARY KEY (objectid);")
+    conn.commit()
+    print(f"⚠️ Đã đổi khóa chính points_of_interest sang objectid (xóa {dropped} dòng cũ).")
+    if journal is not None:
+        journal.reset()
+        print("⚠️ Nhật ký thu thập được làm mới để lấy lại các vùng đã xóa.")
+    else:
+        print("⚠️ Hãy chạy lại thu thập POI từ đầu (task2.py --restart).")
+    return True
+
+# Thuộc tính POI (theo NSW Topographic Data Dictionary) được ghi vào bảng; ngày tháng là epoch mili giây
+POI_ATTRIBUTES = ['objectid', 'poigroup', 'poitype', 'poiname', 'poilabel', 'startdate', 'enddate', 'lastupdate']
+
+# Bảng tạm nhận COPY của mỗi lô POI (theo phiên, được làm rỗng trước mỗi lô và khi commit)
+POI_STAGE_TABLE = '_poi_stage'
+
+def pois_to_frame(pois):
+    """DataFrame (thuộc tính + x/y WGS84) từ các feature ArcGIS; bỏ feature thiếu geometry hoặc objectid."""
+    rows = []
+    for poi in pois:
+        attr = poi.get('attributes', {})
+        geom = poi.get('geometry')
+        if not geom or attr.get('objectid') is None:
+            continue
+        row = {name: attr.get(name) for name in POI_ATTRIBUTES}
+        row['x'], row['y'] = geom.get('x'), geom.get('y')
+        rows.append(row)
+    frame = pd.DataFrame(rows, columns=POI_ATTRIBUTES + ['x', 'y'])
+    # ON CONFLICT DO UPDATE không được chạm một dòng hai lần trong cùng lệnh: giữ bản cuối
+    return frame.drop_duplicates(subset='objectid', keep='last')
+
+@timed('write_pois', rows=int)
+def write_pois(conn, pois, commit=True):
+    """Ghi một lô POI: COPY vào bảng tạm rồi gộp bằng một lệnh INSERT ... SELECT ... ON CONFLICT.
+
+    Geometry được dựng theo tập bằng ST_MakePoint + ST_Transform về SRID làm việc;
+    POI đã có chỉ được cập nhật khi thuộc tính hoặc vị trí thay đổi. Trả về số
+    POI đã gửi.
+    """
+    frame = pois_to_frame(pois)
+    if frame.empty:
+        return 0
+    try:
+        with conn.cursor() as cur:
+            # Một round trip (simple query): tạo bảng tạm nếu chưa có và làm rỗng nó
+            conn.execute_simple(f"""
+                CREATE TEMP TABLE IF NOT EXISTS {POI_STAGE_TABLE} (
+                    objectid BIGINT,
+                    poigroup TEXT,
+                    poitype TEXT,
+                    poiname TEXT,
+                    poilabel TEXT,
+                    startdate BIGINT,
+                    enddate BIGINT,
+                    lastupdate BIGINT,
+                    x DOUBLE PRECISION,
+                    y DOUBLE PRECISION
+                ) ON COMMIT DELETE ROWS;
+                TRUNCATE {POI_STAGE_TABLE};
+            """)
+            copy_dataframe(conn, frame, POI_STAGE_TABLE, commit=False)
+            cur.execute(f"""
+                INSERT INTO points_of_interest (
+                    objectid, poigroup, poitype, poiname, poilabel, shape, startdate, enddate, lastupdate
+                )
+                SELECT
+                    objectid, poigroup, COALESCE(poitype, 'Unknown'), COALESCE(poiname, 'Unknown'),
+                    COALESCE(poilabel, 'Unknown'),
+                    ST_Transform(ST_SetSRID(ST_MakePoint(x, y), 4326), {WORKING_SRID}),
+                    to_timestamp(startdate / 1000.0)::date,
+                    to_timestamp(enddate / 1000.0)::date,
+                    to_timestamp(lastupdate / 1000.0)::timestamp
+                FROM {POI_STAGE_TABLE}
+                ON CONFLICT (objectid) DO UPDATE SET
+                    poigroup = EXCLUDED.poigroup, poitype = EXCLUDED.poitype, poiname = EXCLUDED.poiname,
+                    poilabel = EXCLUDED.poilabel, shape = EXCLUDED.shape, startdate = EXCLUDED.startdate,
+                    enddate = EXCLUDED.enddate, lastupdate = EXCLUDED.lastupdate
+                WHERE (points_of_interest.poigroup, points_of_interest.poitype, points_of_interest.poiname,
+                       points_of_interest.poilabel, points_of_interest.shape, points_of_interest.startdate,
+                       points_of_interest.enddate, points_of_interest.lastupdate)
+                      IS DISTINCT FROM
+                      (EXCLUDED.poigroup, EXCLUDED.poitype, EXCLUDED.poiname, EXCLUDED.poilabel, EXCLUDED.shape,
+                       EXCLUDED.startdate, EXCLUDED.enddate, EXCLUDED.lastupdate);
+            """)
+        if commit:
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(frame)
 
 # Cấu hình kết nối đến PostgreSQL
 db_config = {
@@ -34,11 +161,24 @@ db_config = {
     'database': 'postgres'
 }
 
-# Kết nối đến cơ sở dữ liệu
-conn = pg8000.connect(**db_config)
 
-# Tạo bảng
-create_poi_table(conn)
+def run(conn, load_mode=None):
+    """Tạo bảng points_of_interest trên kết nối có sẵn (được pipeline.py gọi)."""
+    with stage('poi_table'):
+        create_poi_table(conn)
+        build_indexes(conn, 'points_of_interest', POI_INDEXES)
+
+
+if __name__ == '__main__':
+    # Ghi bản ghi đo của từng bước ra data/metrics.jsonl
+    configure(METRICS_PATH)
+    # Kết nối đến cơ sở dữ liệu
+    conn = count_round_trips(pg8000.connect(**db_config))
+
+    # Tạo bảng (bảng cũ khóa theo poigroup được chuyển sang khóa objectid)
+    run(conn)
+    ensure_poi_key(conn)
 
-# Đóng kết nối
-conn.close()
+    # Đóng kết nối
+    conn.close()
+    print_summary()
@@ -1,20 +1,36 @@
 import pandas as pd
 from shapely import wkb
 import pg8000
+from bulk_loader import copy_dataframe
+from incremental_loader import incremental_load
+from index_manager import build_indexes
+from metrics import METRICS_PATH, configure, count_round_trips, print_summary, stage, timed
+from shadow_loader import shadow_load
 
-# Load CSV
-df = pd.read_csv("Population.csv")
+csv_path = "Population.csv"
 
-# Clean column names
-df.columns = [col.strip() for col in df.columns]
+# Load modes: None keeps existing rows and only adds new sa2_codes, 'incremental'
+# applies changes, 'shadow' swaps in a rebuilt table, 'full' drops and reloads
+LOAD_MODES = ('full', 'incremental', 'shadow')
+
+
+@timed('read', rows=len)
+def read_population(csv_path=csv_path):
+    """Load the population CSV and add the '0_19' column."""
+    df = pd.read_csv(csv_path)
+
+    # Clean column names
+    df.columns = [col.strip() for col in df.columns]
+
+    # Create '0_19' column
+    df["0_19"] = (
+        df["0-4_people"] +
+        df["5-9_people"] +
+        df["10-14_people"] +
+        df["15-19_people"]
+    )
+    return df
 
-# Create '0_19' column
-df["0_19"] = (
-    df["0-4_people"] +
-    df["5-9_people"] +
-    df["10-14_people"] +
-    df["15-19_people"]
-)
 
 # Database configuration
 db_config = {
@@ -53,38 +69,45 @@ CREATE TABLE IF NOT EXISTS population_data (
 );
 """
 
-# Insert statement
-insert_sql = """
-INSERT INTO population_data (
-    sa2_code, sa2_name, "0-4_people", "5-9_people", "10-14_people", "15-19_people",
+# Columns to load (same order as the table)
+columns = [
+    "sa2_code", "sa2_name", "0-4_people", "5-9_people", "10-14_people", "15-19_people",
     "20-24_people", "25-29_people", "30-34_people", "35-39_people",
     "40-44_people", "45-49_people", "50-54_people", "55-59_people",
     "60-64_people", "65-69_people", "70-74_people", "75-79_people",
-    "80-84_people", "85-and-over_people", total_people, "0_19"
-)
-VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-ON CONFLICT (sa2_code) DO NOTHING;
-"""
+    "80-84_people", "85-and-over_people", "total_people", "0_19"
+]
+
 
-# Connect and execute
-conn = pg8000.connect(**db_config)
-cur = conn.cursor()
-cur.execute(create_table_sql)
-conn.commit()
+def run(conn, load_mode=None):
+    """Create population_data and load the CSV on an existing connection (called by pipeline.py)."""
+    if load_mode is not None and load_mode not in LOAD_MODES:
+        raise ValueError(f"Population does not support load mode {load_mode!r} (only {LOAD_MODES})")
+    with stage('population'):
+        cur = conn.cursor()
+        if load_mode == 'full':
+            cur.execute("DROP TABLE IF EXISTS population_data;")
+        cur.execute(create_table_sql)
+        conn.commit()
+        cur.close()
 
-for _, row in df.iterrows():
-    cur.execute(insert_sql, (
-        row["sa2_code"], row["sa2_name"], row["0-4_people"], row["5-9_people"],
-        row["10-14_people"], row["15-19_people"], row["20-24_people"],
-        row["25-29_people"], row["30-34_people"], row["35-39_people"],
-        row["40-44_people"], row["45-49_people"], row["50-54_people"],
-        row["55-59_people"], row["60-64_people"], row["65-69_people"],
-        row["70-74_people"], row["75-79_people"], row["80-84_people"],
-        row["85-and-over_people"], row["total_people"], row["0_19"]
-    ))
+        if load_mode == 'incremental':
+            incremental_load(conn, "population_data", [csv_path], read_population, columns, "sa2_code")
+        elif load_mode == 'shadow':
+            shadow_load(conn, "population_data", read_population(), columns, key="sa2_code")
+        else:
+            # Bulk load with COPY; rows whose sa2_code already exists are skipped
+            copy_dataframe(conn, read_population(), "population_data", columns, conflict_key="sa2_code")
+        # Refresh planner statistics (sa2_code is already indexed by the primary key)
+        build_indexes(conn, "population_data", [], concurrently=load_mode != 'full')
+        print("✅ Population data inserted into PostgreSQL with '0_19' column.")
 
-conn.commit()
-cur.close()
-conn.close()
 
-print("✅ Population data inserted into PostgreSQL with '0_19' column.")
+if __name__ == '__main__':
+    # Write the per-stage metrics to data/metrics.jsonl
+    configure(METRICS_PATH)
+    # Connect and execute
+    conn = count_round_trips(pg8000.connect(**db_config))
+    run(conn)
+    conn.close()
+    print_summary()
@@ -1,5 +1,11 @@
 import pg8000
-import geopandas as gpd
+from utils import read_shapefile, shapefile_sources
+from bulk_loader import WORKING_SRID, copy_geodataframe, geodataframe_to_frame, to_working_crs
+from incremental_loader import ensure_geometry_column, incremental_load
+from geometry_resolution import PRECISION_GRID, SIMPLIFY_TOLERANCE, ensure_resolution_columns
+from shadow_loader import shadow_load
+from index_manager import build_indexes
+from metrics import METRICS_PATH, configure, count_round_trips, print_summary, stage
 
 class SA2DataProcessor:
     def __init__(self, db_config, shapefile_path):
@@ -9,40 +15,55 @@ class SA2DataProcessor:
     def connect(self):
         """Kết nối đến PostgreSQL và trả về đối tượng kết nối."""
         try:
-            conn = pg8000.connect(**self.db_config)
+            conn = count_round_trips(pg8000.connect(**self.db_config))
             print("✅ Kết nối đến PostgreSQL thành công!")
             return conn
         except Exception as e:
             print(f"❌ Lỗi kết nối: {e}")
             return None
 
-    def create_table(self, conn):
-        """Tạo bảng SA2 nếu chưa tồn tại."""
+    def create_table(self, conn, drop=True):
+        """Tạo bảng SA2 nếu chưa tồn tại (drop=False giữ lại bảng cũ cho chế độ nạp tăng dần)."""
         drop_table_query = "DROP TABLE IF EXISTS SA2;"
-        create_table_query = """
+        create_table_query = f"""
         CREATE TABLE IF NOT EXISTS SA2 (
             sa2_code21 VARCHAR(15) PRIMARY KEY,
             sa2_name21 VARCHAR(255),
             loci_uri21 TEXT,
-            geometry GEOMETRY(MultiPolygon, 4326)
+            geometry GEOMETRY(MultiPolygon, {WORKING_SRID})
         );
         """
 
         try:
             with conn.cursor() as cur:
-                cur.execute(drop_table_query)
+                if drop:
+                    cur.execute(drop_table_query)
                 cur.execute(create_table_query)
                 conn.commit()
-                print("✅ Tạo bảng SA2 thành công!")
+            # Bảng tạo trước khi chuẩn hóa CRS (SRID 4326) được chuyển sang SRID làm việc
+            ensure_geometry_column(conn, 'SA2', 'geometry', 'MultiPolygon', WORKING_SRID)
+            # Bản đơn giản hóa và vùng lõi (GENERATED) cho phép join thô trước, chính xác sau
+            ensure_resolution_columns(conn, 'SA2', 'geometry', self.simplify_tolerance, self.precision_grid)
+            print("✅ Tạo bảng SA2 thành công!")
         except Exception as e:
             print(f"❌ Lỗi khi tạo bảng: {e}")
             conn.rollback()
+            raise
 
-    def insert_data(self, conn, gdf):
-        """Chèn dữ liệu từ GeoDataFrame vào bảng PostgreSQL với PostGIS."""
-        insert_query = """
+    def insert_data(self, conn, gdf, geometry_mode='wkb'):
+        """Chèn dữ liệu từ GeoDataFrame vào bảng PostgreSQL với PostGIS.
+
+        geometry_mode='wkb' (mặc định): COPY geometry dạng hex EWKB, chuyển
+        Polygon -> MultiPolygon bằng shapely vectorized.
+        geometry_mode='wkt': cách cũ, INSERT từng dòng với ST_GeomFromText.
+        """
+        if geometry_mode == 'wkb':
+            return self.insert_data_wkb(conn, gdf)
+
+        gdf = to_working_crs(gdf)
+        insert_query = f"""
         INSERT INTO SA2 (sa2_code21, sa2_name21, loci_uri21, geometry)
-        VALUES (%s, %s, %s, ST_GeomFromText(%s, 4326))
+        VALUES (%s, %s, %s, ST_GeomFromText(%s, {WORKING_SRID}))
         ON CONFLICT (sa2_code21) DO NOTHING;
         """
         try:
@@ -71,14 +92,72 @@ class SA2DataProcessor:
         except Exception as e:
             print(f"❌ Lỗi khi chèn dữ liệu: {e}")
             conn.rollback()
+            raise
+
+    # Các cột của bảng SA2 theo đúng thứ tự
+    columns = ['sa2_code21', 'sa2_name21', 'loci_uri21', 'geometry']
+
+    # Index tạo sau khi nạp (sa2_code21 đã có index btree của khóa chính)
+    indexes = [('gist', 'geometry'), ('gist', 'geometry_simple')]
+
+    # Sai số của cột geometry_simple (đơn vị độ của SRID làm việc)
+    simplify_tolerance = SIMPLIFY_TOLERANCE
+    precision_grid = PRECISION_GRID
+
+    def to_table_frame(self, gdf):
+        """GeoDataFrame với tên cột của bảng SA2, chỉ giữ các geometry (Multi)Polygon."""
+        # Bỏ các bản ghi không có geometry hoặc không phải (Multi)Polygon
+        gdf = gdf[gdf.geometry.notna() & gdf.geom_type.isin(['Polygon', 'MultiPolygon'])]
+        gdf = gdf.rename(columns={
+            'SA2_CODE21': 'sa2_code21',
+            'SA2_NAME21': 'sa2_name21',
+            'LOCI_URI21': 'loci_uri21',
+        })
+        gdf['sa2_code21'] = gdf['sa2_code21'].astype(str)
+        return gdf
+
+    def insert_data_wkb(self, conn, gdf):
+        """Chèn dữ liệu bằng COPY, geometry được serialize hàng loạt sang EWKB."""
+        try:
+            copy_geodataframe(conn, self.to_table_frame(gdf), 'SA2', self.columns, srid=WORKING_SRID,
+                              conflict_key='sa2_code21')
+            print("✅ Chèn dữ liệu thành công!")
+        except Exception as e:
+            print(f"❌ Lỗi khi chèn dữ liệu: {e}")
+            raise
+
+    def load_incremental(self, conn):
+        """Nạp tăng dần: bỏ qua nếu Shapefile không đổi, ngược lại chỉ thêm/sửa/xóa các SA2 thay đổi."""
+        self.create_table(conn, drop=False)
+        try:
+            incremental_load(
+                conn, 'SA2', shapefile_sources(self.shapefile_path),
+                lambda: geodataframe_to_frame(self.to_table_frame(self.process_data()), self.columns, srid=WORKING_SRID),
+                self.columns, 'sa2_code21',
+            )
+        except Exception as e:
+            print(f"❌ Lỗi khi nạp tăng dần: {e}")
+            raise
 
+    def load_shadow(self, conn):
+        """Nạp lại toàn bộ vào bảng shadow UNLOGGED rồi đổi bảng nguyên tử (người đọc không thấy bảng rỗng)."""
+        self.create_table(conn, drop=False)
+        try:
+            frame = geodataframe_to_frame(self.to_table_frame(self.process_data()), self.columns, srid=WORKING_SRID)
+            shadow_load(conn, 'SA2', frame, self.columns, key='sa2_code21')
+        except Exception as e:
+            print(f"❌ Lỗi khi nạp bảng shadow: {e}")
+            raise
 
-    def process_data(self):
-        """Quy trình xử lý dữ liệu từ Shapefile."""
+    def process_data(self, where=None, bbox=None, mask=None, columns=None, filters=None):
+        """Quy trình xử lý dữ liệu từ Shapefile (qua cache GeoParquet, bộ lọc và cột được đẩy xuống bộ đọc)."""
         print(f"📂 Đang xử lý file {self.shapefile_path}")
-        gdf = gpd.read_file(self.shapefile_path, engine="pyogrio")
-        print(f"✅ Đọc file Shapefile {self.shapefile_path} thành công!")
-        print(f"✅ Đã tải dữ liệu Shapefile SA2:\n{gdf.head()}")
+        if columns is None:
+            columns = ['SA2_CODE21', 'SA2_NAME21', 'LOCI_URI21']
+        gdf = read_shapefile(self.shapefile_path, where=where, bbox=bbox, mask=mask, columns=columns,
+                             filters=filters)
+        if gdf is not None:
+            print(f"✅ Đã tải dữ liệu Shapefile SA2:\n{gdf.head()}")
         return gdf
 
 # Cấu hình database
@@ -92,18 +171,45 @@ db_config = {
 
 shapefile_path = 'data/SA2_2021_AUST_SHP_GDA2020/SA2_2021_AUST_GDA2020.shp'
 
-# Khởi tạo đối tượng xử lý dữ liệu
-processor = SA2DataProcessor(db_config, shapefile_path)
+# Chế độ nạp: 'incremental' (chỉ áp dụng thay đổi), 'shadow' (nạp bảng phụ rồi đổi bảng)
+# hoặc 'full' (xóa bảng và nạp lại)
+LOAD_MODES = ('full', 'incremental', 'shadow')
+load_mode = 'full'
+
+
+def run(conn, load_mode=load_mode):
+    """Nạp bảng SA2 trên kết nối có sẵn (được pipeline.py gọi)."""
+    if load_mode not in LOAD_MODES:
+        raise ValueError(f"SA2 không hỗ trợ chế độ nạp {load_mode!r} (chỉ {LOAD_MODES})")
+    with stage('sa2'):
+        processor = SA2DataProcessor(db_config, shapefile_path)
+        if load_mode == 'incremental':
+            processor.load_incremental(conn)
+        elif load_mode == 'shadow':
+            processor.load_shadow(conn)
+        else:
+            # Xử lý dữ liệu từ Shapefile
+            gdf = processor.process_data()
+
+            if gdf is None:
+                raise RuntimeError(f"Không đọc được Shapefile {shapefile_path}")
+
+            # Tạo bảng và chèn dữ liệu
+            processor.create_table(conn)
+            processor.insert_data(conn, gdf)
+
+        # Bảng vừa tạo lại (full) chưa có người đọc: tạo index thường và CLUSTER theo GiST
+        build_indexes(conn, 'SA2', processor.indexes, concurrently=load_mode != 'full', cluster=load_mode == 'full')
 
-# Kết nối đến database
-conn = processor.connect()
-if conn:
-    # Xử lý dữ liệu từ Shapefile
-    gdf = processor.process_data()
 
-    # Tạo bảng và chèn dữ liệu
-    processor.create_table(conn)
-    processor.insert_data(conn, gdf)
+if __name__ == '__main__':
+    # Ghi bản ghi đo của từng bước ra data/metrics.jsonl
+    configure(METRICS_PATH)
+    # Kết nối đến database
+    conn = SA2DataProcessor(db_config, shapefile_path).connect()
+    if conn:
+        run(conn)
 
-    # Đóng kết nối
-    conn.close()
+        # Đóng kết nối
+        conn.close()
+        print_summary()
@@ -1,5 +1,14 @@
 import pg8000
 import pandas as pd
+import geopandas as gpd
+from bulk_loader import WORKING_SRID, copy_dataframe, geometry_to_ewkb
+from incremental_loader import ensure_geometry_column, incremental_load
+from shadow_loader import shadow_load
+from index_manager import build_indexes
+from metrics import METRICS_PATH, configure, count_round_trips, print_summary, stage, timed
+
+# SRID của toạ độ stop_lat/stop_lon trong Stops.txt (GTFS dùng WGS84)
+STOPS_SOURCE_SRID = 4326
 
 class StopsDataProcessor:
     def __init__(self, db_config, txt_path):
@@ -9,16 +18,16 @@ class StopsDataProcessor:
     def connect(self):
         """Kết nối đến PostgreSQL."""
         try:
-            conn = pg8000.connect(**self.db_config)
+            conn = count_round_trips(pg8000.connect(**self.db_config))
             print("✅ Kết nối đến PostgreSQL thành công!")
             return conn
         except Exception as e:
             print(f"❌ Lỗi kết nối: {e}")
 
-    def create_table(self, conn):
-        """Tạo bảng stops nếu chưa tồn tại."""
+    def create_table(self, conn, drop=True):
+        """Tạo bảng stops nếu chưa tồn tại (drop=False giữ lại bảng cũ cho chế độ nạp tăng dần)."""
         drop_table_query = "DROP TABLE IF EXISTS stops;"
-        create_table_query = """
+        create_table_query = f"""
         CREATE TABLE IF NOT EXISTS stops (
             stop_id VARCHAR(50) PRIMARY KEY,
             stop_code VARCHAR(50),
@@ -28,21 +37,27 @@ class StopsDataProcessor:
             location_type VARCHAR(50),
             parent_station VARCHAR(50),
             wheelchair_boarding VARCHAR(50),
-            platform_code VARCHAR(50)
+            platform_code VARCHAR(50),
+            geom GEOMETRY(Point, {WORKING_SRID})
         );
         """
         with conn.cursor() as cur:
             try:
-                cur.execute(drop_table_query)
-                conn.commit()
-                print("✅ Xóa bảng 'stops' cũ thành công!")
+                if drop:
+                    cur.execute(drop_table_query)
+                    conn.commit()
+                    print("✅ Xóa bảng 'stops' cũ thành công!")
                 cur.execute(create_table_query)
                 conn.commit()
+                # Bảng tạo trước khi có cột geom được thêm cột và nạp lại toàn bộ
+                ensure_geometry_column(conn, 'stops', 'geom', 'Point', WORKING_SRID)
                 print("✅ Tạo bảng 'stops' thành công!")
             except Exception as e:
                 print(f"❌ Lỗi khi tạo bảng: {e}")
                 conn.rollback()
+                raise
 
+    @timed('read', rows=len)
     def read_data(self):
         """Đọc dữ liệu từ file Stops.txt."""
         try:
@@ -52,6 +67,7 @@ class StopsDataProcessor:
             return df
         except Exception as e:
             print(f"❌ Lỗi khi đọc file: {e}")
+            raise
 
     def normalize_data(self, df):
         """Chuẩn hóa dữ liệu từ file Stops.txt."""
@@ -65,33 +81,59 @@ class StopsDataProcessor:
         
         return df
 
+    # Các cột của bảng stops theo đúng thứ tự
+    columns = [
+        'stop_id', 'stop_code', 'stop_name', 'stop_lat', 'stop_lon',
+        'location_type', 'parent_station', 'wheelchair_boarding', 'platform_code', 'geom'
+    ]
+
+    # Index tạo sau khi nạp (stop_id đã có index btree của khóa chính)
+    indexes = [('gist', 'geom')]
+
+    def to_table_frame(self, df):
+        """DataFrame với đúng các cột/kiểu của bảng stops."""
+        df = df.copy()
+        for col in ['stop_lat', 'stop_lon']:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+
+        # Toạ độ GTFS là WGS84: dựng điểm và chiếu về SRID làm việc một lần lúc nạp
+        points = gpd.GeoSeries(gpd.points_from_xy(df['stop_lon'], df['stop_lat']), index=df.index,
+                               crs=STOPS_SOURCE_SRID).to_crs(epsg=WORKING_SRID)
+        points[df['stop_lat'].isna() | df['stop_lon'].isna()] = None
+        df['geom'] = geometry_to_ewkb(points.values, WORKING_SRID, promote_multi=False)
+        return df[self.columns]
+
     def insert_data(self, conn, df):
-        """Chèn dữ liệu từ DataFrame vào bảng stops."""
-        insert_query = """
-        INSERT INTO stops (stop_id, stop_code, stop_name, stop_lat, stop_lon, location_type, parent_station, wheelchair_boarding, platform_code)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ON CONFLICT (stop_id) DO NOTHING;
-        """
-        with conn.cursor() as cur:
-            try:
-                for _, row in df.iterrows():
-                    data = (
-                        row['stop_id'],
-                        row['stop_code'],
-                        row['stop_name'],
-                        float(row['stop_lat']) if row['stop_lat'] else None,
-                        float(row['stop_lon']) if row['stop_lon'] else None,
-                        row['location_type'],
-                        row['parent_station'],
-                        row['wheelchair_boarding'],
-                        row['platform_code']
-                    )
-                    cur.execute(insert_query, data)
-                conn.commit()
-                print("✅ Đã chèn dữ liệu vào bảng 'stops' thành công!")
-            except Exception as e:
-                print(f"❌ Lỗi khi chèn dữ liệu: {e}")
-                conn.rollback()
+        """Chèn dữ liệu từ DataFrame vào bảng stops bằng COPY."""
+        try:
+            copy_dataframe(conn, self.to_table_frame(df), 'stops', self.columns, conflict_key='stop_id')
+            print("✅ Đã chèn dữ liệu vào bảng 'stops' thành công!")
+        except Exception as e:
+            print(f"❌ Lỗi khi chèn dữ liệu: {e}")
+            raise
+
+    def load_incremental(self, conn):
+        """Nạp tăng dần: bỏ qua nếu Stops.txt không đổi, ngược lại chỉ thêm/sửa/xóa các dòng thay đổi."""
+        self.create_table(conn, drop=False)
+        try:
+            incremental_load(
+                conn, 'stops', [self.txt_path],
+                lambda: self.to_table_frame(self.normalize_data(self.read_data())),
+                self.columns, 'stop_id',
+            )
+        except Exception as e:
+            print(f"❌ Lỗi khi nạp tăng dần: {e}")
+            raise
+
+    def load_shadow(self, conn):
+        """Nạp lại toàn bộ vào bảng shadow UNLOGGED rồi đổi bảng nguyên tử (người đọc không thấy bảng rỗng)."""
+        self.create_table(conn, drop=False)
+        try:
+            df = self.to_table_frame(self.normalize_data(self.read_data()))
+            shadow_load(conn, 'stops', df, self.columns, key='stop_id')
+        except Exception as e:
+            print(f"❌ Lỗi khi nạp bảng shadow: {e}")
+            raise
 
 # Cấu hình kết nối đến PostgreSQL
 db_config = {
@@ -105,15 +147,37 @@ db_config = {
 # Đường dẫn đến file Stops.txt
 txt_path = 'data/Stops.txt'
 
-# Khởi tạo đối tượng xử lý dữ liệu
-processor = StopsDataProcessor(db_config, txt_path)
-
-# Thực thi các bước xử lý dữ liệu
-conn = processor.connect()
-if conn:
-    processor.create_table(conn)  # Tạo bảng
-    df = processor.read_data()    # Đọc dữ liệu từ file
-    if df is not None:
-        df = processor.normalize_data(df)  # Chuẩn hóa dữ liệu
-        processor.insert_data(conn, df)    # Chèn dữ liệu vào bảng
-    conn.close()
+# Chế độ nạp: 'incremental' (chỉ áp dụng thay đổi), 'shadow' (nạp bảng phụ rồi đổi bảng)
+# hoặc 'full' (xóa bảng và nạp lại)
+LOAD_MODES = ('full', 'incremental', 'shadow')
+load_mode = 'full'
+
+
+def run(conn, load_mode=load_mode):
+    """Nạp bảng Stops trên kết nối có sẵn (được pipeline.py gọi)."""
+    if load_mode not in LOAD_MODES:
+        raise ValueError(f"Stops không hỗ trợ chế độ nạp {load_mode!r} (chỉ {LOAD_MODES})")
+    with stage('stops'):
+        processor = StopsDataProcessor(db_config, txt_path)
+        if load_mode == 'incremental':
+            processor.load_incremental(conn)
+        elif load_mode == 'shadow':
+            processor.load_shadow(conn)
+        else:
+            processor.create_table(conn)  # Tạo bảng
+            df = processor.read_data()    # Đọc dữ liệu từ file
+            if df is not None:
+                df = processor.normalize_data(df)  # Chuẩn hóa dữ liệu
+                processor.insert_data(conn, df)    # Chèn dữ liệu vào bảng
+        build_indexes(conn, 'stops', processor.indexes, concurrently=load_mode != 'full')
+
+
+if __name__ == '__main__':
+    # Ghi bản ghi đo của từng bước ra data/metrics.jsonl
+    configure(METRICS_PATH)
+    # Thực thi các bước xử lý dữ liệu
+    conn = StopsDataProcessor(db_config, txt_path).connect()
+    if conn:
+        run(conn)
+        conn.close()
+        print_summary()
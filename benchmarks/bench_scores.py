@@ -0,0 +1,103 @@
+"""So sánh calculate_well_resourced_score (vectorized) với vòng lặp cũ theo từng SA2.
+
+Chạy từ thư mục gốc của repo:
+    python benchmarks/bench_scores.py --sa2 2500 --stops 100000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from task3_4 import YOUNG_COLUMNS, calculate_score, calculate_well_resourced_score  # noqa: E402
+
+
+# Phiên bản cũ (lọc boolean theo từng SA2), giữ lại để đối chiếu kết quả và đo tốc độ
+def legacy_well_resourced_score(df_business, df_population, df_stops, df_schools, df_poi):
+    def z_score(value, mean, std):
+        if std == 0:
+            return 0
+        return (value - mean) / std
+
+    sa2_codes = pd.concat([df_business['sa2_code'], df_population['sa2_code']]).drop_duplicates().tolist()
+    business_list, stops_list, school_list, poi_list = [], [], [], []
+    for sa2 in sa2_codes:
+        pop = df_population[df_population['sa2_code'] == sa2]['total_people'].values
+        if len(pop) == 0 or pop[0] < 100:
+            for values in (business_list, stops_list, school_list, poi_list):
+                values.append(np.nan)
+            continue
+        businesses = df_business[df_business['sa2_code'] == sa2]['total_businesses'].sum()
+        young_pop = df_population[df_population['sa2_code'] == sa2][YOUNG_COLUMNS].sum(axis=1).values
+        young_pop = young_pop[0] if len(young_pop) > 0 else 0
+        if young_pop == 0:
+            school = 0
+        else:
+            school = df_schools[df_schools['sa2_code'] == sa2].shape[0] / (young_pop / 1000)
+        business_list.append(businesses / (pop[0] / 1000))
+        stops_list.append(df_stops[df_stops['sa2_code'] == sa2].shape[0])
+        school_list.append(school)
+        poi_list.append(df_poi[df_poi['sa2_code'] == sa2].shape[0])
+
+    arrays = [np.array(values, dtype=np.float64) for values in (business_list, stops_list, school_list, poi_list)]
+    stats = [(np.nanmean(arr), np.nanstd(arr)) for arr in arrays]
+    result = []
+    for i, sa2 in enumerate(sa2_codes):
+        if any(np.isnan(arr[i]) for arr in arrays):
+            result.append((sa2, None))
+            continue
+        z = [z_score(arr[i], mean, std) for arr, (mean, std) in zip(arrays, stats)]
+        result.append((sa2, calculate_score(z[0] + z[1] + z[2] + z[3])))
+    return pd.DataFrame(result, columns=['sa2_code', 'score'])
+
+
+# Sinh dữ liệu giả lập có cấu trúc giống các file CSV thật
+def make_inputs(n_sa2, n_stops, n_schools, n_poi, seed=0):
+    rng = np.random.default_rng(seed)
+    codes = 100000000 + np.arange(n_sa2)
+    population = pd.DataFrame({'sa2_code': codes})
+    for col in YOUNG_COLUMNS:
+        population[col] = rng.integers(0, 2000, n_sa2)
+    population['total_people'] = population[YOUNG_COLUMNS].sum(axis=1) * 4
+    population.loc[rng.random(n_sa2) < 0.05, 'total_people'] = rng.integers(0, 100)
+    business = pd.DataFrame({
+        'sa2_code': rng.choice(codes, n_sa2 * 3),
+        'total_businesses': rng.integers(0, 500, n_sa2 * 3),
+    })
+    stops = pd.DataFrame({'sa2_code': rng.choice(codes, n_stops)})
+    schools = pd.DataFrame({'sa2_code': rng.choice(codes, n_schools)})
+    poi = pd.DataFrame({'sa2_code': rng.choice(codes, n_poi)})
+    return business, population, stops, schools, poi
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sa2', type=int, default=2500)
+    parser.add_argument('--stops', type=int, default=100000)
+    parser.add_argument('--schools', type=int, default=3000)
+    parser.add_argument('--poi', type=int, default=50000)
+    args = parser.parse_args()
+
+    inputs = make_inputs(args.sa2, args.stops, args.schools, args.poi)
+
+    start = time.perf_counter()
+    expected = legacy_well_resourced_score(*inputs)
+    legacy_time = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        actual = calculate_well_resourced_score(*inputs, output_path=os.path.join(tmp, 'scores.csv'))
+        vectorized_time = time.perf_counter() - start
+
+    assert expected.to_csv(index=False) == actual.to_csv(index=False), 'Kết quả khác với vòng lặp cũ!'
+    print(f'⏱️ Vòng lặp cũ: {legacy_time:.3f}s | Vectorized: {vectorized_time:.3f}s '
+          f'| Nhanh hơn {legacy_time / vectorized_time:.1f} lần')
+
+
+if __name__ == '__main__':
+    main()
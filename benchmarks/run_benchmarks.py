@@ -0,0 +1,301 @@
+"""Bộ benchmark trên dữ liệu giả lập: loader (PostgreSQL/PostGIS), gán sa2_code, tính điểm và task3.sql.
+
+Kết quả được ghi ra JSON (mỗi phép đo: name, scale, seconds, rows, rows_per_sec,
+status) để so sánh giữa các phiên bản. Chạy từ thư mục gốc của repo:
+    python benchmarks/run_benchmarks.py --scale 1 10 --output bench_results.json
+    python benchmarks/run_benchmarks.py --scale 1 --db --compare bench_results.json
+
+--db chạy các loader ở chế độ 'full' (xóa và tạo lại bảng): chỉ dùng với
+database thử nghiệm.
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import shapely
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import Businesses  # noqa: E402
+import Catchments  # noqa: E402
+import Income  # noqa: E402
+import POI  # noqa: E402
+import Population  # noqa: E402
+import SA2  # noqa: E402
+import Stops  # noqa: E402
+import catchment_overlay  # noqa: E402
+import metrics  # noqa: E402
+import scoring  # noqa: E402
+from bulk_loader import WORKING_SRID, geodataframe_to_frame  # noqa: E402
+from geometry_resolution import SIMPLIFY_TOLERANCE  # noqa: E402
+from sa2_locator import SA2Locator  # noqa: E402
+from synthetic import PATHS, generate_dataset  # noqa: E402
+from task3_4 import (  # noqa: E402
+    add_sa2_code_from_coords, add_sa2_code_from_wkt, calculate_well_resourced_score, overlay_sa2_from_wkt,
+)
+from utils import read_shapefile  # noqa: E402
+
+# Chậm hơn baseline quá tỉ lệ này thì bị coi là regression
+REGRESSION_THRESHOLD = 0.2
+
+# Các loader: (tên benchmark, hàm run của module, bảng đích, khóa trong manifest)
+LOADERS = [
+    ('load_sa2', SA2.run, 'sa2', 'sa2'),
+    ('load_stops', Stops.run, 'stops', 'stops'),
+    ('load_businesses', Businesses.run, 'businesses', 'businesses'),
+    ('load_income', Income.run, 'income', 'income'),
+    ('load_population', Population.run, 'population_data', 'population'),
+    ('load_catchments', Catchments.run, 'schools', 'catchments'),
+]
+
+
+@contextlib.contextmanager
+def working_directory(path):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+class BenchmarkRunner:
+    """Đo thời gian từng phép đo và gom kết quả (một dict mỗi phép đo)."""
+
+    def __init__(self, scale, verbose=False, repeat=1):
+        self.scale = scale
+        self.verbose = verbose
+        self.repeat = repeat
+        self.results = []
+
+    def measure(self, name, rows, func, *args, repeat=1, **kwargs):
+        """Chạy func ``repeat`` lần, ghi thời gian nhỏ nhất; lỗi được ghi vào kết quả thay vì dừng cả bộ benchmark."""
+        result = {'name': name, 'scale': self.scale, 'rows': rows}
+        runs = []
+        value = None
+        try:
+            with contextlib.ExitStack() as stack:
+                if not self.verbose:
+                    stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, 'w'))))
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    value = func(*args, **kwargs)
+                    runs.append(time.perf_counter() - start)
+            result['status'] = 'ok'
+        except Exception as e:
+            runs.append(time.perf_counter() - start)
+            result['status'] = 'failed'
+            result['error'] = f"{type(e).__name__}: {e}"
+        result['seconds'] = round(min(runs), 6)
+        result['runs'] = [round(r, 6) for r in runs]
+        result['rows_per_sec'] = round(rows / result['seconds'], 1) if rows and result['seconds'] > 0 else None
+        self.results.append(result)
+        mark = '✅' if result['status'] == 'ok' else '❌'
+        print(f"{mark} [{self.scale}×] {name}: {result['seconds']:.3f}s ({rows} dòng)"
+              + (f" — {result['error']}" if 'error' in result else ''))
+        return value
+
+
+def run_python_benchmarks(runner, manifest, workers):
+    """Các phép đo không cần database: đọc shapefile, SA2Locator, gán sa2_code, tính điểm.
+
+    Mỗi phép đo chạy runner.repeat lần và lấy thời gian nhỏ nhất.
+    """
+    rows = manifest['rows']
+    repeat = runner.repeat
+
+    sa2 = runner.measure('read_sa2_shapefile', rows['sa2'], read_shapefile, PATHS['sa2'],
+                         use_cache=False, repeat=repeat)
+    read_shapefile(PATHS['sa2'], use_cache=True)  # dựng cache GeoParquet
+    runner.measure('read_sa2_shapefile_cached', rows['sa2'], read_shapefile, PATHS['sa2'],
+                   use_cache=True, repeat=repeat)
+    runner.measure('sa2_to_ewkb_frame', rows['sa2'], geodataframe_to_frame,
+                   sa2.rename(columns=str.lower), ['sa2_code21', 'sa2_name21', 'loci_uri21', 'geometry'],
+                   repeat=repeat)
+
+    sa2 = sa2.rename(columns={'SA2_CODE21': 'sa2_code'})
+    locator = runner.measure('sa2_locator_build', rows['sa2'], SA2Locator.from_geodataframe, sa2, 'sa2_code',
+                             repeat=repeat)
+
+    stops = pd.read_csv(PATHS['stops'])
+    stops = runner.measure('add_sa2_code_from_coords', rows['stops'],
+                           add_sa2_code_from_coords, stops, 'stop_lat', 'stop_lon', locator, repeat=repeat)
+    runner.measure('add_sa2_code_from_coords_parallel', rows['stops'],
+                   add_sa2_code_from_coords, stops, 'stop_lat', 'stop_lon', locator, workers=workers, repeat=repeat)
+    multires = runner.measure('sa2_locator_build_multires', rows['sa2'], SA2Locator.from_geodataframe, sa2, 'sa2_code',
+                              tolerance=SIMPLIFY_TOLERANCE, repeat=repeat)
+    runner.measure('add_sa2_code_from_coords_multires', rows['stops'],
+                   add_sa2_code_from_coords, stops, 'stop_lat', 'stop_lon', multires, repeat=repeat)
+
+    runner.measure('read_catchments_sequential', rows['catchments'],
+                   Catchments.read_and_combine_shapefiles, attribute_first=False, repeat=repeat)
+    catchments = runner.measure('read_catchments_attribute_first', rows['catchments'],
+                                Catchments.read_and_combine_shapefiles, attribute_first=True, repeat=repeat)
+    catchments = catchments.to_crs(epsg=WORKING_SRID)
+    schools = pd.DataFrame({'geometry': shapely.to_wkt(catchments.geometry.values)})
+    runner.measure('add_sa2_code_from_wkt_schools', len(schools),
+                   add_sa2_code_from_wkt, schools, 'geometry', locator, repeat=repeat)
+    runner.measure('overlay_sa2_schools', len(schools),
+                   overlay_sa2_from_wkt, schools, 'geometry', locator, repeat=repeat)
+    schools = runner.measure('overlay_sa2_schools_multires', len(schools),
+                             overlay_sa2_from_wkt, schools, 'geometry', multires, repeat=repeat)
+
+    with open(PATHS['poi'], encoding='utf-8') as f:
+        features = json.load(f)['features']
+    xy = np.array([[f['geometry']['x'], f['geometry']['y']] for f in features])
+    poi = pd.DataFrame({'shape_wkt': shapely.to_wkt(shapely.points(xy))})
+    poi = runner.measure('add_sa2_code_from_wkt_poi', rows['poi'],
+                         add_sa2_code_from_wkt, poi, 'shape_wkt', locator, workers=workers, repeat=repeat)
+
+    business = pd.read_csv(PATHS['businesses'], dtype={'sa2_code': str})
+    population = pd.read_csv(PATHS['population'], dtype={'sa2_code': str})
+    if all(df is not None for df in (stops, schools, poi)):
+        runner.measure('calculate_well_resourced_score', rows['sa2'], calculate_well_resourced_score,
+                       business, population, stops, schools, poi,
+                       output_path='well_resourced_scores.csv', repeat=repeat)
+
+
+def table_count(conn, table):
+    """Số dòng của bảng (0 nếu bảng không tồn tại, ví dụ loader bị lỗi)."""
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT COUNT(*) FROM {table};")
+            count = cur.fetchone()[0]
+        conn.commit()
+        return count
+    except Exception:
+        conn.rollback()
+        return 0
+
+
+def run_db_benchmarks(runner, manifest, db_config):
+    """Nạp từng bảng bằng loader thật (chế độ 'full'), rồi đo task3.sql (scoring) và truy vấn đọc điểm."""
+    import pg8000
+
+    conn = pg8000.connect(**db_config)
+    try:
+        for name, run, table, key in LOADERS:
+            with conn.cursor() as cur:
+                cur.execute(f"DROP TABLE IF EXISTS {table} CASCADE;")
+            conn.commit()
+            runner.measure(name, manifest['rows'][key], run, conn, 'full')
+            runner.results[-1]['rows_loaded'] = table_count(conn, table)
+            if not runner.results[-1]['rows_loaded']:
+                runner.results[-1]['status'] = 'failed'
+
+        POI.run(conn)
+        with open(PATHS['poi'], encoding='utf-8') as f:
+            features = json.load(f)['features']
+        runner.measure('write_pois', len(features), POI.write_pois, conn, features)
+        runner.results[-1]['rows_loaded'] = table_count(conn, 'points_of_interest')
+        runner.measure('catchment_overlay', manifest['rows']['catchments'], catchment_overlay.run, conn, 'full')
+        runner.measure('scoring', manifest['rows']['sa2'], scoring.run, conn)
+        with conn.cursor() as cur:
+            runner.measure('read_scores', manifest['rows']['sa2'], cur.execute,
+                           "SELECT * FROM sa2_scores ORDER BY final_score DESC;", repeat=runner.repeat)
+            cur.fetchall()
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, threshold=REGRESSION_THRESHOLD):
+    """In bảng so sánh với file kết quả cũ; trả về danh sách phép đo bị chậm đi quá threshold."""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {(r['name'], r['scale']): r for r in json.load(f)['results'] if r['status'] == 'ok'}
+    regressions = []
+    print(f"\n{'Phép đo':<36} {'Scale':>6} {'Cũ (s)':>10} {'Mới (s)':>10} {'Tỉ lệ':>7}")
+    for result in results:
+        old = baseline.get((result['name'], result['scale']))
+        if old is None or result['status'] != 'ok':
+            continue
+        ratio = result['seconds'] / old['seconds'] if old['seconds'] else float('inf')
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = ' ⚠️'
+            regressions.append(result['name'])
+        print(f"{result['name']:<36} {result['scale']:>6} {old['seconds']:>10.3f} {result['seconds']:>10.3f} "
+              f"{ratio:>6.2f}x{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=float, nargs='+', default=[1.0], help="Các hệ số quy mô (1, 10, 100...)")
+    parser.add_argument('--data-dir', default='bench_data', help="Thư mục chứa dữ liệu giả lập (mỗi scale một thư mục con)")
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help="File kết quả cũ để so sánh")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--repeat', type=int, default=3, help="Số lần chạy mỗi phép đo không cần database")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true', help="Hiện output của các loader")
+    parser.add_argument('--db', action='store_true', help="Chạy cả benchmark loader/task3.sql trên PostgreSQL")
+    parser.add_argument('--db-host', default='localhost')
+    parser.add_argument('--db-port', type=int, default=5432)
+    parser.add_argument('--db-user', default='postgres')
+    parser.add_argument('--db-password', default='1234')
+    parser.add_argument('--db-name', default='postgres')
+    args = parser.parse_args()
+    # Không ghi bản ghi đo của từng bước vào thư mục dữ liệu giả lập
+    metrics.configure(None)
+
+    db_config = {
+        'user': args.db_user,
+        'password': args.db_password,
+        'host': args.db_host,
+        'port': args.db_port,
+        'database': args.db_name,
+    }
+
+    results = []
+    for scale in args.scale:
+        data_dir = os.path.abspath(os.path.join(args.data_dir, f"x{scale:g}"))
+        manifest = generate_dataset(data_dir, scale, args.seed)
+        runner = BenchmarkRunner(scale, args.verbose, args.repeat)
+        # Các loader đọc đường dẫn tương đối (data/...): chạy trong thư mục dữ liệu giả lập
+        with working_directory(data_dir):
+            if args.db:
+                run_db_benchmarks(runner, manifest, db_config)
+            run_python_benchmarks(runner, manifest, args.workers)
+        results.extend(runner.results)
+
+    report = {
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"📦 Đã ghi {len(results)} kết quả vào {args.output}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions:
+            print(f"❌ Chậm hơn baseline quá {args.threshold:.0%}: {regressions}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,293 @@
+"""Sinh bộ dữ liệu giả lập (SA2, Stops, Businesses, Population, Income, catchments, POI) theo hệ số quy mô.
+
+Các file được ghi đúng đường dẫn tương đối mà các loader đọc (data/Stops.txt,
+data/SA2_2021_AUST_SHP_GDA2020/..., Population.csv, ...), nên có thể chạy
+loader ngay trong thư mục dữ liệu. Chạy từ thư mục gốc của repo:
+    python benchmarks/synthetic.py --scale 1 --out bench_data/x1
+"""
+import argparse
+import json
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+# Quy mô 1× (xấp xỉ cả nước); hệ số --scale nhân với các số này
+NATIONAL_SIZE = {
+    'sa2': 2473,
+    'stops': 120000,
+    'catchments': 3000,
+    'poi': 60000,
+}
+
+# Số ngành của mỗi SA2 trong Businesses.csv
+INDUSTRIES = [
+    ('A', 'Agriculture, Forestry and Fishing'), ('C', 'Manufacturing'), ('E', 'Construction'),
+    ('G', 'Retail Trade'), ('H', 'Accommodation and Food Services'), ('I', 'Transport, Postal and Warehousing'),
+    ('K', 'Financial and Insurance Services'), ('M', 'Professional, Scientific and Technical Services'),
+    ('P', 'Education and Training'), ('Q', 'Health Care and Social Assistance'),
+]
+
+# Khung toạ độ (lon/lat) và các đô thị (lon, lat, trọng số, độ phân tán theo độ)
+BOUNDS = (113.0, -44.0, 154.0, -10.0)
+CITIES = [
+    (151.21, -33.87, 0.30, 0.6), (144.96, -37.81, 0.27, 0.6), (153.03, -27.47, 0.14, 0.5),
+    (115.86, -31.95, 0.11, 0.5), (138.60, -34.93, 0.07, 0.4), (147.33, -42.88, 0.03, 0.3),
+    (149.13, -35.28, 0.03, 0.2), (130.84, -12.46, 0.01, 0.2),
+]
+# Tỉ lệ điểm rải đều trên cả khung (vùng nông thôn)
+RURAL_SHARE = 0.2
+
+AGE_COLUMNS = [
+    '0-4_people', '5-9_people', '10-14_people', '15-19_people', '20-24_people', '25-29_people',
+    '30-34_people', '35-39_people', '40-44_people', '45-49_people', '50-54_people', '55-59_people',
+    '60-64_people', '65-69_people', '70-74_people', '75-79_people', '80-84_people', '85-and-over_people',
+]
+
+BUSINESS_COLUMNS = [
+    '0_to_50k_businesses', '50k_to_200k_businesses', '200k_to_2m_businesses',
+    '2m_to_5m_businesses', '5m_to_10m_businesses', '10m_or_more_businesses',
+]
+
+POI_TYPES = ['School', 'Hospital', 'Library', 'Park', 'Shopping Centre', 'Police Station', 'Post Office']
+
+# Đường dẫn tương đối (giống đường dẫn mặc định của các loader)
+PATHS = {
+    'sa2': 'data/SA2_2021_AUST_SHP_GDA2020/SA2_2021_AUST_GDA2020.shp',
+    'stops': 'data/Stops.txt',
+    'businesses': 'data/Businesses.csv',
+    'income': 'data/Income.csv',
+    'population': 'Population.csv',
+    'catchments': 'data/Catchments/catchments/catchments_{level}.shp',
+    'poi': 'data/poi.json',
+}
+CATCHMENT_LEVELS = ['future', 'primary', 'secondary']
+# Tỉ lệ vùng 'future' dùng lại USE_ID của một trường hiện có (như dữ liệu thật: trường đổi vùng tuyển sinh)
+FUTURE_DUPLICATE_SHARE = 0.5
+
+MANIFEST_NAME = 'manifest.json'
+# Tăng khi thay đổi cách sinh dữ liệu để không dùng lại bộ dữ liệu cũ
+DATASET_VERSION = 2
+
+
+def sizes_for(scale):
+    return {name: max(1, int(round(count * scale))) for name, count in NATIONAL_SIZE.items()}
+
+
+def clustered_points(rng, n):
+    """n toạ độ (lon, lat): tập trung quanh các đô thị, một phần rải đều."""
+    weights = np.array([c[2] for c in CITIES])
+    city = rng.choice(len(CITIES), n, p=weights / weights.sum())
+    centers = np.array([c[:2] for c in CITIES])[city]
+    spread = np.array([c[3] for c in CITIES])[city]
+    xy = centers + rng.normal(size=(n, 2)) * spread[:, None]
+
+    rural = rng.random(n) < RURAL_SHARE
+    min_x, min_y, max_x, max_y = BOUNDS
+    xy[rural, 0] = rng.uniform(min_x, max_x, rural.sum())
+    xy[rural, 1] = rng.uniform(min_y, max_y, rural.sum())
+    xy[:, 0] = xy[:, 0].clip(min_x, max_x)
+    xy[:, 1] = xy[:, 1].clip(min_y, max_y)
+    return xy
+
+
+def make_sa2(rng, n):
+    """Đa giác SA2 phủ kín khung (Voronoi), chia nhỏ cạnh để có số đỉnh giống ranh giới thật."""
+    frame = shapely.box(*BOUNDS)
+    seeds = shapely.multipoints(clustered_points(rng, n))
+    cells = shapely.get_parts(shapely.voronoi_polygons(seeds, extend_to=frame))
+    cells = shapely.intersection(cells, frame)
+    cells = cells[~shapely.is_empty(cells)]
+    # Cạnh dài ~1/40 kích thước ô trung bình (cạnh chung của hai ô được chia giống nhau)
+    segment = np.sqrt(shapely.area(frame) / len(cells)) / 40
+    cells = shapely.segmentize(cells, segment)
+
+    # Mã SA4 theo ô lưới 4 độ của tâm; mã SA2 = SA4 (3 số) + số thứ tự (6 số)
+    centroids = shapely.get_coordinates(shapely.centroid(cells))
+    grid = (np.floor((centroids[:, 0] - BOUNDS[0]) / 4) * 100 + np.floor((centroids[:, 1] - BOUNDS[1]) / 4))
+    sa4 = 101 + pd.factorize(grid, sort=True)[0]
+    codes = [f"{s}{i:06d}" for i, s in enumerate(sa4)]
+    return gpd.GeoDataFrame({
+        'SA2_CODE21': codes,
+        'SA2_NAME21': [f"Synthetic SA2 {c}" for c in codes],
+        'SA4_CODE21': [str(s) for s in sa4],
+        'LOCI_URI21': [f"http://example.org/sa2/{c}" for c in codes],
+    }, geometry=cells, crs=7844)
+
+
+def make_stops(rng, n):
+    xy = clustered_points(rng, n)
+    ids = np.arange(200000, 200000 + n).astype(str)
+    location_type = np.where(rng.random(n) < 0.05, '1', '')
+    parent = np.where((location_type == '') & (rng.random(n) < 0.3), rng.choice(ids, n), '')
+    return pd.DataFrame({
+        'stop_id': ids,
+        'stop_code': ids,
+        'stop_name': [f"Synthetic Stop {i}" for i in ids],
+        'stop_lat': xy[:, 1].round(6),
+        'stop_lon': xy[:, 0].round(6),
+        'location_type': location_type,
+        'parent_station': parent,
+        'wheelchair_boarding': rng.integers(0, 3, n),
+        'platform_code': np.where(rng.random(n) < 0.1, rng.integers(1, 9, n).astype(str), ''),
+    })
+
+
+def make_businesses(rng, sa2):
+    codes = np.repeat(sa2['SA2_CODE21'].to_numpy(), len(INDUSTRIES))
+    names = np.repeat(sa2['SA2_NAME21'].to_numpy(), len(INDUSTRIES))
+    industry = np.tile(np.arange(len(INDUSTRIES)), len(sa2))
+    df = pd.DataFrame({
+        'industry_code': [INDUSTRIES[i][0] for i in industry],
+        'industry_name': [INDUSTRIES[i][1] for i in industry],
+        'sa2_code': codes,
+        'sa2_name': names,
+    })
+    for col, high in zip(BUSINESS_COLUMNS, [300, 200, 120, 30, 10, 5]):
+        df[col] = rng.integers(0, high, len(df))
+    df['total_businesses'] = df[BUSINESS_COLUMNS].sum(axis=1)
+    return df
+
+
+def make_population(rng, sa2):
+    n = len(sa2)
+    df = pd.DataFrame({'sa2_code': sa2['SA2_CODE21'].to_numpy(), 'sa2_name': sa2['SA2_NAME21'].to_numpy()})
+    size = rng.lognormal(mean=2.5, sigma=1.0, size=n)
+    for col in AGE_COLUMNS:
+        df[col] = (size * rng.uniform(20, 60, n)).astype(int)
+    # Một phần nhỏ SA2 gần như không có dân (bị loại khi tính điểm)
+    empty = rng.random(n) < 0.03
+    df.loc[empty, AGE_COLUMNS] = 0
+    df['total_people'] = df[AGE_COLUMNS].sum(axis=1)
+    return df
+
+
+def make_income(rng, sa2):
+    n = len(sa2)
+    df = pd.DataFrame({
+        'sa2_code21': sa2['SA2_CODE21'].to_numpy(),
+        'sa2_name': sa2['SA2_NAME21'].to_numpy(),
+        'earners': rng.integers(0, 20000, n).astype(object),
+        'median_age': rng.integers(25, 60, n).astype(object),
+        'median_income': rng.integers(30000, 90000, n).astype(object),
+        'mean_income': rng.integers(40000, 120000, n).astype(object),
+    })
+    # Giá trị bị che ('np') như trong dữ liệu ABS
+    for col in ['earners', 'median_age', 'median_income', 'mean_income']:
+        df.loc[rng.random(n) < 0.02, col] = 'np'
+    return df
+
+
+def make_catchments(rng, n):
+    """Vùng tuyển sinh: đa giác tròn quanh trường, ~10% là MultiPolygon; CRS GDA94 (phải chiếu lại khi nạp)."""
+    xy = clustered_points(rng, n)
+    radius = rng.uniform(0.01, 0.08, n)
+    shapes = shapely.buffer(shapely.points(xy), radius, quad_segs=16)
+    multi = np.flatnonzero(rng.random(n) < 0.1)
+    satellites = shapely.buffer(shapely.points(xy[multi] + radius[multi, None] * 2.5), radius[multi] / 3)
+    shapes[multi] = shapely.multipolygons(
+        np.column_stack((shapes[multi], satellites)).ravel(), indices=np.repeat(np.arange(len(multi)), 2)
+    )
+    add_date = pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.integers(0, 1500, n), unit='D')
+    years = {f'YEAR{i}': np.where(rng.random(n) < 0.5, 'Y', 'N') for i in range(1, 13)}
+    gdf = gpd.GeoDataFrame({
+        'USE_ID': np.arange(1000, 1000 + n),
+        'CATCH_TYPE': rng.choice(['PRIMARY', 'HIGH_COED', 'HIGH_BOYS', 'HIGH_GIRLS'], n),
+        'USE_DESC': [f"Synthetic School {i}" for i in range(n)],
+        'ADD_DATE': add_date.strftime('%Y-%m-%d'),
+        'KINDERGART': np.where(rng.random(n) < 0.5, 'Y', 'N'),
+        **years,
+        'PRIORITY': np.where(rng.random(n) < 0.05, '1', None),
+    }, geometry=shapes, crs=4326).to_crs(4283)
+    gdf['level'] = rng.choice(CATCHMENT_LEVELS, n)
+    current = gdf.loc[gdf['level'] != 'future', 'USE_ID'].to_numpy()
+    future = np.flatnonzero((gdf['level'] == 'future').to_numpy() & (rng.random(n) < FUTURE_DUPLICATE_SHARE))
+    if len(current):
+        gdf.loc[gdf.index[future], 'USE_ID'] = rng.choice(current, len(future))
+    return gdf
+
+
+def make_poi(rng, n):
+    """Phản hồi dạng ArcGIS (features với attributes + geometry x/y, WGS84)."""
+    xy = clustered_points(rng, n)
+    types = rng.choice(len(POI_TYPES), n)
+    return {'features': [
+        {
+            'attributes': {
+                'objectid': int(i),
+                'poigroup': int(types[i] + 1),
+                'poitype': POI_TYPES[types[i]],
+                'poiname': f"Synthetic {POI_TYPES[types[i]]} {i}",
+                'poilabel': f"SYNTHETIC {i}",
+                'startdate': 1577836800000,
+                'lastupdate': 1704067200000,
+            },
+            'geometry': {'x': round(float(xy[i, 0]), 7), 'y': round(float(xy[i, 1]), 7)},
+        }
+        for i in range(n)
+    ]}
+
+
+def generate_dataset(out_dir, scale=1.0, seed=0, force=False):
+    """Ghi bộ dữ liệu vào out_dir (bỏ qua nếu đã có bộ cùng scale/seed). Trả về manifest (số dòng mỗi file)."""
+    manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+    if not force and os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        if (manifest.get('scale'), manifest.get('seed'), manifest.get('version')) == (scale, seed, DATASET_VERSION):
+            print(f"⏭️ Dùng lại dữ liệu giả lập có sẵn trong {out_dir}")
+            return manifest
+
+    rng = np.random.default_rng(seed)
+    sizes = sizes_for(scale)
+
+    def path(name, **kwargs):
+        full = os.path.join(out_dir, PATHS[name].format(**kwargs))
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        return full
+
+    print(f"⏳ Sinh dữ liệu giả lập scale={scale} vào {out_dir}...")
+    sa2 = make_sa2(rng, sizes['sa2'])
+    sa2.to_file(path('sa2'), engine='pyogrio')
+    make_stops(rng, sizes['stops']).to_csv(path('stops'), index=False)
+    make_businesses(rng, sa2).to_csv(path('businesses'), index=False)
+    make_population(rng, sa2).to_csv(path('population'), index=False)
+    make_income(rng, sa2).to_csv(path('income'), index=False)
+
+    catchments = make_catchments(rng, sizes['catchments'])
+    for level in CATCHMENT_LEVELS:
+        part = catchments[catchments['level'] == level].drop(columns='level')
+        part.to_file(path('catchments', level=level), engine='pyogrio')
+    with open(path('poi'), 'w', encoding='utf-8') as f:
+        json.dump(make_poi(rng, sizes['poi']), f)
+
+    manifest = {
+        'scale': scale,
+        'seed': seed,
+        'version': DATASET_VERSION,
+        'rows': {
+            'sa2': len(sa2),
+            'stops': sizes['stops'],
+            'businesses': len(sa2) * len(INDUSTRIES),
+            'population': len(sa2),
+            'income': len(sa2),
+            'catchments': int(catchments['USE_ID'].nunique()),
+            'poi': sizes['poi'],
+        },
+    }
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    print(f"✅ Đã sinh dữ liệu: {manifest['rows']}")
+    return manifest
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=float, default=1.0, help="Hệ số quy mô so với cả nước (1, 10, 100...)")
+    parser.add_argument('--out', default='bench_data/x1')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--force', action='store_true', help="Sinh lại kể cả khi đã có dữ liệu")
+    args = parser.parse_args()
+    generate_dataset(args.out, args.scale, args.seed, args.force)
@@ -0,0 +1,174 @@
+import io
+import time
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from metrics import timed
+
+# Số dòng mỗi lần COPY (mỗi chunk là một lệnh COPY ... FROM STDIN)
+COPY_CHUNK_SIZE = 50000
+
+# Ký hiệu NULL dùng trong luồng CSV gửi cho PostgreSQL
+COPY_NULL = r'\N'
+
+# Mã kiểu hình học của shapely (shapely.get_type_id)
+POLYGON_TYPE_ID = 3
+
+# SRID làm việc chung: mọi geometry được chiếu về hệ này một lần lúc nạp.
+# GDA2020 địa lý là CRS gốc của shapefile SA2 nên bảng lớn nhất không phải chiếu lại.
+WORKING_SRID = 7844
+
+
+def quote_ident(name):
+    """Đặt tên cột/bảng trong dấu nháy kép (cần cho các cột như "0-4_people")."""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def prepare_copy_frame(df, columns):
+    """Chuẩn bị DataFrame để ghi ra CSV cho COPY.
+
+    - Cột float chỉ chứa số nguyên (thường do NaN làm pandas ép kiểu) được đổi
+      sang Int64 để ghi '3' thay vì '3.0' vào cột INTEGER.
+    - Mọi giá trị thiếu (None, NaN, NaT, pd.NA) đều thành NULL thật trong bảng.
+    """
+    frame = df[columns].copy()
+    for col in frame.columns:
+        series = frame[col]
+        if pd.api.types.is_float_dtype(series):
+            values = series.dropna()
+            if len(values) and (values % 1 == 0).all():
+                frame[col] = series.astype('Int64')
+    return frame
+
+
+def _copy_chunk(cur, chunk, target, column_sql):
+    """Ghi một chunk ra CSV trong bộ nhớ và stream vào PostgreSQL bằng COPY."""
+    buffer = io.StringIO()
+    chunk.to_csv(buffer, index=False, header=False, na_rep=COPY_NULL)
+    buffer.seek(0)
+    copy_sql = f"COPY {target} ({column_sql}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')"
+    cur.execute(copy_sql, stream=buffer)
+
+
+@timed('copy', rows=int)
+def copy_dataframe(conn, df, table_name, columns=None, conflict_key=None, on_conflict='nothing',
+                   chunk_size=COPY_CHUNK_SIZE, commit=True):
+    """Nạp DataFrame vào bảng PostgreSQL bằng COPY ... FROM STDIN của pg8000.
+
+    Tên cột trong DataFrame phải trùng với tên cột trong bảng. Nếu có
+    ``conflict_key`` thì dữ liệu được COPY vào bảng tạm rồi gộp bằng
+    ``INSERT ... ON CONFLICT DO NOTHING`` (hoặc ``DO UPDATE`` khi
+    ``on_conflict='update'``), giữ nguyên hành vi của các lệnh INSERT cũ.
+    Với ``commit=False`` người gọi tự commit (để gộp nhiều bước vào một
+    transaction). Trả về số dòng đã gửi.
+    """
+    columns = list(columns or df.columns)
+    frame = prepare_copy_frame(df, columns)
+    if conflict_key:
+        conflict_key = [conflict_key] if isinstance(conflict_key, str) else list(conflict_key)
+        # DO NOTHING giữ bản ghi đầu tiên của mỗi khóa, DO UPDATE giữ bản ghi cuối cùng
+        keep = 'last' if on_conflict == 'update' else 'first'
+        frame = frame.drop_duplicates(subset=conflict_key, keep=keep)
+
+    column_sql = ", ".join(quote_ident(col) for col in columns)
+    total = len(frame)
+    start = time.perf_counter()
+
+    try:
+        with conn.cursor() as cur:
+            target = table_name
+            if conflict_key:
+                target = f"_copy_stage_{table_name.lower()}"
+                cur.execute(f"DROP TABLE IF EXISTS {target};")
+                cur.execute(
+                    f"CREATE TEMP TABLE {target} (LIKE {table_name} INCLUDING DEFAULTS) ON COMMIT DROP;"
+                )
+
+            for offset in range(0, total, chunk_size):
+                chunk = frame.iloc[offset:offset + chunk_size]
+                _copy_chunk(cur, chunk, target, column_sql)
+                done = offset + len(chunk)
+                elapsed = time.perf_counter() - start
+                rate = done / elapsed if elapsed > 0 else float('inf')
+                print(f"⏳ COPY {table_name}: {done}/{total} dòng ({rate:,.0f} dòng/giây)")
+
+            if conflict_key:
+                key_sql = ", ".join(quote_ident(col) for col in conflict_key)
+                action = "DO NOTHING"
+                update_columns = [col for col in columns if col not in conflict_key]
+                if on_conflict == 'update' and update_columns:
+                    action = "DO UPDATE SET " + ", ".join(
+                        f"{quote_ident(col)} = EXCLUDED.{quote_ident(col)}" for col in update_columns
+                    )
+                cur.execute(f"""
+                    INSERT INTO {table_name} ({column_sql})
+                    SELECT {column_sql} FROM {target}
+                    ON CONFLICT ({key_sql}) {action};
+                """)
+        if commit:
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    elapsed = time.perf_counter() - start
+    rate = total / elapsed if elapsed > 0 else float('inf')
+    print(f"✅ Đã COPY {total} dòng vào bảng {table_name} trong {elapsed:.2f}s ({rate:,.0f} dòng/giây)")
+    return total
+
+
+def geometry_to_ewkb(geometries, srid=WORKING_SRID, promote_multi=True):
+    """Chuyển cả mảng geometry sang hex EWKB (kèm SRID) bằng shapely 2 vectorized.
+
+    Khi ``promote_multi`` bật, mọi Polygon được đổi thành MultiPolygon trong
+    một bước để khớp với cột ``GEOMETRY(MultiPolygon, ...)``. Geometry rỗng
+    (None) trả về None và sẽ thành NULL khi COPY.
+    """
+    geoms = np.asarray(geometries, dtype=object)
+    if promote_multi:
+        polygon_idx = np.flatnonzero(shapely.get_type_id(geoms) == POLYGON_TYPE_ID)
+        if len(polygon_idx):
+            geoms = geoms.copy()
+            geoms[polygon_idx] = shapely.multipolygons(
+                geoms[polygon_idx], indices=np.arange(len(polygon_idx))
+            )
+    geoms = shapely.set_srid(geoms, srid)
+    return shapely.to_wkb(geoms, hex=True, include_srid=True)
+
+
+def copy_geodataframe(conn, gdf, table_name, columns, srid=WORKING_SRID, promote_multi=True, assume_srid=None,
+                      **copy_kwargs):
+    """Nạp GeoDataFrame bằng COPY, geometry được gửi dưới dạng hex EWKB.
+
+    PostGIS đọc trực tiếp hex EWKB vào cột geometry nên không cần
+    ``ST_GeomFromText``. Cột geometry đang hoạt động của ``gdf`` được ghi vào
+    cột cùng tên trong ``columns``.
+    """
+    frame = geodataframe_to_frame(gdf, columns, srid, promote_multi, assume_srid)
+    return copy_dataframe(conn, frame, table_name, columns, **copy_kwargs)
+
+
+def to_working_crs(gdf, srid=WORKING_SRID, assume_srid=None):
+    """Chiếu GeoDataFrame về ``srid``; giữ nguyên nếu đã đúng hệ.
+
+    GeoDataFrame chưa khai báo CRS (thiếu file .prj...) bị từ chối, trừ khi người
+    gọi chỉ rõ hệ của toạ độ bằng ``assume_srid``.
+    """
+    if gdf.crs is None:
+        if assume_srid is None:
+            raise ValueError("GeoDataFrame chưa có CRS; hãy khai báo CRS hoặc truyền assume_srid=")
+        gdf = gdf.set_crs(epsg=assume_srid)
+    if gdf.crs.to_epsg() == srid:
+        return gdf
+    return gdf.to_crs(epsg=srid)
+
+
+def geodataframe_to_frame(gdf, columns, srid=WORKING_SRID, promote_multi=True, assume_srid=None):
+    """DataFrame thường với cột geometry đã chiếu về ``srid`` và chuyển sang hex EWKB (dùng cho COPY)."""
+    gdf = to_working_crs(gdf, srid, assume_srid)
+    geometry_column = gdf.geometry.name
+    frame = pd.DataFrame({col: gdf[col] for col in columns if col != geometry_column})
+    frame[geometry_column] = geometry_to_ewkb(gdf.geometry.values, srid, promote_multi)
+    return frame[columns]
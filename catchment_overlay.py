@@ -0,0 +1,108 @@
+import time
+
+from index_manager import build_indexes
+from metrics import stage
+from scoring import source_fingerprint
+
+# Bảng nguồn của overlay: chỉ tính lại khi một trong hai bảng thay đổi
+OVERLAY_SOURCES = ['sa2', 'schools']
+
+# Index cho join theo mã SA2 (khóa chính (use_id, sa2_code21) đã phục vụ tra theo trường)
+OVERLAY_INDEXES = [('btree', 'sa2_code21')]
+
+# Cặp (vùng tuyển sinh, SA2) giao nhau, diện tích phần giao (m², tính trên geography)
+# và tỷ lệ diện tích vùng tuyển sinh nằm trong SA2. Cặp chỉ chạm biên có diện tích 0.
+CREATE_OVERLAY_SQL = """
+CREATE TABLE IF NOT EXISTS catchment_sa2 (
+    use_id INTEGER NOT NULL,
+    sa2_code21 VARCHAR(15) NOT NULL,
+    intersection_area DOUBLE PRECISION NOT NULL,
+    area_fraction DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (use_id, sa2_code21)
+);
+
+CREATE TABLE IF NOT EXISTS catchment_sa2_sources (
+    source TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    refreshed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+
+# Join không gian hai bước như task3.sql: lọc thô trên geometry_simple, nhận ngay khi hai
+# vùng lõi giao nhau, còn lại kiểm tra trên geometry gốc. Vùng tuyển sinh nằm trọn trong
+# SA2 thì không cần ST_Intersection (phần lớn các cặp).
+OVERLAY_SQL = """
+INSERT INTO catchment_sa2 (use_id, sa2_code21, intersection_area, area_fraction)
+SELECT
+    sc.use_id,
+    s.sa2_code21,
+    o.area,
+    COALESCE(o.area / NULLIF(ST_Area(sc.geometry::geography), 0), 0)
+FROM schools sc
+JOIN sa2 s
+    ON ST_DWithin(sc.geometry_simple, s.geometry_simple, %s)
+    AND CASE WHEN ST_Intersects(sc.geometry_core, s.geometry_core) THEN TRUE
+             ELSE ST_Intersects(sc.geometry, s.geometry) END
+CROSS JOIN LATERAL (
+    SELECT CASE WHEN ST_CoveredBy(sc.geometry, s.geometry) THEN ST_Area(sc.geometry::geography)
+                ELSE ST_Area(ST_Intersection(sc.geometry, s.geometry)::geography) END AS area
+) o;
+"""
+
+
+def overlay_margin(cur):
+    """Tổng margin của sa2.geometry và schools.geometry (từ bảng geometry_resolution)."""
+    cur.execute("""
+        SELECT table_name, margin FROM geometry_resolution
+        WHERE table_name IN ('sa2', 'schools') AND column_name = 'geometry';
+    """)
+    margins = dict(cur.fetchall())
+    missing = [name for name in OVERLAY_SOURCES if name not in margins]
+    if missing:
+        raise RuntimeError(f"Bảng {missing} chưa có cột geometry_simple/geometry_core; hãy chạy loader tương ứng trước.")
+    return margins['sa2'] + margins['schools']
+
+
+def build_catchment_overlay(conn, force=False):
+    """Tính lại bảng catchment_sa2 nếu bảng sa2 hoặc schools thay đổi (hoặc force=True).
+
+    Bảng được xóa và nạp lại trong một transaction nên người đọc luôn thấy bản
+    đầy đủ. Trả về số cặp đã ghi, None nếu bỏ qua.
+    """
+    with conn.cursor() as cur:
+        conn.execute_simple(CREATE_OVERLAY_SQL)
+        current = {source: source_fingerprint(cur, source) for source in OVERLAY_SOURCES}
+        if any(fingerprint is None for fingerprint in current.values()):
+            print("❌ Chưa có bảng SA2 hoặc schools, không thể tính catchment_sa2.")
+            return None
+        cur.execute("SELECT source, fingerprint FROM catchment_sa2_sources;")
+        if not force and dict(cur.fetchall()) == current:
+            conn.commit()
+            print("⏭️ Bỏ qua catchment_sa2: bảng SA2 và schools không thay đổi.")
+            return None
+
+        try:
+            start = time.perf_counter()
+            margin = overlay_margin(cur)
+            cur.execute("DELETE FROM catchment_sa2;")
+            cur.execute(OVERLAY_SQL, (margin,))
+            pairs = cur.rowcount
+            cur.execute("DELETE FROM catchment_sa2_sources;")
+            for source, fingerprint in current.items():
+                cur.execute(
+                    "INSERT INTO catchment_sa2_sources (source, fingerprint) VALUES (%s, %s);",
+                    (source, fingerprint),
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    print(f"✅ catchment_sa2: {pairs} cặp vùng tuyển sinh/SA2 ({time.perf_counter() - start:.1f}s)")
+    return pairs
+
+
+def run(conn, load_mode=None):
+    """Bước overlay của pipeline: tính catchment_sa2 một lần sau mỗi lần nạp catchments/SA2."""
+    with stage('catchment_overlay') as current:
+        current.rows = build_catchment_overlay(conn, force=load_mode == 'full')
+        build_indexes(conn, 'catchment_sa2', OVERLAY_INDEXES, concurrently=load_mode != 'full')
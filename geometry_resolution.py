@@ -0,0 +1,167 @@
+import hashlib
+
+import numpy as np
+import shapely
+
+# Sai số đơn giản hóa mặc định, theo đơn vị của SRID làm việc (độ): 0.0001° ≈ 10 m
+SIMPLIFY_TOLERANCE = 0.0001
+
+# Lưới làm tròn toạ độ của bản đơn giản hóa: 0.000001° ≈ 0.1 m
+PRECISION_GRID = 0.000001
+
+# margin = MARGIN_FACTOR * sai số + lưới. Simplify của GEOS có thể lệch quá sai số một
+# chút (ví dụ khi dời điểm đầu của vòng), hệ số 2 để phép lọc thô không bỏ sót.
+MARGIN_FACTOR = 2.0
+
+# Vùng lõi = bản đơn giản hóa thu vào CORE_FACTOR * margin. Lớn hơn 1 để bù phần
+# cung tròn bị xấp xỉ bằng dây cung (quad_segs=2) ở các góc lõm.
+CORE_FACTOR = 1.25
+
+# Hậu tố tên cột: <cột>_simple (đơn giản hóa + làm tròn) và <cột>_core (vùng lõi chắc chắn nằm trong)
+SIMPLE_SUFFIX = '_simple'
+CORE_SUFFIX = '_core'
+
+# Hàm SQL dùng trong các cột GENERATED (phải IMMUTABLE). Vùng quá nhỏ bị triệt tiêu
+# khi làm tròn thì giữ nguyên geometry gốc để phép lọc thô không bỏ sót.
+GEOMETRY_FUNCTIONS_SQL = [
+    """
+    CREATE OR REPLACE FUNCTION simplify_geometry(g geometry, tolerance double precision, grid double precision)
+    RETURNS geometry
+    LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE AS $$
+      SELECT CASE WHEN ST_IsEmpty(s) THEN g ELSE s END
+      FROM (SELECT ST_ReducePrecision(ST_SimplifyPreserveTopology(g, tolerance), grid) AS s) simplified;
+    $$;
+    """,
+    """
+    CREATE OR REPLACE FUNCTION core_geometry(g geometry, tolerance double precision, grid double precision,
+                                             depth double precision)
+    RETURNS geometry
+    LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE AS $$
+      SELECT ST_Buffer(simplify_geometry(g, tolerance, grid), -depth, 'quad_segs=2');
+    $$;
+    """,
+]
+
+
+# Chữ ký của hai hàm SQL (ghi vào COMMENT ON FUNCTION): chỉ tạo lại khi thiếu hoặc định nghĩa thay đổi
+GEOMETRY_FUNCTIONS = [
+    'simplify_geometry(geometry, double precision, double precision)',
+    'core_geometry(geometry, double precision, double precision, double precision)',
+]
+GEOMETRY_FUNCTIONS_VERSION = hashlib.sha1(''.join(GEOMETRY_FUNCTIONS_SQL).encode('utf-8')).hexdigest()[:16]
+
+CREATE_RESOLUTION_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS geometry_resolution (
+    table_name TEXT,
+    column_name TEXT,
+    tolerance DOUBLE PRECISION NOT NULL,
+    grid_size DOUBLE PRECISION NOT NULL,
+    margin DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (table_name, column_name)
+);
+"""
+
+# Khóa advisory (pg_advisory_xact_lock) tuần tự hóa DDL của các loader chạy song song (sa2, catchments)
+RESOLUTION_LOCK_KEY = 0x67656f6d  # 'geom'
+
+
+def resolution_margin(tolerance, grid_size):
+    """Khoảng cách tối đa giữa biên gốc và biên đơn giản hóa (sai số simplify + làm tròn).
+
+    Điểm cách biên bản đơn giản hóa xa hơn margin thì nằm trong/ngoài vùng gốc
+    giống hệt như với bản đơn giản hóa; chỉ các điểm gần biên cần kiểm tra lại
+    trên geometry gốc.
+    """
+    return MARGIN_FACTOR * tolerance + grid_size
+
+
+def simplify_geometries(geometries, tolerance=SIMPLIFY_TOLERANCE, grid_size=PRECISION_GRID):
+    """Bản đơn giản hóa giữ topology rồi làm tròn toạ độ (shapely vectorized), như simplify_geometry() trong SQL."""
+    geometries = np.asarray(geometries, dtype=object)
+    simple = shapely.set_precision(shapely.simplify(geometries, tolerance, preserve_topology=True), grid_size)
+    collapsed = shapely.is_empty(simple) | shapely.is_missing(simple)
+    simple[collapsed] = geometries[collapsed]
+    return simple
+
+
+def core_geometries(simple, margin):
+    """Vùng lõi: mọi điểm trong lõi chắc chắn thuộc geometry gốc (có thể rỗng với vùng nhỏ)."""
+    return shapely.buffer(simple, -CORE_FACTOR * margin, quad_segs=2)
+
+
+def _functions_current(cur):
+    """True nếu hai hàm SQL đã có và được tạo từ đúng GEOMETRY_FUNCTIONS_SQL hiện tại."""
+    cur.execute(
+        "SELECT obj_description(to_regprocedure(f), 'pg_proc') FROM unnest(%s::text[]) AS f;",
+        (GEOMETRY_FUNCTIONS,),
+    )
+    return all(row[0] == GEOMETRY_FUNCTIONS_VERSION for row in cur.fetchall())
+
+
+def _resolution_current(cur, table, column, simple_column, core_column, expected):
+    """True nếu bảng đã có hai cột và geometry_resolution ghi đúng cấu hình `expected`."""
+    cur.execute("SELECT to_regclass('geometry_resolution') IS NOT NULL;")
+    if not cur.fetchone()[0]:
+        return False
+    cur.execute(
+        "SELECT tolerance, grid_size, margin FROM geometry_resolution WHERE table_name = %s AND column_name = %s;",
+        (table, column),
+    )
+    configured = cur.fetchone()
+    cur.execute("""
+        SELECT COUNT(*) FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s AND column_name IN (%s, %s);
+    """, (table, simple_column, core_column))
+    present = cur.fetchone()[0] == 2
+    return present and configured is not None and tuple(configured) == expected
+
+
+def ensure_resolution_columns(conn, table_name, column='geometry', tolerance=SIMPLIFY_TOLERANCE,
+                              grid_size=PRECISION_GRID):
+    """Đảm bảo bảng có cột <column>_simple và <column>_core (GENERATED ... STORED) đúng sai số.
+
+    Cấu hình được ghi vào bảng geometry_resolution (kèm margin) để các truy vấn
+    trong task3.sql biết khoảng cách cần kiểm tra lại. Khi sai số thay đổi, hai
+    cột được tạo lại (PostgreSQL tính lại toàn bộ bảng). Trả về True nếu bảng bị sửa.
+
+    Khi mọi thứ đã đúng thì chỉ đọc catalog, không chạy DDL. Ngược lại DDL chạy
+    dưới pg_advisory_xact_lock nên các loader song song không tranh nhau tạo hàm/bảng.
+    """
+    table = table_name.lower()
+    simple_column, core_column = column + SIMPLE_SUFFIX, column + CORE_SUFFIX
+    margin = resolution_margin(tolerance, grid_size)
+    expected = (tolerance, grid_size, margin)
+    with conn.cursor() as cur:
+        if _functions_current(cur) and _resolution_current(cur, table, column, simple_column, core_column, expected):
+            conn.commit()
+            return False
+
+        # Kiểm tra lại sau khi có khóa: loader khác có thể vừa tạo xong
+        cur.execute("SELECT pg_advisory_xact_lock(%s);", (RESOLUTION_LOCK_KEY,))
+        if not _functions_current(cur):
+            for sql in GEOMETRY_FUNCTIONS_SQL:
+                cur.execute(sql)
+            for signature in GEOMETRY_FUNCTIONS:
+                cur.execute(f"COMMENT ON FUNCTION {signature} IS '{GEOMETRY_FUNCTIONS_VERSION}';")
+        cur.execute(CREATE_RESOLUTION_TABLE_SQL)
+        if _resolution_current(cur, table, column, simple_column, core_column, expected):
+            conn.commit()
+            return False
+
+        cur.execute(f"ALTER TABLE {table} DROP COLUMN IF EXISTS {simple_column}, DROP COLUMN IF EXISTS {core_column};")
+        cur.execute(f"""
+            ALTER TABLE {table}
+            ADD COLUMN {simple_column} geometry GENERATED ALWAYS AS
+                (simplify_geometry({column}, {tolerance!r}, {grid_size!r})) STORED,
+            ADD COLUMN {core_column} geometry GENERATED ALWAYS AS
+                (core_geometry({column}, {tolerance!r}, {grid_size!r}, {CORE_FACTOR * margin!r})) STORED;
+        """)
+        cur.execute("""
+            INSERT INTO geometry_resolution (table_name, column_name, tolerance, grid_size, margin)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (table_name, column_name) DO UPDATE
+            SET tolerance = EXCLUDED.tolerance, grid_size = EXCLUDED.grid_size, margin = EXCLUDED.margin;
+        """, (table, column, tolerance, grid_size, margin))
+    conn.commit()
+    print(f"✅ Đã tạo cột {table}.{simple_column}/{core_column} (sai số {tolerance}, lưới {grid_size})")
+    return True
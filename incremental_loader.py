@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import threading
+
+import pandas as pd
+
+from bulk_loader import copy_dataframe, prepare_copy_frame, quote_ident
+from metrics import timed
+from utils import _atomic_write
+
+# Manifest lưu checksum của file nguồn đã nạp cho từng bảng
+LOAD_MANIFEST_PATH = 'data/cache/load_manifest.json'
+
+# Các loader chạy song song trong pipeline.py: mọi lần đọc-sửa-ghi manifest đi qua khóa này
+_manifest_lock = threading.Lock()
+
+# Cột lưu hash nội dung của từng dòng trong các bảng nạp tăng dần
+ROW_HASH_COLUMN = 'row_hash'
+
+
+def source_checksum(paths):
+    """sha256 của toàn bộ nội dung các file nguồn (theo thứ tự truyền vào)."""
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def _read_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_manifest(manifest, manifest_path):
+    """Ghi manifest qua file tạm + os.replace: người đọc không bao giờ thấy file ghi dở."""
+    os.makedirs(os.path.dirname(manifest_path) or '.', exist_ok=True)
+
+    def write(path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+    _atomic_write(manifest_path, write)
+
+
+def source_unchanged(table_name, checksum, manifest_path=LOAD_MANIFEST_PATH):
+    with _manifest_lock:
+        manifest = _read_manifest(manifest_path)
+    return manifest.get(table_name, {}).get('sha256') == checksum
+
+
+def record_source(table_name, paths, checksum, manifest_path=LOAD_MANIFEST_PATH):
+    with _manifest_lock:
+        manifest = _read_manifest(manifest_path)
+        manifest[table_name] = {'sources': list(paths), 'sha256': checksum}
+        _write_manifest(manifest, manifest_path)
+
+
+def forget_source(table_name, manifest_path=LOAD_MANIFEST_PATH):
+    """Xóa checksum đã lưu để lần nạp tăng dần sau đọc lại file nguồn."""
+    with _manifest_lock:
+        manifest = _read_manifest(manifest_path)
+        if manifest.pop(table_name, None) is None:
+            return
+        _write_manifest(manifest, manifest_path)
+
+
+def ensure_geometry_column(conn, table_name, column, geometry_type, srid, manifest_path=LOAD_MANIFEST_PATH):
+    """Đảm bảo cột geometry tồn tại với đúng kiểu và SRID.
+
+    Bảng tạo trước khi chuẩn hóa CRS được sửa tại chỗ (thêm cột, hoặc đổi SRID
+    bằng ST_Transform), rồi xóa ``row_hash`` và checksum trong manifest để lần
+    nạp tăng dần kế tiếp ghi lại mọi dòng từ nguồn. Trả về True nếu bảng bị sửa.
+    """
+    table = table_name.lower()
+    target = f"geometry({geometry_type}, {srid})"
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT type, srid FROM geometry_columns
+            WHERE f_table_schema = current_schema() AND f_table_name = %s AND f_geometry_column = %s;
+        """, (table, column))
+        row = cur.fetchone()
+        if row is not None and row[0].upper() == geometry_type.upper() and row[1] == srid:
+            conn.commit()
+            return False
+
+        if row is None:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {target};")
+        else:
+            # Giá trị chưa có SRID (0) chỉ được gán SRID, còn lại được chiếu lại
+            using = (f"CASE WHEN ST_SRID({column}) = 0 THEN ST_SetSRID({column}, {srid}) "
+                     f"ELSE ST_Transform({column}, {srid}) END")
+            cur.execute(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE {target} USING {using};")
+        cur.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = %s AND column_name = %s;
+        """, (table, ROW_HASH_COLUMN))
+        if cur.fetchone() is not None:
+            cur.execute(f"UPDATE {table} SET {ROW_HASH_COLUMN} = NULL;")
+    conn.commit()
+    forget_source(table_name, manifest_path)
+    print(f"⚠️ Đã chuyển cột {table}.{column} sang {target}; lần nạp tới sẽ ghi lại toàn bộ dữ liệu.")
+    return True
+
+
+def row_hashes(frame, columns):
+    """Hash nội dung của từng dòng (hex 16 ký tự), không phụ thuộc index."""
+    hashes = pd.util.hash_pandas_object(frame[columns].astype(str), index=False)
+    return hashes.map('{:016x}'.format)
+
+
+@timed('apply_incremental', rows=sum)
+def apply_incremental(conn, df, table_name, columns, key):
+    """So sánh DataFrame với bảng theo khóa tự nhiên và chỉ áp dụng insert/update/delete.
+
+    Bảng được thêm cột ``row_hash`` (nếu chưa có). Dòng mới hoặc có hash khác
+    được COPY rồi upsert; khóa không còn trong DataFrame bị xóa. Tất cả nằm
+    trong một transaction. Trả về (số dòng thêm, số dòng sửa, số dòng xóa).
+    """
+    frame = prepare_copy_frame(df, columns).drop_duplicates(subset=[key], keep='first')
+    frame[ROW_HASH_COLUMN] = row_hashes(frame, columns)
+    keys = frame[key].astype(str)
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS {ROW_HASH_COLUMN} TEXT;")
+            cur.execute(f"SELECT CAST({quote_ident(key)} AS TEXT), {ROW_HASH_COLUMN} FROM {table_name};")
+            existing = dict(cur.fetchall())
+
+            is_new = ~keys.isin(list(existing))
+            is_changed = ~is_new & (keys.map(existing) != frame[ROW_HASH_COLUMN])
+            deleted = sorted(set(existing) - set(keys))
+
+            if deleted:
+                cur.execute(
+                    f"DELETE FROM {table_name} WHERE CAST({quote_ident(key)} AS TEXT) = ANY(%s);",
+                    (deleted,),
+                )
+        changed = frame[(is_new | is_changed).to_numpy()]
+        if len(changed):
+            copy_dataframe(conn, changed, table_name, columns + [ROW_HASH_COLUMN],
+                           conflict_key=key, on_conflict='update', commit=False)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    counts = (int(is_new.sum()), int(is_changed.sum()), len(deleted))
+    print(f"✅ {table_name}: +{counts[0]} thêm, ~{counts[1]} sửa, -{counts[2]} xóa "
+          f"({len(frame) - counts[0] - counts[1]} dòng không đổi)")
+    return counts
+
+
+def table_loaded(conn, table_name):
+    """True nếu bảng tồn tại, có cột row_hash và ít nhất một dòng đã được nạp tăng dần."""
+    table = table_name.lower()
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = %s AND column_name = %s;
+        """, (table, ROW_HASH_COLUMN))
+        loaded = cur.fetchone() is not None
+        if loaded:
+            cur.execute(f"SELECT EXISTS (SELECT 1 FROM {table} WHERE {ROW_HASH_COLUMN} IS NOT NULL);")
+            loaded = bool(cur.fetchone()[0])
+    conn.commit()
+    return loaded
+
+
+def incremental_load(conn, table_name, source_paths, build_frame, columns, key,
+                     manifest_path=LOAD_MANIFEST_PATH):
+    """Nạp tăng dần một bảng từ các file nguồn.
+
+    Nếu checksum của file nguồn trùng với manifest và bảng vẫn còn dữ liệu đã
+    nạp thì bỏ qua hoàn toàn (không đọc file). Ngược lại gọi ``build_frame()`` để dựng DataFrame rồi
+    ``apply_incremental``. Trả về None nếu bỏ qua, ngược lại là bộ đếm thay đổi.
+    """
+    checksum = source_checksum(source_paths)
+    if source_unchanged(table_name, checksum, manifest_path):
+        if table_loaded(conn, table_name):
+            print(f"⏭️ Bỏ qua bảng {table_name}: file nguồn không thay đổi.")
+            return None
+        # Manifest nằm ngoài database: bảng bị xóa/làm mới thì phải nạp lại dù file không đổi
+        print(f"⚠️ Bảng {table_name} chưa có dữ liệu nạp tăng dần, nạp lại dù file nguồn không đổi.")
+    counts = apply_incremental(conn, build_frame(), table_name, columns, key)
+    record_source(table_name, source_paths, checksum, manifest_path)
+    return counts
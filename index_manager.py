@@ -0,0 +1,73 @@
+import time
+
+from bulk_loader import quote_ident
+from metrics import timed
+
+# Phương thức index được hỗ trợ: gist (geometry), btree (cột join), brin (bảng lớn, dữ liệu theo thứ tự)
+INDEX_METHODS = ('gist', 'btree', 'brin')
+
+
+def index_name(table_name, method, columns):
+    """Tên index theo quy ước <bảng>_<cột>_<phương thức>_idx."""
+    if isinstance(columns, str):
+        columns = [columns]
+    return f"{table_name.lower()}_{'_'.join(col.lower() for col in columns)}_{method}_idx"
+
+
+def _index_valid(cur, name):
+    """True/False theo pg_index.indisvalid, None nếu index chưa tồn tại."""
+    cur.execute("""
+        SELECT x.indisvalid
+        FROM pg_index x
+        WHERE x.indexrelid = to_regclass(%s);
+    """, (name,))
+    row = cur.fetchone()
+    return None if row is None else bool(row[0])
+
+
+@timed('indexes')
+def build_indexes(conn, table_name, indexes, concurrently=False, cluster=False):
+    """Tạo các index khai báo cho bảng (nếu chưa có), tùy chọn CLUSTER, rồi ANALYZE.
+
+    ``indexes`` là danh sách (phương thức, cột hoặc list cột), ví dụ
+    ``[('gist', 'geometry'), ('btree', 'sa2_code')]``. Với ``concurrently=True``
+    (bảng đang được đọc) index được tạo bằng CREATE INDEX CONCURRENTLY; index
+    INVALID còn sót lại từ lần tạo concurrently bị lỗi sẽ được xóa và tạo lại.
+    ``cluster=True`` sắp xếp lại bảng theo index GiST đầu tiên (khóa cả bảng,
+    chỉ nên dùng khi vừa nạp lại toàn bộ).
+    """
+    table = table_name.lower()
+    option = 'CONCURRENTLY ' if concurrently else ''
+    # CREATE INDEX CONCURRENTLY không chạy được trong transaction
+    conn.commit()
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            for method, columns in indexes:
+                if method not in INDEX_METHODS:
+                    raise ValueError(f"Phương thức index không hỗ trợ: {method}")
+                if isinstance(columns, str):
+                    columns = [columns]
+                name = index_name(table, method, columns)
+                valid = _index_valid(cur, name)
+                if valid:
+                    continue
+                if valid is False:
+                    print(f"⚠️ Index {name} không hợp lệ (lần tạo trước bị lỗi), tạo lại.")
+                    cur.execute(f"DROP INDEX {option}IF EXISTS {name};")
+
+                start = time.perf_counter()
+                column_sql = ", ".join(quote_ident(col.lower()) for col in columns)
+                cur.execute(f"CREATE INDEX {option}IF NOT EXISTS {name} ON {table} USING {method} ({column_sql});")
+                print(f"✅ Tạo index {name} ({time.perf_counter() - start:.1f}s)")
+
+            gist = [index_name(table, method, columns) for method, columns in indexes if method == 'gist']
+            if cluster and gist:
+                cur.execute(f"CLUSTER {table} USING {gist[0]};")
+                print(f"✅ CLUSTER bảng {table} theo {gist[0]}")
+
+            cur.execute(f"ANALYZE {table};")
+            print(f"✅ ANALYZE bảng {table}")
+    finally:
+        conn.autocommit = autocommit
@@ -1,43 +1,32 @@
-import requests
 import time
 import pg8000
 import geopandas as gpd
 from shapely.geometry import box
 
-class NSWPointsOfInterestAPI:
-    def __init__(self, base_url):
-        self.base_url = base_url
-    
-    def get_poi_within_bbox(self, min_lat, min_lon, max_lat, max_lon):
-        """Lấy các điểm quan tâm trong một bounding box (min_lat, min_lon, max_lat, max_lon)."""
-        url = f"{self.base_url}/query"
-        params = {
-            "f": "json",
-            "geometry": f"{min_lon},{min_lat},{max_lon},{max_lat}",
-            "geometryType": "esriGeometryEnvelope",
-            "spatialRel": "esriSpatialRelIntersects",
-            "outFields": "*"  # Lấy tất cả các trường thông tin
-        }
-        
-        try:
-            response = requests.get(url, params=params)
-            response.raise_for_status()
-            data = response.json()
-            return data.get("features", [])
-        except requests.exceptions.RequestException as e:
-            print(f"❌ Lỗi khi lấy dữ liệu POI: {e}")
-            return []
+from poi_api import NSWPointsOfInterestAPI, ResponseCache
+from poi_harvest import (
+    BBoxQueryPlanner, ConcurrentPOIHarvester, HarvestJournal, harvest_tiles, inside_regions, owned_by_tile,
+    resumable_harvest, sa2_units, tile_units,
+)
+from utils import read_shapefile
+from POI import ensure_poi_key, write_pois
+from metrics import METRICS_PATH, configure, count_round_trips, print_summary, stage
 
 class SA2DataProcessor:
-    def __init__(self, db_config, shapefile_path, poi_api):
+    def __init__(self, db_config, shapefile_path, poi_api, harvester=None, harvest_mode='sa2', tile_size=0.05,
+                 journal=None):
         self.db_config = db_config
         self.shapefile_path = shapefile_path
         self.poi_api = poi_api
+        self.harvester = harvester  # ConcurrentPOIHarvester; None giữ vòng lặp tuần tự cũ
+        self.harvest_mode = harvest_mode  # 'sa2': mỗi SA2 một truy vấn, 'tiles': lưới ô dùng chung
+        self.tile_size = tile_size  # kích thước ô (độ) khi harvest_mode='tiles'
+        self.journal = journal  # HarvestJournal; có harvester thì bỏ qua các đơn vị đã xong khi chạy lại
 
     def connect(self):
         """Kết nối đến PostgreSQL và trả về đối tượng kết nối."""
         try:
-            conn = pg8000.connect(**self.db_config)
+            conn = count_round_trips(pg8000.connect(**self.db_config))
             print("✅ Kết nối đến PostgreSQL thành công!")
             return conn
         except Exception as e:
@@ -45,38 +34,30 @@ class SA2DataProcessor:
             return None
 
     def insert_pois(self, conn, sa2_code, pois):
-        """Chèn dữ liệu POI vào cơ sở dữ liệu PostgreSQL."""
-        insert_query = """
-        INSERT INTO points_of_interest (poigroup, poitype, poiname, poilabel, shape, startdate, enddate, lastupdate)
-        VALUES (%s, %s, %s, %s, ST_SetSRID(ST_GeomFromGeoJSON(%s), 4326), %s, %s, %s)
-        ON CONFLICT (poigroup) DO NOTHING;
-        """
-
+        """Chèn một lô POI: COPY vào bảng tạm rồi gộp vào points_of_interest bằng một lệnh ON CONFLICT (objectid)."""
         try:
-            with conn.cursor() as cur:
-                for poi in pois:
-                    print(poi)
-                    poi_id = poi['attributes']['objectid']
-                    poi_name = poi['attributes'].get('poiname', 'Unknown')
-                    poi_type = poi['attributes'].get('poilabeltype', 'Unknown')
-                    geometry = poi['geometry']
-                    startdate = poi['attributes'].get('startdate', None)
-                    enddate = poi['attributes'].get('enddate', None)
-                    lastupdate = poi['attributes'].get('lastupdate', None)
-                    if geometry:
-                        geom_wkt = f"POINT({geometry['x']} {geometry['y']})"
-                        data = (sa2_code, poi_id, poi_name, poi_type, geom_wkt, None, None, None)
-                        # print(data)
-                        
-                #         cur.execute(insert_query, data)
-                # conn.commit()
-                print(f"✅ Chèn dữ liệu POI cho SA2 {sa2_code} thành công!")
+            written = write_pois(conn, pois)
+            print(f"✅ Chèn {written} POI cho {sa2_code} thành công!")
+            return True
         except Exception as e:
             print(f"❌ Lỗi khi chèn dữ liệu POI vào cơ sở dữ liệu: {e}")
-            conn.rollback()
+            return False
 
     def process_sa2_pois(self, conn, gdf):
         """Lặp qua từng SA2 để lấy và chèn dữ liệu POI vào cơ sở dữ liệu."""
+        if self.harvester is not None and self.journal is not None:
+            self.harvest_resumable(conn, gdf)
+            return
+
+        if self.harvester is not None and self.harvest_mode == 'tiles':
+            for sa2_code, pois in harvest_tiles(self.harvester, gdf, self.tile_size):
+                self.insert_pois(conn, sa2_code, pois)
+            return
+
+        if self.harvester is not None:
+            self.harvest_concurrently(conn, gdf)
+            return
+
         for _, row in gdf.iterrows():
             sa2_code = row['SA2_CODE21']
             min_lon, min_lat, max_lon, max_lat = row['geometry'].bounds
@@ -93,16 +74,47 @@ class SA2DataProcessor:
             # Thời gian chờ 1 giây trước khi xử lý tiếp SA2 khác để tránh quá tải API
             time.sleep(10)
 
-    def process_data(self):
-        """Đọc dữ liệu từ Shapefile và trả về GeoDataFrame."""
+    def harvest_resumable(self, conn, gdf):
+        """Thu thập theo đơn vị (ô lưới hoặc bbox SA2) qua nhật ký checkpoint: đơn vị đã xong ở lần chạy
+        trước được bỏ qua, mỗi đơn vị được chèn + commit rồi mới ghi vào nhật ký. Chỉ POI nằm trong
+        các vùng SA2 của gdf được chèn."""
+        if self.harvest_mode == 'tiles':
+            # Khóa ô kèm phạm vi 'all': ô đã xong cho một vùng (task2.py) vẫn được thu thập lại cho toàn bộ SA2
+            units = tile_units(gdf, self.tile_size, scope='all')
+            boxes = dict(units)
+            # POI nằm trên cạnh chung của hai ô chỉ thuộc về một ô
+            select = lambda unit, pois: owned_by_tile(pois, boxes[unit])
+        else:
+            units = sa2_units(gdf)
+            select = lambda unit, pois: pois
+
+        def sink(unit, pois):
+            # Ô lưới/bbox SA2 phủ cả phần ngoài các vùng SA2 (biển, bang khác)
+            if not self.insert_pois(conn, unit, inside_regions(select(unit, pois), gdf)):
+                raise RuntimeError(f"Chèn POI thất bại cho đơn vị {unit}")
+
+        resumable_harvest(self.harvester, units, self.journal, sink)
+        print(f"🗂️ Nhật ký thu thập: {self.journal.stats()}")
+
+    def harvest_concurrently(self, conn, gdf):
+        """Lấy POI cho tất cả SA2 song song (có giới hạn tốc độ) và chèn ngay khi có kết quả."""
+        jobs = []
+        for _, row in gdf.iterrows():
+            min_lon, min_lat, max_lon, max_lat = row['geometry'].bounds
+            jobs.append((row['SA2_CODE21'], (min_lat, min_lon, max_lat, max_lon)))
+
+        for sa2_code, pois in self.harvester.harvest(jobs):
+            print(f"📍 Đang xử lý POI cho SA2 {sa2_code}...")
+            if pois:
+                self.insert_pois(conn, sa2_code, pois)
+            else:
+                print(f"⚠️ Không tìm thấy POI cho SA2 {sa2_code}.")
+
+    def process_data(self, where=None, bbox=None, mask=None, columns=('SA2_CODE21',), filters=None):
+        """Đọc dữ liệu SA2 (qua cache GeoParquet, bộ lọc và cột được đẩy xuống bộ đọc) và trả về GeoDataFrame."""
         print(f"📂 Đang xử lý file Shapefile {self.shapefile_path}...")
-        try:
-            gdf = gpd.read_file(self.shapefile_path, engine="pyogrio")
-            print(f"✅ Đọc file Shapefile {self.shapefile_path} thành công!")
-            return gdf
-        except Exception as e:
-            print(f"❌ Lỗi khi đọc Shapefile: {e}")
-            return None
+        return read_shapefile(self.shapefile_path, where=where, bbox=bbox, mask=mask,
+                              columns=list(columns) if columns else None, filters=filters)
 
 # Cấu hình kết nối cơ sở dữ liệu PostgreSQL
 db_config = {
@@ -120,8 +132,15 @@ shapefile_path = 'data/SA2_2021_AUST_SHP_GDA2020/SA2_2021_AUST_GDA2020.shp'
 poi_api_url = "https://maps.six.nsw.gov.au/arcgis/rest/services/public/NSW_POI/MapServer/0"
 
 # Khởi tạo đối tượng API và xử lý dữ liệu
-poi_api = NSWPointsOfInterestAPI(poi_api_url)
-processor = SA2DataProcessor(db_config, shapefile_path, poi_api)
+poi_api = NSWPointsOfInterestAPI(poi_api_url, cache=ResponseCache('data/poi_cache.sqlite'))
+harvester = ConcurrentPOIHarvester(poi_api, requests_per_second=1.0, max_workers=4,
+                                   planner=BBoxQueryPlanner(poi_api, max_workers=4))
+# Nhật ký checkpoint dùng chung với task2.py: dừng giữa chừng rồi chạy lại sẽ tiếp tục từ chỗ cũ
+processor = SA2DataProcessor(db_config, shapefile_path, poi_api, harvester, harvest_mode='tiles',
+                             journal=HarvestJournal('data/poi_harvest_journal.sqlite'))
+
+# Ghi bản ghi đo của từng bước ra data/metrics.jsonl
+configure(METRICS_PATH)
 
 # Kết nối đến cơ sở dữ liệu
 conn = processor.connect()
@@ -131,7 +150,12 @@ if conn:
 
     if gdf is not None:
         # Lấy và chèn dữ liệu POI cho từng SA2
-        processor.process_sa2_pois(conn, gdf)
+        with stage('poi'):
+            # Bảng cũ (khóa poigroup) được chuyển sang khóa objectid, nhật ký được làm mới theo
+            ensure_poi_key(conn, processor.journal)
+            processor.process_sa2_pois(conn, gdf)
 
     # Đóng kết nối cơ sở dữ liệu sau khi hoàn thành
     conn.close()
+    print(f"📦 Bộ nhớ đệm POI: {poi_api.cache.stats()}")
+    print_summary()
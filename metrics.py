@@ -0,0 +1,186 @@
+import functools
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:  # Windows: không có getrusage, bỏ qua số liệu bộ nhớ
+    resource = None
+
+# File JSON-lines mặc định cho bản ghi đo (mỗi bước một dòng). Chỉ được ghi khi
+# entry point (pipeline.py, các loader chạy trực tiếp...) gọi configure(METRICS_PATH).
+METRICS_PATH = 'data/metrics.jsonl'
+
+# Mã của lần chạy hiện tại, giúp tách các lần chạy trong cùng một file metrics
+RUN_ID = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:6]}"
+
+_config = {'path': None}
+_records = []
+_sequence = itertools.count()
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def configure(path=METRICS_PATH):
+    """Bật ghi bản ghi đo ra file ``path`` (``path=None`` chỉ giữ trong bộ nhớ cho bảng tổng kết, mặc định)."""
+    _config['path'] = path
+
+
+def peak_rss_mb():
+    """Bộ nhớ RSS lớn nhất của process tới thời điểm hiện tại (MB), None nếu không đo được."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux trả về KB, macOS trả về byte
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _active_stages():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def count_round_trips(conn):
+    """Đếm round trip của kết nối pg8000 ``conn`` vào các bước đang mở trên thread hiện tại.
+
+    Mỗi lần pg8000 chờ phản hồi tới ReadyForQuery là một round trip tới server
+    (execute, COPY, commit/rollback...). Chỉ kết nối được truyền vào bị bọc; trả về ``conn``.
+    """
+    if getattr(conn, '_metrics_counted', False):
+        return conn
+    handle_messages = conn.handle_messages
+
+    def counting_handle_messages(*args, **kwargs):
+        for active in _active_stages():
+            active.round_trips += 1
+        return handle_messages(*args, **kwargs)
+
+    conn.handle_messages = counting_handle_messages
+    conn._metrics_counted = True
+    return conn
+
+
+class Stage:
+    """Một bước đang được đo; gán ``rows`` (hoặc gọi ``add_rows``) khi biết số dòng đã xử lý."""
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = None
+        self.round_trips = 0
+        self.status = 'ok'
+        self.error = None
+
+    def add_rows(self, count):
+        self.rows = (self.rows or 0) + int(count)
+
+
+def _write(record):
+    path = _config['path']
+    if path is None:
+        return
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with _lock:
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+@contextmanager
+def stage(name, rows=None):
+    """Đo một bước: thời gian, số dòng, dòng/giây, RSS lớn nhất và số round trip tới DB.
+
+    Bước lồng nhau được đặt tên theo đường dẫn (``income/copy``). Bản ghi được
+    ghi ra file đã configure() khi bước kết thúc, kể cả khi bước bị lỗi. Round
+    trip chỉ được đếm trên kết nối đã qua count_round_trips().
+    """
+    stack = _active_stages()
+    current = Stage(f"{stack[-1].name}/{name}" if stack else name)
+    current.rows = rows
+    seq = next(_sequence)
+    started = datetime.now(timezone.utc)
+    rss_before = peak_rss_mb()
+    stack.append(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.status = 'failed'
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        stack.pop()
+        peak = peak_rss_mb()
+        record = {
+            'run_id': RUN_ID,
+            'seq': seq,
+            'stage': current.name,
+            'status': current.status,
+            'started': started.isoformat(timespec='seconds'),
+            'seconds': round(seconds, 4),
+            'rows': current.rows,
+            'rows_per_sec': round(current.rows / seconds, 1) if current.rows and seconds > 0 else None,
+            'peak_rss_mb': round(peak, 1) if peak is not None else None,
+            'rss_growth_mb': round(peak - rss_before, 1) if peak is not None else None,
+            'round_trips': current.round_trips,
+            'thread': threading.current_thread().name,
+        }
+        if current.error:
+            record['error'] = current.error
+        with _lock:
+            _records.append(record)
+        _write(record)
+
+
+def timed(name=None, rows=None):
+    """Decorator đo cả hàm như một bước (mặc định tên bước là tên hàm).
+
+    ``rows`` là hàm nhận kết quả trả về và trả về số dòng (ví dụ ``len``).
+    """
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(stage_name) as current:
+                result = func(*args, **kwargs)
+                if rows is not None and result is not None and current.rows is None:
+                    try:
+                        current.rows = int(rows(result))
+                    except (TypeError, ValueError):
+                        pass
+                return result
+        return wrapper
+    return decorator
+
+
+def records():
+    """Các bản ghi đo của lần chạy hiện tại (theo thứ tự kết thúc)."""
+    with _lock:
+        return list(_records)
+
+
+def print_summary(all_records=None):
+    """In bảng tổng kết các bước đã đo trong lần chạy (theo thứ tự bắt đầu)."""
+    rows = sorted(all_records if all_records is not None else records(), key=lambda r: r['seq'])
+    if not rows:
+        return
+    width = max(len('Bước'), *(len(r['stage']) for r in rows))
+    print(f"\n📊 Tổng kết đo đạc (run {RUN_ID})")
+    print(f"{'Bước':<{width}} {'Trạng thái':<10} {'Giây':>9} {'Dòng':>10} {'Dòng/giây':>12} "
+          f"{'RSS đỉnh (MB)':>14} {'Round trip':>10}")
+    for r in rows:
+        rows_text = '' if r['rows'] is None else f"{r['rows']:,}"
+        rate = '' if r['rows_per_sec'] is None else f"{r['rows_per_sec']:,.0f}"
+        rss = '' if r['peak_rss_mb'] is None else f"{r['peak_rss_mb']:,.0f}"
+        print(f"{r['stage']:<{width}} {r['status']:<10} {r['seconds']:>9.2f} {rows_text:>10} {rate:>12} "
+              f"{rss:>14} {r['round_trips']:>10}")
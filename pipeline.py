@@ -0,0 +1,212 @@
+import argparse
+import importlib
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+import pg8000
+
+from metrics import METRICS_PATH, configure, count_round_trips, print_summary
+
+# Cấu hình database dùng chung cho mọi bước của pipeline
+DB_CONFIG = {
+    'user': 'postgres',
+    'password': '1234',
+    'host': 'localhost',
+    'port': 5432,
+    'database': 'postgres'
+}
+
+# Các bước: tên -> ("module:hàm run(conn, load_mode)", các bước phải xong trước).
+# Thứ tự khai báo là thứ tự topo: mỗi bước đứng sau các bước nó phụ thuộc.
+STAGES = {
+    'sa2': ('SA2:run', []),
+    'stops': ('Stops:run', []),
+    'businesses': ('Businesses:run', []),
+    'income': ('Income:run', []),
+    'population': ('Population:run', []),
+    'catchments': ('Catchments:run', []),
+    'poi_table': ('POI:run', []),
+    'catchment_overlay': ('catchment_overlay:run', ['sa2', 'catchments']),
+    'poi': ('task2:run', ['sa2', 'poi_table']),
+    'scoring': ('scoring:run', ['sa2', 'stops', 'businesses', 'income', 'population', 'catchment_overlay', 'poi']),
+}
+
+
+class ConnectionPool:
+    """Pool kết nối pg8000 đơn giản, an toàn giữa các thread.
+
+    Kết nối được mở khi cần (tối đa `size`) và dùng lại giữa các bước. Khi trả
+    về pool, transaction đang mở được commit (hoặc rollback nếu bước bị lỗi).
+    """
+
+    def __init__(self, db_config, size):
+        self.db_config = db_config
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    def _acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            can_create = self.created < self.size
+            if can_create:
+                self.created += 1
+        if not can_create:
+            return self.idle.get()
+        try:
+            return count_round_trips(pg8000.connect(**self.db_config))
+        except Exception:
+            with self.lock:
+                self.created -= 1
+            raise
+
+    def _discard(self, conn):
+        with self.lock:
+            self.created -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                # Kết nối hỏng: bỏ đi, lần sau mở kết nối mới
+                self._discard(conn)
+                raise
+            self.idle.put(conn)
+            raise
+        self.idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(conn)
+
+
+def _resolve(target):
+    module_name, func_name = target.split(':')
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+def check_load_mode(runners, load_mode):
+    """Báo lỗi trước khi chạy nếu có bước không hỗ trợ `load_mode` (theo LOAD_MODES của module)."""
+    if load_mode is None:
+        return
+    unsupported = [
+        name for name, runner in runners.items()
+        if load_mode not in getattr(sys.modules[runner.__module__], 'LOAD_MODES', (load_mode,))
+    ]
+    if unsupported:
+        raise ValueError(f"Các bước {unsupported} không hỗ trợ chế độ nạp {load_mode!r}")
+
+
+def select_stages(names=None):
+    """Các bước cần chạy (kèm mọi bước phụ thuộc), theo thứ tự khai báo trong STAGES."""
+    if not names:
+        return list(STAGES)
+    unknown = [name for name in names if name not in STAGES]
+    if unknown:
+        raise ValueError(f"Bước không tồn tại: {unknown}. Các bước hợp lệ: {list(STAGES)}")
+    needed = set()
+    todo = list(names)
+    while todo:
+        name = todo.pop()
+        if name not in needed:
+            needed.add(name)
+            todo.extend(STAGES[name][1])
+    return [name for name in STAGES if name in needed]
+
+
+def run_pipeline(stages=None, db_config=DB_CONFIG, max_workers=4, load_mode=None):
+    """Chạy các bước theo đồ thị phụ thuộc; các bước độc lập chạy song song trên pool kết nối.
+
+    `load_mode` (None = mặc định của từng module) được truyền cho hàm run() của
+    mỗi bước. Bước có bước phụ thuộc bị lỗi sẽ bị bỏ qua. Trả về dict
+    tên bước -> (trạng thái, số giây).
+    """
+    selected = select_stages(stages)
+    # Import trước ở thread chính để thời gian import không tính vào bước nào
+    runners = {name: _resolve(STAGES[name][0]) for name in selected}
+    check_load_mode(runners, load_mode)
+    pool = ConnectionPool(db_config, max_workers)
+    results = {}
+
+    def run_stage(name):
+        start = time.perf_counter()
+        with pool.connection() as conn:
+            if load_mode is None:
+                runners[name](conn)
+            else:
+                runners[name](conn, load_mode)
+        return time.perf_counter() - start
+
+    pipeline_start = time.perf_counter()
+    pending = list(selected)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            for name in list(pending):
+                deps = STAGES[name][1]
+                if any(results.get(dep, ('ok',))[0] != 'ok' for dep in deps if dep in results):
+                    results[name] = ('skipped', 0.0)
+                    pending.remove(name)
+                    print(f"⏭️ Bỏ qua bước {name}: bước phụ thuộc không thành công.")
+                elif all(results.get(dep, (None,))[0] == 'ok' for dep in deps):
+                    print(f"⏳ Bắt đầu bước {name}...")
+                    running[executor.submit(run_stage, name)] = name
+                    pending.remove(name)
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = ('ok', future.result())
+                    print(f"✅ Xong bước {name} ({results[name][1]:.1f}s)")
+                except Exception as e:
+                    results[name] = ('failed', 0.0)
+                    print(f"❌ Bước {name} bị lỗi: {e}")
+    pool.close()
+
+    wall = time.perf_counter() - pipeline_start
+    width = max(12, *(len(name) for name in selected))
+    print(f"\n{'Bước':<{width}} {'Trạng thái':<10} {'Thời gian (s)':>14}")
+    for name in selected:
+        status, seconds = results[name]
+        print(f"{name:<{width}} {status:<10} {seconds:>14.1f}")
+    total = sum(seconds for _, seconds in results.values())
+    print(f"⏱️ Tổng thời gian thực: {wall:.1f}s (cộng dồn các bước: {total:.1f}s)")
+    print_summary()
+    return results
+
+
+if __name__ == '__main__':
+    # Ghi bản ghi đo của từng bước ra data/metrics.jsonl
+    configure(METRICS_PATH)
+    parser = argparse.ArgumentParser(description="Nạp toàn bộ dữ liệu theo đồ thị phụ thuộc giữa các bước.")
+    parser.add_argument('stages', nargs='*', help=f"Các bước cần chạy (mặc định: tất cả). Gồm: {', '.join(STAGES)}")
+    parser.add_argument('--workers', type=int, default=4, help="Số bước chạy song song / số kết nối tối đa")
+    parser.add_argument('--load-mode', choices=['incremental', 'shadow', 'full'], default=None,
+                        help="Chế độ nạp cho các loader (mặc định: theo từng module)")
+    args = parser.parse_args()
+    run_pipeline(args.stages, max_workers=args.workers, load_mode=args.load_mode)
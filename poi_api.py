@@ -0,0 +1,230 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# HTTP status codes worth retrying (rate limited / transient server errors)
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Thread-safe token bucket: at most `rate` requests per second, bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available, then consume it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class ResponseCache:
+    """
+    On-disk (SQLite) cache of JSON responses keyed on the normalized query.
+
+    Entries expire after `ttl` seconds; when the stored payloads exceed
+    `max_size_mb` the least recently used entries are evicted.
+    """
+
+    def __init__(self, path="data/poi_cache.sqlite", ttl=7 * 24 * 3600, max_size_mb=512):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                body TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self.db.commit()
+
+    @staticmethod
+    def make_key(url, params):
+        """Hash of the URL and params with sorted keys and fixed-precision envelope coordinates."""
+        normalized = {str(k): str(v).strip() for k, v in params.items()}
+        if "geometry" in normalized:
+            try:
+                coords = [float(c) for c in normalized["geometry"].split(",")]
+                normalized["geometry"] = ",".join(f"{c:.7f}" for c in coords)
+            except ValueError:
+                pass
+        payload = json.dumps([url, sorted(normalized.items())])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Return the cached JSON for `key`, or None if missing or expired."""
+        now = time.time()
+        with self.lock:
+            row = self.db.execute("SELECT body, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self.db.commit()
+                self.misses += 1
+                return None
+            self.db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self.db.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, data):
+        body = json.dumps(data)
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses (key, body, size, created, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, body, len(body), now, now),
+            )
+            self._evict()
+            self.db.commit()
+
+    def _evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes."""
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self.db.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+
+    def stats(self):
+        with self.lock:
+            entries, size = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
+
+
+class NSWPointsOfInterestAPI:
+    def __init__(self, base_url, rate_limiter=None, max_retries=5, backoff=1.0, timeout=30, pool_size=16,
+                 cache=None):
+        self.base_url = base_url
+        self.rate_limiter = rate_limiter
+        self.concurrency = None  # AdaptiveConcurrency fed with the HTTP round-trip time; None = unlimited
+        self.cache = cache  # ResponseCache; None disables caching
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        # One keep-alive session shared by all calls (and threads)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _retry_delay(self, response, attempt):
+        """Seconds to wait before retry number `attempt` (honours Retry-After)."""
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        return self.backoff * (2 ** attempt)
+
+    def query(self, params):
+        """Send one /query request with rate limiting and retry/backoff on 429/5xx."""
+        url = f"{self.base_url}/query"
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(url, params)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        data = self._fetch(url, params)
+        # ArcGIS reports some failures as HTTP 200 with an "error" body; never cache those
+        if cache_key is not None and "error" not in data:
+            self.cache.put(cache_key, data)
+        return data
+
+    def _fetch(self, url, params):
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            response = None
+            try:
+                response = self._get(url, params)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    response.raise_for_status()
+                    return response.json()
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                print(f"⚠️ Request failed ({e}), attempt {attempt + 1}/{self.max_retries + 1}")
+            if attempt < self.max_retries:
+                time.sleep(self._retry_delay(response, attempt))
+        raise requests.exceptions.RetryError(f"Giving up on {url} after {self.max_retries + 1} attempts")
+
+    def _get(self, url, params):
+        """One HTTP round trip; only this time (no rate-limit or retry waits) is reported to `concurrency`."""
+        if self.concurrency is None:
+            return self.session.get(url, params=params, timeout=self.timeout)
+        self.concurrency.acquire()
+        start = time.monotonic()
+        try:
+            return self.session.get(url, params=params, timeout=self.timeout)
+        finally:
+            self.concurrency.release(time.monotonic() - start)
+
+    @staticmethod
+    def bbox_params(min_lat, min_lon, max_lat, max_lon):
+        """Envelope query parameters for a bounding box."""
+        return {
+            "f": "json",
+            "geometry": f"{min_lon},{min_lat},{max_lon},{max_lat}",
+            "geometryType": "esriGeometryEnvelope",
+            "spatialRel": "esriSpatialRelIntersects",
+            "inSR": 4326,
+            "outSR": 4326,
+            "outFields": "*"
+        }
+
+    def query_bbox(self, min_lat, min_lon, max_lat, max_lon, result_offset=None, record_count=None,
+                   count_only=False):
+        """Raw envelope query; returns the whole JSON body (features, exceededTransferLimit, count)."""
+        params = self.bbox_params(min_lat, min_lon, max_lat, max_lon)
+        if result_offset is not None:
+            params["resultOffset"] = result_offset
+            params["resultRecordCount"] = record_count
+            params["orderByFields"] = "objectid"
+        if count_only:
+            params["returnCountOnly"] = "true"
+        return self.query(params)
+
+    def get_poi_within_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """
+        i) Return all points of interest within bounding box (min_lat, min_lon, max_lat, max_lon)
+        """
+        try:
+            data = self.query_bbox(min_lat, min_lon, max_lat, max_lon)
+            if data.get("exceededTransferLimit"):
+                print(f"⚠️ Result truncated by the server for bbox {(min_lat, min_lon, max_lat, max_lon)}; "
+                      "use BBoxQueryPlanner for a complete harvest.")
+            return data.get("features", [])
+        except requests.exceptions.RequestException as e:
+            print(f"❌ Error fetching POI data: {e}")
+            return []
@@ -0,0 +1,461 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import geopandas as gpd
+import requests
+import shapely
+
+from poi_api import TokenBucket
+
+
+def poi_key(feature):
+    """Stable identity of a POI feature: its objectid, else name + coordinates."""
+    attr = feature.get('attributes', {})
+    object_id = attr.get('objectid', attr.get('OBJECTID'))
+    if object_id is not None:
+        return object_id
+    geom = feature.get('geometry') or {}
+    return (attr.get('poiname'), geom.get('x'), geom.get('y'))
+
+
+def split_bbox(bbox):
+    """Split (min_lat, min_lon, max_lat, max_lon) into its four quadrants."""
+    min_lat, min_lon, max_lat, max_lon = bbox
+    mid_lat = (min_lat + max_lat) / 2
+    mid_lon = (min_lon + max_lon) / 2
+    return [
+        (min_lat, min_lon, mid_lat, mid_lon),
+        (min_lat, mid_lon, mid_lat, max_lon),
+        (mid_lat, min_lon, max_lat, mid_lon),
+        (mid_lat, mid_lon, max_lat, max_lon),
+    ]
+
+
+class BBoxQueryPlanner:
+    """
+    Fetch every POI in a bbox even when the server caps the result size.
+
+    A query whose response has `exceededTransferLimit` is either split into
+    quadrants (strategy="split", repeated level by level up to `max_depth`) or
+    paged with resultOffset (strategy="page"). Sub-queries of one level run in
+    parallel and results are merged by objectid.
+    """
+
+    def __init__(self, poi_api, max_workers=4, max_depth=8, strategy="split"):
+        self.poi_api = poi_api
+        self.max_workers = max_workers
+        self.max_depth = max_depth
+        self.strategy = strategy
+        self.requests_made = 0
+        self.lock = threading.Lock()
+
+    def _query(self, bbox, strict=False, **kwargs):
+        with self.lock:
+            self.requests_made += 1
+        try:
+            data = self.poi_api.query_bbox(*bbox, **kwargs)
+        except requests.exceptions.RequestException as e:
+            if strict:
+                raise
+            print(f"❌ Error fetching POI data for bbox {bbox}: {e}")
+            return {}
+        if strict and "error" in data:
+            raise requests.exceptions.RequestException(f"Server error for bbox {bbox}: {data['error']}")
+        return data
+
+    def _pages(self, executor, bbox, first_page, strict=False):
+        """
+        Every page of a truncated bbox, fetched in parallel.
+
+        The first response has no ordering, so it cannot serve as page 0 of an
+        objectid-ordered listing: all pages, offset 0 included, are requested
+        with the same ordering.
+        """
+        page_size = len(first_page.get('features', []))
+        total = self._query(bbox, strict, count_only=True).get('count', 0)
+        offsets = range(0, total, page_size) if page_size else []
+        return executor.map(
+            lambda offset: self._query(bbox, strict, result_offset=offset, record_count=page_size), offsets
+        )
+
+    def fetch(self, bbox, strict=False):
+        """
+        Return the merged (deduplicated by objectid) features within `bbox`.
+
+        With `strict`, a failed request raises instead of being skipped, so the
+        caller never mistakes a partial result for a complete one.
+        """
+        features = {}
+        frontier = [(bbox, 0)]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while frontier:
+                responses = executor.map(lambda item: self._query(item[0], strict), frontier)
+                next_frontier = []
+                for (box, depth), data in zip(frontier, responses):
+                    for feature in data.get('features', []):
+                        features.setdefault(poi_key(feature), feature)
+                    if not data.get('exceededTransferLimit'):
+                        continue
+                    if self.strategy == "page":
+                        for page in self._pages(executor, box, data, strict):
+                            for feature in page.get('features', []):
+                                features.setdefault(poi_key(feature), feature)
+                    elif depth < self.max_depth:
+                        next_frontier.extend((child, depth + 1) for child in split_bbox(box))
+                    else:
+                        print(f"⚠️ Bbox {box} is still truncated at depth {depth}; some POIs may be missing.")
+                frontier = next_frontier
+        return list(features.values())
+
+
+class AdaptiveConcurrency:
+    """AIMD limit on in-flight requests: +1 while latency is fine, halve when it rises."""
+
+    def __init__(self, max_limit, min_limit=1, latency_target=2.0):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.latency_target = latency_target
+        self.limit = max_limit
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= self.limit:
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency):
+        with self.condition:
+            self.in_flight -= 1
+            if latency > self.latency_target:
+                self.limit = max(self.min_limit, self.limit // 2)
+            elif self.limit < self.max_limit:
+                self.limit += 1
+            self.condition.notify_all()
+
+
+class ConcurrentPOIHarvester:
+    """Fetch POIs for many bounding boxes concurrently on a thread pool.
+
+    Requests share one keep-alive session, a token-bucket rate limit
+    (`requests_per_second`) and an adaptive concurrency limit that backs
+    off when the HTTP round trip takes longer than `latency_target` seconds.
+    """
+
+    def __init__(self, poi_api, requests_per_second=2.0, max_workers=8, min_workers=1, latency_target=2.0,
+                 planner=None):
+        self.poi_api = poi_api
+        self.poi_api.rate_limiter = TokenBucket(requests_per_second)
+        self.planner = planner  # BBoxQueryPlanner to resolve truncated results; None = single query
+        self.max_workers = max_workers
+        self.concurrency = AdaptiveConcurrency(max_workers, min_workers, latency_target)
+        # The limit applies per HTTP request, so planner sub-queries and retries are counted individually
+        self.poi_api.concurrency = self.concurrency
+
+    def _fetch(self, bbox, strict=False):
+        if self.planner is not None:
+            return self.planner.fetch(bbox, strict=strict)
+        if strict:
+            data = self.poi_api.query_bbox(*bbox)
+            if "error" in data:
+                raise requests.exceptions.RequestException(f"Server error for bbox {bbox}: {data['error']}")
+            return data.get("features", [])
+        return self.poi_api.get_poi_within_bbox(*bbox)
+
+    def harvest(self, jobs, on_error=None):
+        """
+        Fetch every (key, (min_lat, min_lon, max_lat, max_lon)) job and yield
+        (key, pois) in completion order, so the caller can insert on its own connection.
+
+        With `on_error`, failed requests are not swallowed: the job is reported
+        as on_error(key, exception) and left out of the results.
+        """
+        strict = on_error is not None
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self._fetch, bbox, strict): key for key, bbox in jobs}
+            for future in as_completed(futures):
+                try:
+                    pois = future.result()
+                except requests.exceptions.RequestException as e:
+                    if not strict:
+                        raise
+                    on_error(futures[future], e)
+                    continue
+                yield futures[future], pois
+
+
+def make_tile_grid(bounds, tile_size):
+    """Non-overlapping (min_lat, min_lon, max_lat, max_lon) tiles covering (min_lon, min_lat, max_lon, max_lat)."""
+    min_lon, min_lat, max_lon, max_lat = bounds
+    n_cols = max(1, math.ceil((max_lon - min_lon) / tile_size))
+    n_rows = max(1, math.ceil((max_lat - min_lat) / tile_size))
+    tiles = []
+    for row in range(n_rows):
+        for col in range(n_cols):
+            tiles.append((
+                min_lat + row * tile_size,
+                min_lon + col * tile_size,
+                min(max_lat, min_lat + (row + 1) * tile_size),
+                min(max_lon, min_lon + (col + 1) * tile_size),
+            ))
+    return tiles
+
+
+def harvest_tiles(harvester, sa2_gdf, tile_size=0.05, sa2_column='SA2_CODE21'):
+    """
+    Harvest POIs for all SA2s in `sa2_gdf` with one request per grid tile instead of one per SA2 bbox.
+
+    Only tiles touching an SA2 polygon are fetched. Features are deduplicated by
+    objectid and assigned to their SA2 locally with a point-in-polygon join on the
+    SA2 spatial index. Returns a list of (sa2_code, pois).
+    """
+    tiles = make_tile_grid(sa2_gdf.total_bounds, tile_size)
+    tile_boxes = shapely.box(
+        [t[1] for t in tiles], [t[0] for t in tiles], [t[3] for t in tiles], [t[2] for t in tiles]
+    )
+    tile_idx, sa2_idx = sa2_gdf.sindex.query(tile_boxes, predicate='intersects')
+    # Tiles that only touch an SA2 edge add nothing: neighbouring tiles already include the edge
+    overlaps = ~shapely.touches(tile_boxes[tile_idx], sa2_gdf.geometry.values[sa2_idx])
+    touched = sorted(set(tile_idx[overlaps]))
+    print(f"🧱 {len(touched)} tiles (of {len(tiles)}) cover {len(sa2_gdf)} SA2 regions.")
+
+    features = {}
+    for _, pois in harvester.harvest((i, tiles[i]) for i in touched):
+        for feature in pois:
+            features.setdefault(poi_key(feature), feature)
+
+    pois = [f for f in features.values() if f.get('geometry')]
+    if not pois:
+        return []
+    points = gpd.GeoDataFrame(
+        {'poi': range(len(pois))},
+        geometry=gpd.points_from_xy([f['geometry']['x'] for f in pois], [f['geometry']['y'] for f in pois]),
+        crs=sa2_gdf.crs,
+    )
+    joined = gpd.sjoin(points, sa2_gdf[[sa2_column, 'geometry']], how='inner', predicate='intersects')
+    # A POI on a shared boundary belongs to the first SA2 only
+    joined = joined.drop_duplicates(subset='poi')
+    print(f"✅ {len(features)} unique POIs downloaded, {len(joined)} assigned to an SA2.")
+
+    return [
+        (sa2_code, [pois[i] for i in group['poi']])
+        for sa2_code, group in joined.groupby(sa2_column, sort=False)
+    ]
+
+
+# Region kinds accepted in harvest region lists ("sa4:11601", "gccsa:1GSYD", "state:1")
+REGION_COLUMNS = {'sa4': 'SA4_CODE21', 'gccsa': 'GCC_CODE21', 'state': 'STE_CODE21'}
+
+
+def region_filters(regions):
+    """
+    Turn region specs into one shapefile filter per region kind, e.g.
+    ["sa4:11601", "sa4:11602", "state:2"] -> [[('SA4_CODE21', 'in', [...])], [('STE_CODE21', 'in', ['2'])]].
+    A bare code is taken as an SA4 code.
+    """
+    codes = {}
+    for region in regions:
+        kind, _, code = str(region).rpartition(':')
+        kind = kind.lower() or 'sa4'
+        if kind not in REGION_COLUMNS:
+            raise ValueError(f"Unknown region kind {kind!r} in {region!r}; expected one of {list(REGION_COLUMNS)}")
+        codes.setdefault(REGION_COLUMNS[kind], []).append(code)
+    return [[(column, 'in', values)] for column, values in codes.items()]
+
+
+def selection_scope(regions):
+    """Canonical journal scope for a region list, e.g. ["11601", "state:1"] -> "sa4:11601,state:1"."""
+    specs = set()
+    for region in regions:
+        kind, _, code = str(region).rpartition(':')
+        specs.add(f"{kind.lower() or 'sa4'}:{code}")
+    return ','.join(sorted(specs))
+
+
+class HarvestJournal:
+    """
+    Checkpoint journal (SQLite) of completed harvest units.
+
+    A unit is recorded only after its POIs were committed to the database, so
+    after a crash or Ctrl+C the harvest resumes with the units that did not finish.
+    """
+
+    def __init__(self, path="data/poi_harvest_journal.sqlite"):
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS units (
+                unit TEXT PRIMARY KEY,
+                pois INTEGER NOT NULL,
+                finished REAL NOT NULL
+            )
+        """)
+        self.db.commit()
+
+    def completed(self, units):
+        """The subset of `units` already recorded as finished."""
+        with self.lock:
+            done = {row[0] for row in self.db.execute("SELECT unit FROM units")}
+        return done.intersection(units)
+
+    def mark_done(self, unit, pois):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO units (unit, pois, finished) VALUES (?, ?, ?)", (unit, pois, time.time())
+            )
+            self.db.commit()
+
+    def reset(self):
+        """Forget every completed unit (the next harvest starts from scratch)."""
+        with self.lock:
+            self.db.execute("DELETE FROM units")
+            self.db.commit()
+
+    def stats(self):
+        with self.lock:
+            units, pois = self.db.execute("SELECT COUNT(*), COALESCE(SUM(pois), 0) FROM units").fetchone()
+        return {"units": units, "pois": pois}
+
+
+def format_duration(seconds):
+    """1h 02m / 5m 07s / 42s."""
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}h {minutes:02d}m"
+    if minutes:
+        return f"{minutes}m {seconds:02d}s"
+    return f"{seconds}s"
+
+
+class HarvestProgress:
+    """Progress of a harvest: units done (including earlier runs), POIs, rate and ETA from this run's pace."""
+
+    def __init__(self, total, done=0, report_every=10.0):
+        self.total = total
+        self.done = done
+        self.done_this_run = 0
+        self.failed = 0
+        self.pois = 0
+        self.report_every = report_every
+        self.started = time.monotonic()
+        self.last_report = None
+
+    def eta(self):
+        """Seconds until every unit is done, None before the first unit of this run finishes."""
+        if not self.done_this_run:
+            return None
+        elapsed = time.monotonic() - self.started
+        return elapsed / self.done_this_run * (self.total - self.done - self.failed)
+
+    def update(self, pois):
+        self.done += 1
+        self.done_this_run += 1
+        self.pois += pois
+        now = time.monotonic()
+        if self.last_report is None or now - self.last_report >= self.report_every or self.done == self.total:
+            self.last_report = now
+            self.report()
+
+    def report(self):
+        elapsed = time.monotonic() - self.started
+        rate = self.done_this_run / elapsed if elapsed > 0 else 0.0
+        eta = self.eta()
+        percent = 100.0 * self.done / self.total if self.total else 100.0
+        print(f"📈 {self.done}/{self.total} units ({percent:.1f}%), {self.pois:,} POIs this run, "
+              f"{rate:.2f} units/s, ETA {format_duration(eta) if eta is not None else '?'}"
+              + (f", {self.failed} failed" if self.failed else ""))
+
+
+def tile_units(sa2_gdf, tile_size=0.05, scope='all'):
+    """
+    ("tile:<size>:<col>:<row>@<scope>", bbox) units for the tiles of a global grid that overlap an SA2 polygon.
+
+    The grid is anchored at (0, 0), so a tile has the same position whichever regions
+    are being harvested. Only the POIs of the current selection are inserted, so the
+    key also carries `scope` (see selection_scope): a border tile finished for one
+    region is fetched again (from the response cache) for a neighbouring region.
+    """
+    min_lon, min_lat, max_lon, max_lat = sa2_gdf.total_bounds
+    cols = range(math.floor(min_lon / tile_size), math.ceil(max_lon / tile_size))
+    rows = range(math.floor(min_lat / tile_size), math.ceil(max_lat / tile_size))
+    cells = [(col, row) for row in rows for col in cols]
+    tile_boxes = shapely.box(
+        [col * tile_size for col, _ in cells], [row * tile_size for _, row in cells],
+        [(col + 1) * tile_size for col, _ in cells], [(row + 1) * tile_size for _, row in cells],
+    )
+    tile_idx, sa2_idx = sa2_gdf.sindex.query(tile_boxes, predicate='intersects')
+    overlaps = ~shapely.touches(tile_boxes[tile_idx], sa2_gdf.geometry.values[sa2_idx])
+    units = []
+    for i in sorted(set(tile_idx[overlaps])):
+        col, row = cells[i]
+        bbox = (row * tile_size, col * tile_size, (row + 1) * tile_size, (col + 1) * tile_size)
+        units.append((f"tile:{tile_size:g}:{col}:{row}@{scope}", bbox))
+    return units
+
+
+def sa2_units(sa2_gdf, sa2_column='SA2_CODE21'):
+    """("sa2:<code>", bbox) units, one query per SA2 bounding box."""
+    units = []
+    for code, geometry in zip(sa2_gdf[sa2_column], sa2_gdf.geometry):
+        if geometry is None or geometry.is_empty:
+            continue
+        min_lon, min_lat, max_lon, max_lat = geometry.bounds
+        units.append((f"sa2:{code}", (min_lat, min_lon, max_lat, max_lon)))
+    return units
+
+
+def owned_by_tile(pois, bbox):
+    """
+    POIs whose point lies in the half-open tile [min, max): a POI on a shared
+    tile edge is returned by both envelope queries but kept by one tile only.
+    """
+    min_lat, min_lon, max_lat, max_lon = bbox
+    return [
+        f for f in pois
+        if f.get('geometry') and min_lon <= f['geometry']['x'] < max_lon and min_lat <= f['geometry']['y'] < max_lat
+    ]
+
+
+def inside_regions(pois, sa2_gdf):
+    """POIs whose point falls in (or on the edge of) one of the `sa2_gdf` polygons (SA2 spatial index)."""
+    pois = [f for f in pois if f.get('geometry')]
+    if not pois:
+        return []
+    points = gpd.points_from_xy([f['geometry']['x'] for f in pois], [f['geometry']['y'] for f in pois])
+    point_idx, _ = sa2_gdf.sindex.query(points, predicate='intersects')
+    return [pois[i] for i in sorted(set(point_idx))]
+
+
+def resumable_harvest(harvester, units, journal, sink, report_every=10.0):
+    """
+    Harvest (unit, bbox) units, skipping those the journal already has.
+
+    `sink(unit, pois)` must write and commit the POIs; the unit is journaled
+    only after it returns. Failed requests are reported and retried on the
+    next run. Returns the HarvestProgress.
+    """
+    done = journal.completed(unit for unit, _ in units)
+    pending = [(unit, bbox) for unit, bbox in units if unit not in done]
+    progress = HarvestProgress(len(units), len(done), report_every)
+    print(f"🧭 {len(units)} harvest units, {len(done)} already done, {len(pending)} to fetch.")
+
+    def failed(unit, error):
+        progress.failed += 1
+        print(f"❌ Harvest unit {unit} failed ({error}); it will be retried on the next run.")
+
+    for unit, pois in harvester.harvest(pending, on_error=failed):
+        sink(unit, pois)
+        journal.mark_done(unit, len(pois))
+        progress.update(len(pois))
+    if progress.failed:
+        progress.report()
+    return progress
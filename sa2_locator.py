@@ -0,0 +1,166 @@
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import shapely
+from shapely import STRtree
+
+from geometry_resolution import PRECISION_GRID, core_geometries, resolution_margin, simplify_geometries
+
+# Số điểm mỗi chunk gửi cho một process
+PARALLEL_CHUNK_SIZE = 50000
+
+# SA2Locator riêng của mỗi process worker (dựng một lần trong initializer)
+_worker_locator = None
+
+
+def _init_worker(codes, wkb, crs, tolerance, grid_size):
+    global _worker_locator
+    _worker_locator = SA2Locator(codes, shapely.from_wkb(wkb), crs, tolerance, grid_size)
+
+
+def _locate_chunk(chunk):
+    # Điểm được gửi dưới dạng mảng toạ độ (rẻ hơn WKB), geometry khác dạng WKB
+    kind, data = chunk
+    geometries = shapely.points(data) if kind == 'xy' else shapely.from_wkb(data)
+    return _worker_locator.locate(geometries)
+
+
+class SA2Locator:
+    """Gán mã SA2 cho điểm: STRtree (lọc bbox) + geometry đã prepare (kiểm tra within chính xác).
+
+    Cây chỉ được xây một lần và dùng lại cho stops, schools và POI; có thể lưu
+    xuống đĩa bằng save()/load().
+
+    Với ``tolerance`` (cùng đơn vị với CRS), cây được dựng trên bản đơn giản hóa
+    của SA2: điểm nằm trong vùng lõi được nhận ngay, chỉ các điểm cách biên bản
+    đơn giản hóa không quá margin mới được kiểm tra trên geometry gốc, nên kết
+    quả giống hệt ``tolerance=None``.
+    """
+
+    def __init__(self, codes, geometries, crs=None, tolerance=None, grid_size=PRECISION_GRID):
+        self.codes = np.asarray(codes, dtype=object)
+        self.geometries = np.asarray(geometries, dtype=object)
+        self.crs = crs
+        self.tolerance = tolerance
+        self.grid_size = grid_size
+        shapely.prepare(self.geometries)
+        if tolerance is None:
+            self.tree = STRtree(self.geometries)
+            return
+        self.margin = resolution_margin(tolerance, grid_size)
+        simple = simplify_geometries(self.geometries, tolerance, grid_size)
+        self.cores = core_geometries(simple, self.margin)
+        shapely.prepare(simple)
+        shapely.prepare(self.cores)
+        self.tree = STRtree(simple)
+
+    @classmethod
+    def from_geodataframe(cls, gdf, code_column='sa2_code', tolerance=None, grid_size=PRECISION_GRID):
+        gdf = gdf[gdf.geometry.notna()]
+        crs = gdf.crs.to_string() if gdf.crs is not None else None
+        return cls(gdf[code_column].to_numpy(), gdf.geometry.values, crs, tolerance, grid_size)
+
+    def _query(self, points):
+        """Các cặp (điểm, SA2) mà điểm nằm trong SA2 (theo geometry gốc)."""
+        if self.tolerance is None:
+            return self.tree.query(points, predicate='within')
+        # Lọc thô: điểm thuộc SA2 gốc thì cách bản đơn giản hóa không quá margin
+        point_idx, sa2_idx = self.tree.query(points, predicate='dwithin', distance=self.margin)
+        inside = shapely.contains(self.cores[sa2_idx], points[point_idx])
+        near = np.flatnonzero(~inside)
+        inside[near] = shapely.contains(self.geometries[sa2_idx[near]], points[point_idx[near]])
+        return point_idx[inside], sa2_idx[inside]
+
+    def locate(self, points):
+        """Trả về mảng mã SA2 (NaN nếu không thuộc SA2 nào), cùng thứ tự với `points`."""
+        points = np.asarray(points, dtype=object)
+        result = np.full(len(points), np.nan, dtype=object)
+        point_idx, sa2_idx = self._query(points)
+        # Nếu một điểm thuộc nhiều vùng thì lấy vùng đầu tiên (query trả về theo thứ tự điểm)
+        first = np.unique(point_idx, return_index=True)[1]
+        result[point_idx[first]] = self.codes[sa2_idx[first]]
+        return result
+
+    def overlay(self, geometries):
+        """Mọi cặp (geometry, SA2) giao nhau, kèm diện tích phần giao và tỷ lệ diện tích của geometry.
+
+        Trả về (chỉ số geometry, chỉ số SA2, diện tích giao, tỷ lệ), diện tích theo
+        đơn vị của CRS. Cặp chỉ chạm biên có diện tích 0.
+        """
+        geometries = np.asarray(geometries, dtype=object)
+        if self.tolerance is None:
+            geom_idx, sa2_idx = self.tree.query(geometries, predicate='intersects')
+        else:
+            geom_idx, sa2_idx = self.tree.query(geometries, predicate='dwithin', distance=self.margin)
+            hit = shapely.intersects(self.cores[sa2_idx], geometries[geom_idx])
+            near = np.flatnonzero(~hit)
+            hit[near] = shapely.intersects(self.geometries[sa2_idx[near]], geometries[geom_idx[near]])
+            geom_idx, sa2_idx = geom_idx[hit], sa2_idx[hit]
+
+        geoms, regions = geometries[geom_idx], self.geometries[sa2_idx]
+        area = shapely.area(geoms)
+        # Geometry nằm trọn trong SA2 (phần lớn các cặp) không cần tính phần giao
+        partial = np.flatnonzero(~shapely.covered_by(geoms, regions))
+        intersection_area = area.copy()
+        intersection_area[partial] = shapely.area(shapely.intersection(geoms[partial], regions[partial]))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fraction = np.where(area > 0, intersection_area / area, 0.0)
+        return geom_idx, sa2_idx, intersection_area, fraction
+
+    def locate_parallel(self, points, workers=None, chunk_size=PARALLEL_CHUNK_SIZE):
+        """Như locate() nhưng chia điểm theo không gian thành các chunk và chạy trên nhiều process.
+
+        Mỗi worker nhận một bản SA2 (WKB) chỉ đọc lúc khởi tạo; kết quả được trả về
+        đúng thứ tự ban đầu của `points`.
+        """
+        points = np.asarray(points, dtype=object)
+        if len(points) <= chunk_size or workers == 1:
+            return self.locate(points)
+
+        # Sắp điểm theo ô lưới 1 độ để mỗi chunk chỉ chạm một phần nhỏ của cây
+        xy = shapely.get_coordinates(shapely.centroid(points), include_z=False)
+        has_xy = ~shapely.is_missing(points) & ~shapely.is_empty(points)
+        x = np.full(len(points), np.inf)
+        y = np.full(len(points), np.inf)
+        x[has_xy], y[has_xy] = xy[:, 0], xy[:, 1]
+        order = np.lexsort((y, np.floor(x)))
+
+        all_points = bool(has_xy.all()) and bool((shapely.get_type_id(points) == 0).all())
+        chunks = []
+        for start in range(0, len(points), chunk_size):
+            idx = order[start:start + chunk_size]
+            if all_points:
+                chunks.append(('xy', np.column_stack((x[idx], y[idx]))))
+            else:
+                chunks.append(('wkb', shapely.to_wkb(points[idx])))
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(self.codes, shapely.to_wkb(self.geometries), self.crs, self.tolerance, self.grid_size),
+        ) as executor:
+            located = np.concatenate(list(executor.map(_locate_chunk, chunks)))
+
+        result = np.empty(len(points), dtype=object)
+        result[order] = located
+        return result
+
+    def save(self, path):
+        """Lưu mã SA2 và geometry (WKB) xuống đĩa; cây được dựng lại khi load."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'wb') as f:
+            pickle.dump({
+                'codes': self.codes,
+                'wkb': shapely.to_wkb(self.geometries),
+                'crs': self.crs,
+                'tolerance': self.tolerance,
+                'grid_size': self.grid_size,
+            }, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+        return cls(data['codes'], shapely.from_wkb(data['wkb']), data['crs'],
+                   data.get('tolerance'), data.get('grid_size', PRECISION_GRID))
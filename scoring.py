@@ -0,0 +1,109 @@
+import os
+import time
+
+from metrics import stage
+
+# File SQL tạo hàm sigmoid, bảng sa2_metrics, hàm refresh_sa2_metrics và materialized view sa2_scores
+# (đường dẫn theo vị trí module, không theo thư mục làm việc: benchmark chạy trong thư mục dữ liệu giả lập)
+SCORING_SQL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'task3.sql')
+
+# Các bảng nguồn của sa2_metrics; 'sa2' đứng đầu vì nó quyết định danh sách SA2
+METRIC_SOURCES = ['sa2', 'businesses', 'population_data', 'catchment_sa2', 'stops', 'points_of_interest']
+
+
+def create_scoring_schema(conn, sql_path=SCORING_SQL_PATH):
+    """Chạy task3.sql (nhiều câu lệnh, idempotent) bằng simple query protocol."""
+    with open(sql_path, encoding='utf-8') as f:
+        conn.execute_simple(f.read())
+
+
+def source_fingerprint(cur, table_name):
+    """oid:số dòng:xmin lớn nhất của bảng; đổi sau mọi insert/update/delete hoặc khi bảng bị thay.
+
+    Trả về None nếu bảng chưa tồn tại.
+    """
+    cur.execute("SELECT to_regclass(%s)::oid;", (table_name,))
+    oid = cur.fetchone()[0]
+    if oid is None:
+        return None
+    cur.execute(f"SELECT COUNT(*), COALESCE(MAX(xmin::text::bigint), 0) FROM {table_name};")
+    count, max_xmin = cur.fetchone()
+    return f"{oid}:{count}:{max_xmin}"
+
+
+def refresh_metrics(conn, sources=None):
+    """Cập nhật sa2_metrics cho các bảng nguồn đã thay đổi kể từ lần trước.
+
+    ``sources=None`` tự phát hiện thay đổi qua fingerprint; nếu bảng sa2 đổi thì
+    mọi nguồn đều được tính lại. Trả về danh sách nguồn đã cập nhật.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT source, fingerprint FROM sa2_metrics_sources;")
+        previous = dict(cur.fetchall())
+        current = {source: source_fingerprint(cur, source) for source in METRIC_SOURCES}
+        if current['sa2'] is None:
+            print("❌ Chưa có bảng SA2, không thể tính sa2_metrics.")
+            return []
+
+        if sources is None:
+            sources = [s for s in METRIC_SOURCES if current[s] != previous.get(s)]
+            if 'sa2' in sources:
+                sources = METRIC_SOURCES
+        # Bảng nguồn chưa được tạo (ví dụ chưa thu thập POI) thì giữ chỉ số 0
+        sources = [s for s in METRIC_SOURCES if s in sources and current[s] is not None]
+        if not sources:
+            print("⏭️ Bỏ qua cập nhật sa2_metrics: các bảng nguồn không thay đổi.")
+            return []
+
+        try:
+            for source in METRIC_SOURCES:
+                if source not in sources:
+                    continue
+                start = time.perf_counter()
+                cur.execute("SELECT refresh_sa2_metrics(%s);", (source,))
+                changed = cur.fetchone()[0]
+                cur.execute("""
+                    INSERT INTO sa2_metrics_sources (source, fingerprint, refreshed_at)
+                    VALUES (%s, %s, now())
+                    ON CONFLICT (source) DO UPDATE SET fingerprint = EXCLUDED.fingerprint, refreshed_at = now();
+                """, (source, current[source]))
+                print(f"✅ sa2_metrics: nguồn {source} ({changed} dòng, {time.perf_counter() - start:.1f}s)")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return sources
+
+
+def _scores_populated(cur):
+    cur.execute("SELECT ispopulated FROM pg_matviews WHERE matviewname = 'sa2_scores';")
+    row = cur.fetchone()
+    return bool(row and row[0])
+
+
+def refresh_scores(conn, concurrently=True):
+    """REFRESH materialized view sa2_scores.
+
+    Dùng CONCURRENTLY (người đọc không bị khóa) khi view đã có dữ liệu; lần
+    đầu tiên phải refresh thường.
+    """
+    with conn.cursor() as cur:
+        option = 'CONCURRENTLY ' if concurrently and _scores_populated(cur) else ''
+        start = time.perf_counter()
+        cur.execute(f"REFRESH MATERIALIZED VIEW {option}sa2_scores;")
+    conn.commit()
+    print(f"✅ REFRESH {option}sa2_scores ({time.perf_counter() - start:.1f}s)")
+
+
+def run(conn, load_mode=None):
+    """Bước tính điểm của pipeline: tạo schema, cập nhật chỉ số theo nguồn, refresh điểm."""
+    with stage('scoring'):
+        create_scoring_schema(conn)
+        refreshed = refresh_metrics(conn)
+        with conn.cursor() as cur:
+            populated = _scores_populated(cur)
+        if refreshed or not populated:
+            refresh_scores(conn)
+        with conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*) FROM sa2_scores;")
+            print(f"✅ Đã tính điểm cho {cur.fetchone()[0]} vùng SA2.")
@@ -0,0 +1,93 @@
+from bulk_loader import copy_dataframe, quote_ident
+from metrics import timed
+
+# Hậu tố tên bảng/index tạm trong lúc nạp
+SHADOW_SUFFIX = '_shadow'
+
+
+def _primary_key(cur, table_name):
+    """Tên constraint và danh sách cột khóa chính của bảng (theo thứ tự)."""
+    cur.execute("""
+        SELECT c.conname, a.attname
+        FROM pg_constraint c
+        JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = ANY(c.conkey)
+        WHERE c.conrelid = to_regclass(%s) AND c.contype = 'p'
+        ORDER BY array_position(c.conkey, a.attnum);
+    """, (table_name.lower(),))
+    rows = cur.fetchall()
+    return (rows[0][0] if rows else None), [row[1] for row in rows]
+
+
+def _secondary_indexes(cur, table_name):
+    """(tên, câu lệnh CREATE INDEX) của các index không thuộc constraint."""
+    cur.execute("""
+        SELECT i.relname, pg_get_indexdef(x.indexrelid)
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        WHERE x.indrelid = to_regclass(%s)
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = x.indexrelid);
+    """, (table_name.lower(),))
+    return cur.fetchall()
+
+
+@timed('shadow_load')
+def shadow_load(conn, table_name, frame, columns, key=None):
+    """Nạp lại toàn bộ bảng mà không làm gián đoạn người đọc.
+
+    1. Tạo bảng UNLOGGED ``<bảng>_shadow`` cùng cấu trúc (chưa có index) và COPY dữ liệu vào.
+    2. Tạo khóa chính và các index giống bảng đang dùng, ANALYZE, rồi SET LOGGED.
+    3. Trong một transaction: đổi tên bảng cũ, đưa bảng shadow vào thay, xóa bảng cũ.
+
+    Bảng đang dùng phải tồn tại (gọi create_table(drop=False) trước). ``key``
+    (khóa chính) được dùng để bỏ dòng trùng, giống ON CONFLICT DO NOTHING.
+    """
+    live = table_name.lower()
+    shadow = live + SHADOW_SUFFIX
+    if key:
+        frame = frame.drop_duplicates(subset=[key], keep='first')
+
+    with conn.cursor() as cur:
+        pk_name, pk_columns = _primary_key(cur, live)
+        indexes = _secondary_indexes(cur, live)
+        cur.execute(f"DROP TABLE IF EXISTS {shadow};")
+        cur.execute(
+            f"CREATE UNLOGGED TABLE {shadow} "
+            f"(LIKE {live} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING GENERATED);"
+        )
+    conn.commit()
+
+    try:
+        # Nạp hàng loạt vào bảng chưa có index, không ghi WAL
+        copy_dataframe(conn, frame, shadow, columns)
+
+        with conn.cursor() as cur:
+            if pk_columns:
+                pk_sql = ", ".join(quote_ident(col) for col in pk_columns)
+                cur.execute(f"ALTER TABLE {shadow} ADD CONSTRAINT {pk_name}{SHADOW_SUFFIX} PRIMARY KEY ({pk_sql});")
+            for index_name, index_def in indexes:
+                index_def = index_def.replace(f"INDEX {index_name} ON", f"INDEX {index_name}{SHADOW_SUFFIX} ON", 1)
+                index_def = index_def.replace(f" ON {live} ", f" ON {shadow} ", 1)
+                index_def = index_def.replace(f".{live} ", f".{shadow} ", 1)
+                cur.execute(index_def)
+            cur.execute(f"ANALYZE {shadow};")
+            cur.execute(f"ALTER TABLE {shadow} SET LOGGED;")
+        conn.commit()
+
+        # Đổi bảng trong một transaction: người đọc thấy bảng cũ hoặc bảng mới, không bao giờ bảng dở dang
+        with conn.cursor() as cur:
+            cur.execute(f"LOCK TABLE {live} IN ACCESS EXCLUSIVE MODE;")
+            cur.execute(f"ALTER TABLE {live} RENAME TO {live}_old;")
+            cur.execute(f"ALTER TABLE {shadow} RENAME TO {live};")
+            cur.execute(f"DROP TABLE {live}_old;")
+            if pk_columns:
+                cur.execute(f"ALTER TABLE {live} RENAME CONSTRAINT {pk_name}{SHADOW_SUFFIX} TO {pk_name};")
+            for index_name, _ in indexes:
+                cur.execute(f"ALTER INDEX {index_name}{SHADOW_SUFFIX} RENAME TO {index_name};")
+        conn.commit()
+        print(f"✅ Đã thay bảng {live} bằng dữ liệu mới ({len(frame)} dòng)")
+    except Exception:
+        conn.rollback()
+        with conn.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS {shadow};")
+        conn.commit()
+        raise
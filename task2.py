@@ -1,44 +1,34 @@
-import requests
+import argparse
 import time
 import pg8000
 import geopandas as gpd
-
-class NSWPointsOfInterestAPI:
-    def __init__(self, base_url):
-        self.base_url = base_url
-
-    def get_poi_within_bbox(self, min_lat, min_lon, max_lat, max_lon):
-        """
-        i) Return all points of interest within bounding box (min_lat, min_lon, max_lat, max_lon)
-        """
-        url = f"{self.base_url}/query"
-        params = {
-            "f": "json",
-            "geometry": f"{min_lon},{min_lat},{max_lon},{max_lat}",
-            "geometryType": "esriGeometryEnvelope",
-            "spatialRel": "esriSpatialRelIntersects",
-            "outFields": "*"
-        }
-
-        try:
-            response = requests.get(url, params=params)
-            response.raise_for_status()
-            data = response.json()
-            return data.get("features", [])
-        except requests.exceptions.RequestException as e:
-            print(f"❌ Error fetching POI data: {e}")
-            return []
+import pandas as pd
+
+from poi_api import NSWPointsOfInterestAPI, ResponseCache
+from poi_harvest import (
+    BBoxQueryPlanner, ConcurrentPOIHarvester, HarvestJournal, harvest_tiles, inside_regions, owned_by_tile,
+    region_filters, resumable_harvest, sa2_units, selection_scope, tile_units,
+)
+from utils import read_shapefile
+from index_manager import build_indexes
+from metrics import METRICS_PATH, configure, count_round_trips, print_summary, stage
+from POI import POI_INDEXES, ensure_poi_key, write_pois
 
 class SA2DataProcessor:
-    def __init__(self, db_config, shapefile_path, poi_api, selected_sa4):
+    def __init__(self, db_config, shapefile_path, poi_api, selected_regions, harvester=None,
+                 harvest_mode='sa2', tile_size=0.05, journal=None):
         self.db_config = db_config
         self.shapefile_path = shapefile_path
         self.poi_api = poi_api
-        self.selected_sa4 = selected_sa4  # SA4 code to filter SA2 regions within it
+        self.selected_regions = selected_regions  # "sa4:<code>", "gccsa:<code>" or "state:<code>" specs
+        self.harvester = harvester  # ConcurrentPOIHarvester; None keeps the sequential 1-second loop
+        self.harvest_mode = harvest_mode  # 'sa2': one query per SA2 bbox, 'tiles': shared tile grid
+        self.tile_size = tile_size  # tile edge in degrees for harvest_mode='tiles'
+        self.journal = journal  # HarvestJournal; with a harvester, finished units are skipped on restart
 
     def connect(self):
         try:
-            conn = pg8000.connect(**self.db_config)
+            conn = count_round_trips(pg8000.connect(**self.db_config))
             print("✅ Connected to PostgreSQL!")
             return conn
         except Exception as e:
@@ -48,69 +38,92 @@ class SA2DataProcessor:
     def insert_pois(self, conn, pois):
         """
         iii) Insert POIs into DB with meaningful columns, respecting NSW Topographic Data Dictionary.
-        Adjust columns as necessary.
-        """
-        insert_query = """
-        INSERT INTO points_of_interest (
-            poigroup, poitype, poiname, poilabel, shape, startdate, enddate, lastupdate
-        ) VALUES (
-            %s, %s, %s, %s, ST_SetSRID(ST_GeomFromText(%s), 4326), %s, %s, %s
-        )
-        ON CONFLICT (poiname, poilabel) DO NOTHING;
+        The batch is COPYed into a staging table and merged with one INSERT ... ON CONFLICT (objectid).
+        Returns True once the batch is committed.
         """
         try:
-            with conn.cursor() as cur:
-                for poi in pois:
-                    attr = poi.get('attributes', {})
-                    geom = poi.get('geometry', None)
-
-                    if geom is None:
-                        continue  # Skip POIs with no geometry
-
-                    data = (
-                        attr.get('poigroup'),
-                        attr.get('poitype', 'Unknown'),
-                        attr.get('poiname', 'Unknown'),
-                        attr.get('poilabel', 'Unknown'),
-                        f"POINT({geom['x']} {geom['y']})",
-                        attr.get('startdate'),
-                        attr.get('enddate'),
-                        attr.get('lastupdate')
-                    )
-
-                    try:
-                        cur.execute(insert_query, data)
-                    except Exception as e:
-                        print(f"⚠️ Insert error for POI {attr.get('poiname')}: {e}")
-                conn.commit()
-                print(f"✅ Inserted {len(pois)} POIs successfully.")
+            written = write_pois(conn, pois)
+            print(f"✅ Inserted {written} POIs successfully.")
+            return True
         except Exception as e:
             print(f"❌ Error during POI insertion: {e}")
-            conn.rollback()
+            return False
 
-    def process_data(self):
+    def process_data(self, where=None, bbox=None, mask=None, columns=None, filters=None):
+        """
+        Read the SA2 shapefile (through the GeoParquet cache unless a SQL `where` is given).
+        Attribute/bbox/mask filters and the column projection are pushed down to the reader,
+        so only matching rows are read.
+        """
         print(f"📂 Reading Shapefile: {self.shapefile_path}...")
-        try:
-            gdf = gpd.read_file(self.shapefile_path, engine="pyogrio")
-            print("✅ Shapefile read successfully.")
-            return gdf
-        except Exception as e:
-            print(f"❌ Error reading Shapefile: {e}")
+        return read_shapefile(self.shapefile_path, where=where, bbox=bbox, mask=mask, columns=columns,
+                              filters=filters)
+
+    def read_regions(self):
+        """Read the SA2 regions inside the selected SA4s, GCCSAs and states (one filtered read per region kind)."""
+        frames = []
+        for filters in region_filters(self.selected_regions):
+            gdf = self.process_data(filters=filters, columns=['SA2_CODE21'])
+            if gdf is None:
+                return None
+            frames.append(gdf)
+        if not frames:
             return None
+        sa2 = pd.concat(frames, ignore_index=True).drop_duplicates(subset='SA2_CODE21')
+        return gpd.GeoDataFrame(sa2, geometry='geometry', crs=frames[0].crs)
 
-    def process_sa2_within_sa4(self, conn):
+    def harvest_resumable(self, conn, sa2_gdf):
+        """
+        Harvest tile (or SA2 bbox) units through the checkpoint journal: units
+        finished by an earlier run are skipped, each finished unit is inserted,
+        committed and then journaled. A tile keeps only the POIs it owns, so a
+        POI on a tile edge is inserted once, and only POIs inside the selected
+        SA2s are inserted. Tile keys therefore carry the region selection, so a
+        border tile is harvested again for a neighbouring selection (an SA2 unit
+        always inserts the POIs of its own SA2). A failed insert stops the
+        harvest before the unit is journaled.
         """
-        ii) Loop through SA2 regions within the selected SA4, get POIs for each,
+        if self.harvest_mode == 'tiles':
+            units = tile_units(sa2_gdf, self.tile_size, selection_scope(self.selected_regions))
+            boxes = dict(units)
+            select = lambda unit, pois: owned_by_tile(pois, boxes[unit])
+        else:
+            units = sa2_units(sa2_gdf)
+            select = lambda unit, pois: pois
+
+        def sink(unit, pois):
+            # Tiles and SA2 bboxes also cover ground outside the selected regions
+            if not self.insert_pois(conn, inside_regions(select(unit, pois), sa2_gdf)):
+                raise RuntimeError(f"POI insert failed for harvest unit {unit}")
+
+        resumable_harvest(self.harvester, units, self.journal, sink)
+        print(f"🗂️ Harvest journal: {self.journal.stats()}")
+
+    def process_regions(self, conn):
+        """
+        ii) Loop through SA2 regions within the selected regions, get POIs for each,
         wait 1 second between calls, and insert all POIs into the DB.
         """
-        gdf = self.process_data()
-        if gdf is None:
+        # Only the SA2 regions inside the selected regions are read from disk
+        sa2_within_regions = self.read_regions()
+        if sa2_within_regions is None:
+            return
+
+        if self.harvester is not None and self.journal is not None:
+            self.harvest_resumable(conn, sa2_within_regions)
             return
-        
-        # Filter SA2 regions inside the selected SA4 region
-        sa2_within_sa4 = gdf[gdf['SA4_CODE21'] == self.selected_sa4]
 
-        for idx, row in sa2_within_sa4.iterrows():
+        if self.harvester is not None and self.harvest_mode == 'tiles':
+            for sa2_code, pois in harvest_tiles(self.harvester, sa2_within_regions, self.tile_size):
+                print(f"📍 Inserting {len(pois)} POIs for SA2 {sa2_code}...")
+                self.insert_pois(conn, pois)
+            return
+
+        if self.harvester is not None:
+            self.harvest_concurrently(conn, sa2_within_regions)
+            return
+
+        for idx, row in sa2_within_regions.iterrows():
             sa2_code = row['SA2_CODE21']
             bounds = row['geometry'].bounds  # returns (minx, miny, maxx, maxy)
             min_lon, min_lat, max_lon, max_lat = bounds
@@ -125,6 +138,23 @@ class SA2DataProcessor:
 
             time.sleep(1)  # wait 1 second to respect API limits
 
+    def harvest_concurrently(self, conn, sa2_gdf):
+        """
+        Fetch POIs for all SA2s through the rate-limited concurrent harvester
+        and insert each batch as it arrives.
+        """
+        jobs = []
+        for _, row in sa2_gdf.iterrows():
+            min_lon, min_lat, max_lon, max_lat = row['geometry'].bounds
+            jobs.append((row['SA2_CODE21'], (min_lat, min_lon, max_lat, max_lon)))
+
+        for sa2_code, pois in self.harvester.harvest(jobs):
+            print(f"📍 Processing POIs for SA2 {sa2_code}...")
+            if pois:
+                self.insert_pois(conn, pois)
+            else:
+                print(f"⚠️ No POIs found for SA2 {sa2_code}.")
+
 # === Configuration ===
 db_config = {
     'user': 'postgres',
@@ -137,11 +167,47 @@ db_config = {
 shapefile_path = 'data/SA2_2021_AUST_SHP_GDA2020/SA2_2021_AUST_GDA2020.shp'
 poi_api_url = "https://maps.six.nsw.gov.au/arcgis/rest/services/public/NSW_POI/MapServer/0"
 
-selected_sa4 = "11601"  
-poi_api = NSWPointsOfInterestAPI(poi_api_url)
-processor = SA2DataProcessor(db_config, shapefile_path, poi_api, selected_sa4)
-
-conn = processor.connect()
-if conn:
-    processor.process_sa2_within_sa4(conn)
-    conn.close()
+# Regions to harvest: SA4 ("sa4:11601"), Greater Capital City ("gccsa:1GSYD") or state ("state:1") codes
+selected_regions = ["sa4:11601"]
+
+
+def build_processor(regions=selected_regions):
+    """Processor with the cached API client, concurrent harvester and checkpoint journal (opened here, not on import)."""
+    poi_api = NSWPointsOfInterestAPI(poi_api_url, cache=ResponseCache('data/poi_cache.sqlite'))
+    harvester = ConcurrentPOIHarvester(poi_api, requests_per_second=2.0, max_workers=4,
+                                       planner=BBoxQueryPlanner(poi_api, max_workers=4))
+    return SA2DataProcessor(db_config, shapefile_path, poi_api, list(regions), harvester, harvest_mode='tiles',
+                            journal=HarvestJournal('data/poi_harvest_journal.sqlite'))
+
+
+def run(conn, load_mode=None, processor=None):
+    """Harvest POIs for the selected regions on an existing connection (called by pipeline.py).
+
+    The harvest resumes from the checkpoint journal; load_mode='full' forgets it and starts over.
+    """
+    with stage('poi'):
+        processor = processor or build_processor()
+        if load_mode == 'full' and processor.journal is not None:
+            processor.journal.reset()
+        # An old table keyed by poigroup is migrated to objectid; the journal is reset with it
+        ensure_poi_key(conn, processor.journal)
+        processor.process_regions(conn)
+        build_indexes(conn, 'points_of_interest', POI_INDEXES, concurrently=True)
+        print(f"📦 POI cache: {processor.poi_api.cache.stats()}")
+
+
+if __name__ == '__main__':
+    # Write the per-stage metrics to data/metrics.jsonl
+    configure(METRICS_PATH)
+    parser = argparse.ArgumentParser(description="Harvest POIs for SA4s, GCCSAs or states; resumes after a stop.")
+    parser.add_argument('regions', nargs='*', default=selected_regions,
+                        help='Regions such as sa4:11601, gccsa:1GSYD or state:1 (bare codes are SA4s)')
+    parser.add_argument('--restart', action='store_true', help='Forget the checkpoint journal and start over')
+    args = parser.parse_args()
+    processor = build_processor(args.regions)
+
+    conn = processor.connect()
+    if conn:
+        run(conn, 'full' if args.restart else None, processor)
+        conn.close()
+        print_summary()
@@ -1,89 +1,165 @@
--- ✅ Tạo hàm sigmoid
+-- ✅ Hàm sigmoid viết bằng SQL (IMMUTABLE) để planner inline được vào truy vấn
 CREATE OR REPLACE FUNCTION sigmoid(x DOUBLE PRECISION)
-RETURNS DOUBLE PRECISION AS $$
+RETURNS DOUBLE PRECISION
+LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE AS $$
+  SELECT 1 / (1 + EXP(-x));
+$$;
+
+-- === BẢNG CHỈ SỐ THEO SA2 (được cập nhật theo từng bảng nguồn) ===
+
+CREATE TABLE IF NOT EXISTS sa2_metrics (
+    sa2_code21 VARCHAR(15) PRIMARY KEY,
+    business_count INTEGER NOT NULL DEFAULT 0,
+    poi_count INTEGER NOT NULL DEFAULT 0,
+    school_count INTEGER NOT NULL DEFAULT 0,
+    -- Số trường theo tỷ lệ diện tích vùng tuyển sinh nằm trong SA2
+    school_weighted DOUBLE PRECISION NOT NULL DEFAULT 0,
+    stop_count INTEGER NOT NULL DEFAULT 0,
+    population INTEGER NOT NULL DEFAULT 0,
+    population_0_19 INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+ALTER TABLE sa2_metrics ADD COLUMN IF NOT EXISTS school_weighted DOUBLE PRECISION NOT NULL DEFAULT 0;
+
+-- Dấu vết (fingerprint) của mỗi bảng nguồn ở lần cập nhật chỉ số gần nhất
+CREATE TABLE IF NOT EXISTS sa2_metrics_sources (
+    source TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    refreshed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- ✅ Tính lại các cột chỉ số của một bảng nguồn; chỉ ghi những dòng có giá trị thay đổi
+-- Join không gian chạy hai bước: lọc thô trên geometry_simple (ít đỉnh, có index GiST),
+-- chấp nhận ngay nếu nằm trong vùng lõi geometry_core, chỉ các ứng viên sát biên
+-- mới được kiểm tra lại trên geometry gốc nên kết quả vẫn chính xác.
+-- margin (sai số simplify + lưới làm tròn) do loader ghi vào bảng geometry_resolution.
+CREATE OR REPLACE FUNCTION refresh_sa2_metrics(source TEXT)
+RETURNS INTEGER
+LANGUAGE plpgsql AS $$
+DECLARE
+  changed INTEGER := 0;
+  sa2_margin DOUBLE PRECISION;
 BEGIN
-  RETURN 1 / (1 + EXP(-x));
-END;
-$$ LANGUAGE plpgsql;
+  IF source IN ('points_of_interest', 'stops') THEN
+    SELECT margin INTO sa2_margin FROM geometry_resolution WHERE table_name = 'sa2' AND column_name = 'geometry';
+    IF sa2_margin IS NULL THEN
+      RAISE EXCEPTION 'sa2 has no simplified geometry columns; run the SA2 loader first';
+    END IF;
+  END IF;
 
--- === TÍNH CHỈ SỐ ===
+  IF source = 'sa2' THEN
+    -- Đồng bộ danh sách SA2 (các cột chỉ số được tính lại bởi các nguồn khác)
+    DELETE FROM sa2_metrics m WHERE NOT EXISTS (SELECT 1 FROM sa2 s WHERE s.sa2_code21 = m.sa2_code21);
+    INSERT INTO sa2_metrics (sa2_code21) SELECT sa2_code21 FROM sa2 ON CONFLICT (sa2_code21) DO NOTHING;
 
-WITH business_metrics AS (
-    SELECT
-        s.sa2_code21,
-        COUNT(b.*) AS business_count
-    FROM sa2 s
-    LEFT JOIN buss b ON b.sa2_code = s.sa2_code21
-    WHERE b.industry_name ILIKE ANY (ARRAY[
-        '%Retail%', '%Health%', '%Education%', '%Accommodation%', '%Food%'
-    ])
-    GROUP BY s.sa2_code21
-),
+  ELSIF source = 'businesses' THEN
+    UPDATE sa2_metrics m
+    SET business_count = n.value, updated_at = now()
+    FROM (
+        SELECT s.sa2_code21, COUNT(b.sa2_code) AS value
+        FROM sa2 s
+        LEFT JOIN businesses b ON b.sa2_code = s.sa2_code21
+            AND b.industry_name ILIKE ANY (ARRAY[
+                '%Retail%', '%Health%', '%Education%', '%Accommodation%', '%Food%'
+            ])
+        GROUP BY s.sa2_code21
+    ) n
+    WHERE n.sa2_code21 = m.sa2_code21 AND m.business_count IS DISTINCT FROM n.value;
 
-poi_metrics AS (
-    SELECT
-        s.sa2_code21,
-        COUNT(p.*) AS poi_count
-    FROM sa2 s
-    LEFT JOIN poi_csv p ON p.sa2_code21 = s.sa2_code21
-    GROUP BY s.sa2_code21
-),
+  ELSIF source = 'points_of_interest' THEN
+    UPDATE sa2_metrics m
+    SET poi_count = n.value, updated_at = now()
+    FROM (
+        SELECT s.sa2_code21, COUNT(p.shape) AS value
+        FROM sa2 s
+        LEFT JOIN points_of_interest p
+            ON ST_DWithin(p.shape, s.geometry_simple, sa2_margin)
+            AND CASE WHEN ST_Within(p.shape, s.geometry_core) THEN TRUE ELSE ST_Within(p.shape, s.geometry) END
+        GROUP BY s.sa2_code21
+    ) n
+    WHERE n.sa2_code21 = m.sa2_code21 AND m.poi_count IS DISTINCT FROM n.value;
 
-school_metrics AS (
-    SELECT
-        s.sa2_code21,
-        COUNT(sc.*) AS school_count
-    FROM sa2 s
-    LEFT JOIN schools sc ON ST_Intersects(ST_Transform(sc.geometry, 4283), s.geometry)
-    GROUP BY s.sa2_code21
-),
+  ELSIF source = 'catchment_sa2' THEN
+    -- Cặp vùng tuyển sinh/SA2 đã được tính sẵn khi nạp (catchment_overlay.py): join bằng mã
+    UPDATE sa2_metrics m
+    SET school_count = n.value, school_weighted = n.weighted, updated_at = now()
+    FROM (
+        SELECT s.sa2_code21, COUNT(cs.use_id) AS value, COALESCE(SUM(cs.area_fraction), 0) AS weighted
+        FROM sa2 s
+        LEFT JOIN catchment_sa2 cs ON cs.sa2_code21 = s.sa2_code21
+        GROUP BY s.sa2_code21
+    ) n
+    WHERE n.sa2_code21 = m.sa2_code21
+      AND (m.school_count, m.school_weighted) IS DISTINCT FROM (n.value, n.weighted);
 
-stop_metrics AS (
-    SELECT
-        s.sa2_code21,
-        COUNT(st.*) AS stop_count
-    FROM sa2 s
-    LEFT JOIN stops st ON ST_Within(st.geom_4283, s.geometry)
-    GROUP BY s.sa2_code21
-),
+  ELSIF source = 'stops' THEN
+    UPDATE sa2_metrics m
+    SET stop_count = n.value, updated_at = now()
+    FROM (
+        SELECT s.sa2_code21, COUNT(st.stop_id) AS value
+        FROM sa2 s
+        LEFT JOIN stops st
+            ON ST_DWithin(st.geom, s.geometry_simple, sa2_margin)
+            AND CASE WHEN ST_Within(st.geom, s.geometry_core) THEN TRUE ELSE ST_Within(st.geom, s.geometry) END
+        GROUP BY s.sa2_code21
+    ) n
+    WHERE n.sa2_code21 = m.sa2_code21 AND m.stop_count IS DISTINCT FROM n.value;
+
+  ELSIF source = 'population_data' THEN
+    UPDATE sa2_metrics m
+    SET population = n.population, population_0_19 = n.population_0_19, updated_at = now()
+    FROM (
+        SELECT
+            s.sa2_code21,
+            COALESCE(p.total_people, 0) AS population,
+            COALESCE(p."0_19", 0) AS population_0_19
+        FROM sa2 s
+        LEFT JOIN population_data p ON p.sa2_code = s.sa2_code21
+    ) n
+    WHERE n.sa2_code21 = m.sa2_code21
+      AND (m.population, m.population_0_19) IS DISTINCT FROM (n.population, n.population_0_19);
 
--- ✅ Lọc bảng dân số, chuẩn hóa mã
-population_filtered AS (
+  ELSE
+    RAISE EXCEPTION 'Unknown metrics source: %', source;
+  END IF;
+
+  GET DIAGNOSTICS changed = ROW_COUNT;
+  RETURN changed;
+END;
+$$;
+
+-- === ĐIỂM TỪ BẢNG CHỈ SỐ (materialized view, REFRESH ... CONCURRENTLY) ===
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS sa2_scores AS
+WITH combined AS (
     SELECT
         sa2_code21,
-        total_population AS population,
-        population_0_19
-    FROM populations
-    WHERE total_population >= 100
+        business_count,
+        poi_count,
+        school_count,
+        stop_count,
+
+        -- ✅ Chỉ tính các vùng có từ 100 dân trở lên
+        CASE WHEN population >= 100 THEN population ELSE 0 END AS population,
+        CASE WHEN population >= 100 THEN population_0_19 ELSE 0 END AS population_0_19
+    FROM sa2_metrics
 ),
 
--- ✅ Tổng hợp dữ liệu
-combined AS (
+-- ✅ Chia theo dân số/người trẻ
+rates AS (
     SELECT
-        s.sa2_code21,
-        COALESCE(b.business_count, 0) AS business_count,
-        COALESCE(p.poi_count, 0) AS poi_count,
-        COALESCE(sc.school_count, 0) AS school_count,
-        COALESCE(st.stop_count, 0) AS stop_count,
-        COALESCE(pop.population, 0) AS population,
-        COALESCE(pop.population_0_19, 0) AS population_0_19,
-
-        -- ✅ Chia theo dân số/người trẻ
-        CASE 
-            WHEN COALESCE(pop.population, 0) > 0 THEN (COALESCE(b.business_count, 0) * 1000.0) / pop.population
+        c.*,
+        CASE
+            WHEN c.population > 0 THEN (c.business_count * 1000.0) / c.population
             ELSE 0
         END AS business_per_1000,
-        
-        CASE 
-            WHEN COALESCE(pop.population_0_19, 0) > 0 THEN (COALESCE(sc.school_count, 0) * 1000.0) / pop.population_0_19
+
+        CASE
+            WHEN c.population_0_19 > 0 THEN (c.school_count * 1000.0) / c.population_0_19
             ELSE 0
         END AS schools_per_1000young
-    FROM sa2 s
-    LEFT JOIN population_filtered pop ON s.sa2_code21 = pop.sa2_code21
-    LEFT JOIN business_metrics b ON s.sa2_code21 = b.sa2_code21
-    LEFT JOIN poi_metrics p ON s.sa2_code21 = p.sa2_code21
-    LEFT JOIN school_metrics sc ON s.sa2_code21 = sc.sa2_code21
-    LEFT JOIN stop_metrics st ON s.sa2_code21 = st.sa2_code21
+    FROM combined c
 ),
 
 -- Calculate averages and standard deviations first
@@ -97,42 +173,38 @@ stats AS (
         STDDEV_SAMP(schools_per_1000young) AS stddev_schools_per_1000young,
         AVG(stop_count) AS avg_stop_count,
         STDDEV_SAMP(stop_count) AS stddev_stop_count
-    FROM combined
+    FROM rates
     WHERE population > 0  -- Consider only areas with population
 ),
 
 -- ✅ Tính z-score với xử lý NULL
 z_scores AS (
     SELECT
-        c.sa2_code21,
-        c.business_per_1000,
-        c.poi_count,
-        c.schools_per_1000young,
-        c.stop_count,
+        r.sa2_code21,
 
         -- Handle possible division by zero or NULL values
         CASE
             WHEN s.stddev_business_per_1000 IS NULL OR s.stddev_business_per_1000 = 0 THEN 0
-            ELSE (c.business_per_1000 - s.avg_business_per_1000) / s.stddev_business_per_1000
+            ELSE (r.business_per_1000 - s.avg_business_per_1000) / s.stddev_business_per_1000
         END AS zbusiness,
-        
+
         CASE
             WHEN s.stddev_poi_count IS NULL OR s.stddev_poi_count = 0 THEN 0
-            ELSE (c.poi_count - s.avg_poi_count) / s.stddev_poi_count
+            ELSE (r.poi_count - s.avg_poi_count) / s.stddev_poi_count
         END AS zpoi,
-        
+
         CASE
             WHEN s.stddev_schools_per_1000young IS NULL OR s.stddev_schools_per_1000young = 0 THEN 0
-            ELSE (c.schools_per_1000young - s.avg_schools_per_1000young) / s.stddev_schools_per_1000young
+            ELSE (r.schools_per_1000young - s.avg_schools_per_1000young) / s.stddev_schools_per_1000young
         END AS zschools,
-        
+
         CASE
             WHEN s.stddev_stop_count IS NULL OR s.stddev_stop_count = 0 THEN 0
-            ELSE (c.stop_count - s.avg_stop_count) / s.stddev_stop_count
+            ELSE (r.stop_count - s.avg_stop_count) / s.stddev_stop_count
         END AS zstops
-    FROM combined c
+    FROM rates r
     CROSS JOIN stats s
-    WHERE c.population > 0  -- Only include populated areas
+    WHERE r.population > 0  -- Only include populated areas
 )
 
 -- ✅ Tính điểm tổng
@@ -144,4 +216,8 @@ SELECT
     ROUND(zstops::NUMERIC, 2) AS zstops,
     ROUND(sigmoid(zbusiness + zpoi + zschools + zstops)::NUMERIC, 4) AS final_score
 FROM z_scores
-ORDER BY final_score DESC;
+WITH NO DATA;
+
+-- Index duy nhất (bắt buộc cho REFRESH MATERIALIZED VIEW CONCURRENTLY) và index xếp hạng
+CREATE UNIQUE INDEX IF NOT EXISTS sa2_scores_sa2_code21_idx ON sa2_scores (sa2_code21);
+CREATE INDEX IF NOT EXISTS sa2_scores_final_score_idx ON sa2_scores (final_score DESC);
@@ -1,20 +1,25 @@
+import os
+
 import pandas as pd
 import numpy as np
 from scipy.special import expit as sigmoid
-import geopandas as gpd
-from shapely import wkt
+import shapely
 
-# Hàm tính z-score
-def z_score(value, mean, std):
-    if std == 0:
-        return 0
-    return (value - mean) / std
+from geometry_resolution import SIMPLIFY_TOLERANCE
+from metrics import METRICS_PATH, configure, print_summary, timed
+from sa2_locator import SA2Locator
+from utils import decode_geometries, read_shapefile, shapefile_cache_path
+
+# Đường dẫn shapefile SA2 và file lưu SA2Locator đã dựng sẵn
+SA2_SHAPEFILE = r'data\SA2_2021_AUST_SHP_GDA2020\SA2_2021_AUST_GDA2020.shp'
+SA2_LOCATOR_PATH = 'data/cache/sa2_locator.pkl'
 
 # Hàm tính điểm S từ z-score
 def calculate_score(z):
     return sigmoid(z)
 
 # Đọc dữ liệu từ các file CSV
+@timed(rows=len)
 def read_csv(file_path):
     try:
         df = pd.read_csv(file_path)
@@ -25,104 +30,125 @@ def read_csv(file_path):
         print(f'❌ Lỗi khi đọc file {file_path}: {e}')
         return None
 
+# Nhận SA2Locator hoặc GeoDataFrame SA2 (cột sa2_code + geometry)
+def as_sa2_locator(sa2):
+    if isinstance(sa2, SA2Locator):
+        return sa2
+    return SA2Locator.from_geodataframe(sa2, 'sa2_code')
+
+# Đọc SA2Locator đã lưu, hoặc dựng mới từ shapefile khi cache cũ hơn dữ liệu SA2 (hoặc khác sai số)
+# tolerance: lọc thô trên bản đơn giản hóa của SA2, kiểm tra lại trên geometry gốc khi sát biên
+@timed()
+def load_sa2_locator(shapefile_path=SA2_SHAPEFILE, locator_path=SA2_LOCATOR_PATH, tolerance=SIMPLIFY_TOLERANCE):
+    source_path = shapefile_cache_path(shapefile_path)
+    if os.path.exists(locator_path) and os.path.getmtime(locator_path) >= os.path.getmtime(source_path):
+        locator = SA2Locator.load(locator_path)
+        if locator.tolerance == tolerance:
+            print(f'✅ Đọc SA2Locator từ {locator_path}')
+            return locator
+    gdf_sa2 = read_shapefile(shapefile_path, columns=['SA2_CODE21'])
+    locator = SA2Locator.from_geodataframe(gdf_sa2, 'SA2_CODE21', tolerance=tolerance)
+    locator.save(locator_path)
+    print(f'✅ Đã dựng và lưu SA2Locator vào {locator_path}')
+    return locator
+
 # Hàm gán sa2_code cho dataframe có cột tọa độ lat/lon
-def add_sa2_code_from_coords(df, lat_col, lon_col, gdf_sa2):
-    gdf_points = gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(df[lon_col], df[lat_col]), crs=gdf_sa2.crs)
-    gdf_joined = gpd.sjoin(gdf_points, gdf_sa2, how='left', predicate='within')
-    return pd.DataFrame(gdf_joined.drop(columns=['geometry', 'index_right']))
-
-# Hàm gán sa2_code cho dataframe có cột geometry dạng WKT
-def add_sa2_code_from_wkt(df, wkt_col, gdf_sa2):
-    df['geometry'] = df[wkt_col].apply(wkt.loads)
-    gdf = gpd.GeoDataFrame(df, geometry='geometry', crs=gdf_sa2.crs)
-    gdf_joined = gpd.sjoin(gdf, gdf_sa2, how='left', predicate='within')
-    return pd.DataFrame(gdf_joined.drop(columns=['geometry', 'index_right']))
+# workers > 1: chia điểm cho nhiều process (dùng cho tập điểm rất lớn như Stops.txt)
+@timed(rows=len)
+def add_sa2_code_from_coords(df, lat_col, lon_col, sa2, workers=None):
+    points = shapely.points(df[lon_col].to_numpy(dtype=float), df[lat_col].to_numpy(dtype=float))
+    df = df.copy()
+    locator = as_sa2_locator(sa2)
+    df['sa2_code'] = locator.locate_parallel(points, workers) if workers else locator.locate(points)
+    return df
+
+# Hàm gán sa2_code cho dataframe có cột geometry dạng WKT (hoặc WKB/hex EWKB)
+@timed(rows=len)
+def add_sa2_code_from_wkt(df, wkt_col, sa2, workers=None):
+    geometries = decode_geometries(df[wkt_col])
+    df = df.copy()
+    locator = as_sa2_locator(sa2)
+    df['sa2_code'] = locator.locate_parallel(geometries, workers) if workers else locator.locate(geometries)
+    return df
+
+# Hàm tạo một dòng cho mỗi cặp (vùng, SA2) giao nhau từ cột geometry dạng WKT
+# Vùng nằm vắt qua nhiều SA2 được tính cho mọi SA2 nó chạm (như bảng catchment_sa2),
+# kèm diện tích phần giao và tỷ lệ diện tích (area_fraction) để đếm có trọng số
+@timed(rows=len)
+def overlay_sa2_from_wkt(df, wkt_col, sa2):
+    geometries = decode_geometries(df[wkt_col])
+    locator = as_sa2_locator(sa2)
+    geom_idx, sa2_idx, intersection_area, fraction = locator.overlay(geometries)
+    df = df.iloc[geom_idx].reset_index(drop=True)
+    df['sa2_code'] = locator.codes[sa2_idx]
+    df['intersection_area'] = intersection_area
+    df['area_fraction'] = fraction
+    return df
+
+# Các cột dân số 0-19 tuổi
+YOUNG_COLUMNS = ['0-4_people', '5-9_people', '10-14_people', '15-19_people']
+
+# Đếm số dòng theo sa2_code (một lần value_counts), sắp theo thứ tự keys
+def count_by_sa2(df, keys):
+    return df['sa2_code'].value_counts().reindex(keys, fill_value=0).to_numpy(dtype=np.float64)
+
+# Tính z-score cho cả mảng (bỏ qua nan khi tính mean/std)
+def z_scores(arr):
+    mean, std = np.nanmean(arr), np.nanstd(arr)
+    if std == 0:
+        return np.zeros_like(arr)
+    return (arr - mean) / std
 
 # Tính toán điểm "well-resourced" cho từng vùng SA2
-def calculate_well_resourced_score(df_business, df_population, df_stops, df_schools, df_poi):
-    result = []
+@timed(rows=len)
+def calculate_well_resourced_score(df_business, df_population, df_stops, df_schools, df_poi,
+                                   output_path='well_resourced_scores.csv'):
     sa2_codes = pd.concat([df_business['sa2_code'], df_population['sa2_code']]).drop_duplicates().tolist()
-
-    # Tính các thống kê để tính z-score
-    business_per_1000_list = []
-    stops_count_list = []
-    school_per_1000_young_list = []
-    poi_count_list = []
-
-    # Tính trước cho từng SA2 các chỉ số
-    for sa2 in sa2_codes:
-        try:
-            pop = df_population[df_population['sa2_code'] == sa2]['total_people'].values
-            if len(pop) == 0 or pop[0] < 100:
-                business_per_1000_list.append(np.nan)
-                stops_count_list.append(np.nan)
-                school_per_1000_young_list.append(np.nan)
-                poi_count_list.append(np.nan)
-                continue
-
-            businesses = df_business[df_business['sa2_code'] == sa2]['total_businesses'].sum()
-            business_per_1000 = businesses / (pop[0] / 1000)
-
-            stops_count = df_stops[df_stops['sa2_code'] == sa2].shape[0]
-
-            young_pop = df_population[df_population['sa2_code'] == sa2][['0-4_people', '5-9_people', '10-14_people', '15-19_people']].sum(axis=1).values
-            young_pop = young_pop[0] if len(young_pop) > 0 else 0
-            if young_pop == 0:
-                school_per_1000_young = 0
-            else:
-                school_per_1000_young = df_schools[df_schools['sa2_code'] == sa2].shape[0] / (young_pop / 1000)
-
-            poi_count = df_poi[df_poi['sa2_code'] == sa2].shape[0]
-
-            business_per_1000_list.append(business_per_1000)
-            stops_count_list.append(stops_count)
-            school_per_1000_young_list.append(school_per_1000_young)
-            poi_count_list.append(poi_count)
-        except Exception as e:
-            print(f'⚠️ Lỗi khi xử lý SA2 {sa2}: {e}')
-            business_per_1000_list.append(np.nan)
-            stops_count_list.append(np.nan)
-            school_per_1000_young_list.append(np.nan)
-            poi_count_list.append(np.nan)
-
-    # Chuyển thành numpy array để tính mean/std, bỏ nan
-    business_arr = np.array(business_per_1000_list, dtype=np.float64)
-    stops_arr = np.array(stops_count_list, dtype=np.float64)
-    school_arr = np.array(school_per_1000_young_list, dtype=np.float64)
-    poi_arr = np.array(poi_count_list, dtype=np.float64)
-
-    mean_business, std_business = np.nanmean(business_arr), np.nanstd(business_arr)
-    mean_stops, std_stops = np.nanmean(stops_arr), np.nanstd(stops_arr)
-    mean_school, std_school = np.nanmean(school_arr), np.nanstd(school_arr)
-    mean_poi, std_poi = np.nanmean(poi_arr), np.nanstd(poi_arr)
-
-    for i, sa2 in enumerate(sa2_codes):
-        try:
-            if np.isnan(business_arr[i]) or np.isnan(stops_arr[i]) or np.isnan(school_arr[i]) or np.isnan(poi_arr[i]):
-                result.append((sa2, None))
-                continue
-
-            zbusiness = z_score(business_arr[i], mean_business, std_business)
-            zstops = z_score(stops_arr[i], mean_stops, std_stops)
-            zschools = z_score(school_arr[i], mean_school, std_school)
-            zpoi = z_score(poi_arr[i], mean_poi, std_poi)
-
-            score = calculate_score(zbusiness + zstops + zschools + zpoi)
-            result.append((sa2, score))
-        except Exception as e:
-            print(f'⚠️ Lỗi khi tính điểm cho SA2 {sa2}: {e}')
-            result.append((sa2, None))
-
-    result_df = pd.DataFrame(result, columns=['sa2_code', 'score'])
-    result_df.to_csv('well_resourced_scores.csv', index=False)
-    print('✅ Đã lưu kết quả vào file well_resourced_scores.csv')
+    keys = pd.Index(sa2_codes, dtype=object)
+
+    # Mỗi SA2 lấy dòng dân số đầu tiên (giống cách lọc theo từng SA2 trước đây)
+    population = df_population.dropna(subset=['sa2_code']).drop_duplicates(subset=['sa2_code'])
+    population = population.set_index('sa2_code')
+    has_population = keys.isin(population.index)
+    pop = population['total_people'].reindex(keys).to_numpy(dtype=np.float64)
+    young_pop = population[YOUNG_COLUMNS].sum(axis=1).reindex(keys).to_numpy(dtype=np.float64)
+
+    # Một lần groupby/value_counts cho mỗi bảng đầu vào
+    businesses = (
+        df_business.groupby('sa2_code', sort=False)['total_businesses'].sum()
+        .reindex(keys, fill_value=0).to_numpy(dtype=np.float64)
+    )
+    stops_arr = count_by_sa2(df_stops, keys)
+    school_count = count_by_sa2(df_schools, keys)
+    poi_arr = count_by_sa2(df_poi, keys)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        business_arr = businesses / (pop / 1000)
+        school_arr = np.where(young_pop == 0, 0.0, school_count / (young_pop / 1000))
+
+    # SA2 không có dân số hoặc dân số < 100 bị loại khỏi mọi chỉ số
+    excluded = ~has_population | (pop < 100)
+    for arr in (business_arr, stops_arr, school_arr, poi_arr):
+        arr[excluded] = np.nan
+
+    zbusiness = z_scores(business_arr)
+    zstops = z_scores(stops_arr)
+    zschools = z_scores(school_arr)
+    zpoi = z_scores(poi_arr)
+
+    valid = ~(np.isnan(business_arr) | np.isnan(stops_arr) | np.isnan(school_arr) | np.isnan(poi_arr))
+    scores = np.where(valid, calculate_score(zbusiness + zstops + zschools + zpoi), np.nan)
+
+    result_df = pd.DataFrame({'sa2_code': sa2_codes, 'score': scores})
+    result_df.to_csv(output_path, index=False)
+    print(f'✅ Đã lưu kết quả vào file {output_path}')
     return result_df
 
-
 if __name__ == '__main__':
-    # Đọc shapefile vùng SA2
-    gdf_sa2 = gpd.read_file(r'data\SA2_2021_AUST_SHP_GDA2020\SA2_2021_AUST_GDA2020.shp', engine='pyogrio')
-    gdf_sa2 = gdf_sa2[['SA2_CODE21', 'geometry']].rename(columns={'SA2_CODE21': 'sa2_code'})
+    # Ghi bản ghi đo của từng bước ra data/metrics.jsonl
+    configure(METRICS_PATH)
+    # Dựng (hoặc đọc lại) chỉ mục không gian SA2 một lần, dùng chung cho 3 bước gán sa2_code
+    sa2_locator = load_sa2_locator()
 
     # Đọc dữ liệu
     df_business = read_csv('data/Businesses (1).csv')
@@ -132,14 +158,16 @@ if __name__ == '__main__':
     df_poi = read_csv('data/points_of_interest.csv')
 
     # Gán sa2_code cho df_stops
-    df_stops = add_sa2_code_from_coords(df_stops, 'stop_lat', 'stop_lon', gdf_sa2)
+    df_stops = add_sa2_code_from_coords(df_stops, 'stop_lat', 'stop_lon', sa2_locator, workers=os.cpu_count())
 
-    # Gán sa2_code cho df_schools (dựa trên cột 'geometry' dạng WKT)
-    df_schools = add_sa2_code_from_wkt(df_schools, 'geometry', gdf_sa2)
+    # Các cặp vùng tuyển sinh/SA2 giao nhau (dựa trên cột 'geometry' dạng WKT)
+    df_schools = overlay_sa2_from_wkt(df_schools, 'geometry', sa2_locator)
 
     # Gán sa2_code cho df_poi (dựa trên cột 'shape_wkt')
-    df_poi = add_sa2_code_from_wkt(df_poi, 'shape_wkt', gdf_sa2)
+    df_poi = add_sa2_code_from_wkt(df_poi, 'shape_wkt', sa2_locator, workers=os.cpu_count())
 
     # Kiểm tra đủ dữ liệu rồi tính điểm
     if all(df is not None for df in [df_business, df_population, df_stops, df_schools, df_poi]):
         calculate_well_resourced_score(df_business, df_population, df_stops, df_schools, df_poi)
+
+    print_summary()
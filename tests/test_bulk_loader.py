@@ -0,0 +1,25 @@
+import geopandas as gpd
+import pytest
+import shapely
+
+from bulk_loader import WORKING_SRID, to_working_crs
+
+
+def points(crs=None):
+    return gpd.GeoDataFrame({'v': [1]}, geometry=[shapely.Point(151.2, -33.8)], crs=crs)
+
+
+def test_missing_crs_is_rejected_instead_of_labelled_as_the_working_srid():
+    with pytest.raises(ValueError):
+        to_working_crs(points())
+
+
+def test_missing_crs_can_be_assumed_explicitly():
+    gdf = to_working_crs(points(), assume_srid=4326)
+
+    assert gdf.crs.to_epsg() == WORKING_SRID
+    assert gdf.geometry.x.iloc[0] == pytest.approx(151.2, abs=1e-4)
+
+
+def test_declared_crs_is_reprojected():
+    assert to_working_crs(points(crs=4326)).crs.to_epsg() == WORKING_SRID
@@ -0,0 +1,24 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from incremental_loader import forget_source, record_source, source_unchanged
+
+
+def test_concurrent_manifest_updates_keep_every_table(tmp_path):
+    manifest = str(tmp_path / 'cache' / 'load_manifest.json')
+    tables = [f"table_{i}" for i in range(40)]
+
+    def load(table):
+        record_source(table, [f"{table}.csv"], table + '-sha', manifest)
+        assert source_unchanged(table, table + '-sha', manifest)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(load, tables))
+
+    with open(manifest, encoding='utf-8') as f:
+        assert sorted(json.load(f)) == sorted(tables)
+    assert [p.name for p in (tmp_path / 'cache').iterdir()] == ['load_manifest.json']
+
+    forget_source('table_0', manifest)
+    assert not source_unchanged('table_0', 'table_0-sha', manifest)
+    assert source_unchanged('table_1', 'table_1-sha', manifest)
@@ -0,0 +1,45 @@
+import metrics
+
+
+class FakeConnection:
+    def __init__(self):
+        self.messages = 0
+
+    def handle_messages(self, context):
+        self.messages += 1
+
+
+def test_records_stay_in_memory_unless_an_entry_point_configures_a_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    @metrics.timed('quiet', rows=len)
+    def helper():
+        return [1, 2, 3]
+
+    helper()
+
+    assert list(tmp_path.iterdir()) == []
+    assert metrics.records()[-1]['stage'] == 'quiet'
+
+
+def test_configured_file_receives_records(tmp_path, monkeypatch):
+    path = tmp_path / 'metrics.jsonl'
+    monkeypatch.setitem(metrics._config, 'path', str(path))
+
+    with metrics.stage('written'):
+        pass
+
+    assert '"stage": "written"' in path.read_text(encoding='utf-8')
+
+
+def test_round_trips_are_counted_only_on_wrapped_connections():
+    counted, plain = metrics.count_round_trips(FakeConnection()), FakeConnection()
+    metrics.count_round_trips(counted)  # wrapping twice does not double count
+
+    with metrics.stage('db') as current:
+        counted.handle_messages(None)
+        counted.handle_messages(None)
+        plain.handle_messages(None)
+
+    assert current.round_trips == 2
+    assert counted.messages == 2
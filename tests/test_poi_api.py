@@ -0,0 +1,59 @@
+import pytest
+import requests
+
+from poi_api import NSWPointsOfInterestAPI
+
+
+class RecordingConcurrency:
+    def __init__(self):
+        self.latencies = []
+
+    def acquire(self):
+        pass
+
+    def release(self, latency):
+        self.latencies.append(latency)
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {'features': []}
+
+
+def test_concurrency_sees_only_the_http_round_trip(monkeypatch):
+    clock = {'now': 0.0}
+    monkeypatch.setattr('poi_api.time.monotonic', lambda: clock['now'])
+    monkeypatch.setattr('poi_api.time.sleep', lambda seconds: clock.__setitem__('now', clock['now'] + seconds))
+    responses = iter([FakeResponse(429, {'Retry-After': '30'}), FakeResponse(200)])
+
+    def get(url, params=None, timeout=None):
+        clock['now'] += 0.5
+        return next(responses)
+
+    api = NSWPointsOfInterestAPI('http://example.invalid')
+    api.session.get = get
+    api.concurrency = RecordingConcurrency()
+
+    assert api.query({'f': 'json'}) == {'features': []}
+    # The 30 s Retry-After wait is not part of either request's latency
+    assert api.concurrency.latencies == [0.5, 0.5]
+
+
+def test_concurrency_slot_is_released_when_the_request_fails():
+    def get(url, params=None, timeout=None):
+        raise requests.exceptions.ConnectionError('down')
+
+    api = NSWPointsOfInterestAPI('http://example.invalid', max_retries=1, backoff=0)
+    api.session.get = get
+    api.concurrency = RecordingConcurrency()
+
+    with pytest.raises(requests.exceptions.RetryError):
+        api.query({'f': 'json'})
+    assert len(api.concurrency.latencies) == 2
@@ -0,0 +1,94 @@
+import random
+
+import geopandas as gpd
+import pytest
+import shapely
+
+from poi_harvest import BBoxQueryPlanner, inside_regions, owned_by_tile, selection_scope, tile_units
+
+
+class TruncatingServer:
+    """Fake ArcGIS layer: caps every response at `max_records` features like the real service.
+
+    Queries without resultOffset come back in an arbitrary (shuffled) order, paged
+    queries are ordered by objectid, as ArcGIS does with orderByFields.
+    """
+
+    def __init__(self, n_features=2500, max_records=1000, seed=0):
+        rng = random.Random(seed)
+        self.features = [
+            {'attributes': {'objectid': i}, 'geometry': {'x': rng.uniform(150, 151), 'y': rng.uniform(-34, -33)}}
+            for i in range(n_features)
+        ]
+        self.max_records = max_records
+        self.rng = rng
+
+    def _within(self, min_lat, min_lon, max_lat, max_lon):
+        return [
+            f for f in self.features
+            if min_lon <= f['geometry']['x'] <= max_lon and min_lat <= f['geometry']['y'] <= max_lat
+        ]
+
+    def query_bbox(self, min_lat, min_lon, max_lat, max_lon, result_offset=None, record_count=None,
+                   count_only=False):
+        matches = self._within(min_lat, min_lon, max_lat, max_lon)
+        if count_only:
+            return {'count': len(matches)}
+        if result_offset is None:
+            matches = self.rng.sample(matches, len(matches))
+            offset, size = 0, self.max_records
+        else:
+            matches = sorted(matches, key=lambda f: f['attributes']['objectid'])
+            offset, size = result_offset, min(record_count or self.max_records, self.max_records)
+        page = matches[offset:offset + size]
+        return {'features': page, 'exceededTransferLimit': offset + size < len(matches)}
+
+
+BBOX = (-34.0, 150.0, -33.0, 151.0)
+
+
+@pytest.mark.parametrize('strategy', ['split', 'page'])
+def test_planner_returns_every_feature_of_a_truncated_bbox(strategy):
+    server = TruncatingServer()
+    planner = BBoxQueryPlanner(server, max_workers=4, strategy=strategy)
+
+    features = planner.fetch(BBOX)
+
+    ids = sorted(f['attributes']['objectid'] for f in features)
+    assert ids == list(range(len(server.features)))
+
+
+@pytest.mark.parametrize('strategy', ['split', 'page'])
+def test_planner_does_not_page_or_split_a_complete_response(strategy):
+    server = TruncatingServer(n_features=300)
+    planner = BBoxQueryPlanner(server, strategy=strategy)
+
+    assert len(planner.fetch(BBOX)) == 300
+    assert planner.requests_made == 1
+
+
+def test_tile_harvest_keeps_only_pois_inside_the_selected_sa2s():
+    sa2 = gpd.GeoDataFrame({'SA2_CODE21': ['A']}, geometry=[shapely.box(150.0, -34.0, 150.5, -33.5)], crs=4326)
+    pois = [
+        {'attributes': {'objectid': 1}, 'geometry': {'x': 150.2, 'y': -33.8}},
+        {'attributes': {'objectid': 2}, 'geometry': {'x': 150.5, 'y': -33.6}},  # on the SA2 edge
+        {'attributes': {'objectid': 3}, 'geometry': {'x': 150.8, 'y': -33.8}},  # in the tile, outside the SA2
+        {'attributes': {'objectid': 4}, 'geometry': None},
+    ]
+
+    kept = inside_regions(owned_by_tile(pois, (-34.0, 150.0, -33.0, 151.0)), sa2)
+
+    assert [f['attributes']['objectid'] for f in kept] == [1, 2]
+
+
+def test_tile_keys_are_scoped_to_the_region_selection():
+    sa2 = gpd.GeoDataFrame({'SA2_CODE21': ['A']}, geometry=[shapely.box(150.01, -33.99, 150.04, -33.96)], crs=4326)
+
+    first = tile_units(sa2, 0.05, selection_scope(['11601']))
+    neighbour = tile_units(sa2, 0.05, selection_scope(['sa4:11602', 'state:1']))
+
+    assert [bbox for _, bbox in first] == [bbox for _, bbox in neighbour]
+    # The same border tile is a separate journal unit for each selection
+    assert not {unit for unit, _ in first} & {unit for unit, _ in neighbour}
+    assert first[0][0].endswith('@sa4:11601')
+    assert selection_scope(['state:1', 'SA4:11602']) == 'sa4:11602,state:1'
@@ -0,0 +1,19 @@
+import scoring
+
+
+class RecordingConnection:
+    def __init__(self):
+        self.statements = []
+
+    def execute_simple(self, sql):
+        self.statements.append(sql)
+
+
+def test_scoring_schema_is_found_from_another_working_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    conn = RecordingConnection()
+
+    scoring.create_scoring_schema(conn)
+
+    assert len(conn.statements) == 1
+    assert 'sa2_scores' in conn.statements[0]
@@ -0,0 +1,27 @@
+import geopandas as gpd
+import shapely
+
+from utils import shapefile_cache_path
+
+
+def write_shapefile(path, n):
+    path.parent.mkdir(parents=True)
+    gdf = gpd.GeoDataFrame({'v': list(range(n))}, geometry=[shapely.Point(i, i) for i in range(n)], crs=4326)
+    gdf.to_file(path)
+    return str(path)
+
+
+def test_same_named_shapefiles_get_separate_caches(tmp_path):
+    first = write_shapefile(tmp_path / 'a' / 'x.shp', 1)
+    second = write_shapefile(tmp_path / 'b' / 'x.shp', 2)
+    cache_dir = str(tmp_path / 'cache')
+
+    first_cache = shapefile_cache_path(first, cache_dir)
+    second_cache = shapefile_cache_path(second, cache_dir)
+
+    assert first_cache != second_cache
+    assert len(gpd.read_parquet(first_cache)) == 1
+    assert len(gpd.read_parquet(second_cache)) == 2
+    assert shapefile_cache_path(first, cache_dir) == first_cache
+    # No temporary files are left behind
+    assert not [p for p in (tmp_path / 'cache').iterdir() if p.suffix == '.tmp']
@@ -1,7 +1,16 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
 import pandas as pd
 import geopandas as gpd
+import shapely
 from sqlalchemy import create_engine, text
 
+from metrics import timed
+
 def enable_postgis(engine):
     try:
         with engine.connect() as conn:
@@ -42,16 +51,149 @@ def read_txt_file(txt_path, delimiter='\t'):
         print(f"❌ Lỗi khi đọc TXT {txt_path}: {e}")
         return None
 
+# 📦 Thư mục chứa bản GeoParquet đã chuyển đổi từ Shapefile
+SHAPEFILE_CACHE_DIR = 'data/cache'
+
+# Các file đi kèm của một Shapefile ảnh hưởng đến nội dung đọc được
+SHAPEFILE_SIDECARS = ('.shp', '.dbf', '.shx', '.prj', '.cpg')
+
+def shapefile_sources(shapefile_path):
+    base = os.path.splitext(shapefile_path)[0]
+    return [base + ext for ext in SHAPEFILE_SIDECARS if os.path.exists(base + ext)]
+
+def _file_hash(paths):
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+# Ghi file qua một file tạm riêng trong cùng thư mục rồi os.replace (người đọc/ghi song song không thấy file dở)
+def _atomic_write(path, write):
+    directory = os.path.dirname(path) or '.'
+    with tempfile.NamedTemporaryFile(dir=directory, prefix=os.path.basename(path) + '.', suffix='.tmp',
+                                     delete=False) as tmp:
+        tmp_path = tmp.name
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+# 📦 Trả về đường dẫn GeoParquet cache của Shapefile, chuyển đổi lại khi file gốc thay đổi
+# (so sánh size/mtime trước, chỉ tính hash khi size/mtime khác). Tên cache kèm hash của
+# đường dẫn tuyệt đối nên hai Shapefile cùng tên ở hai thư mục không dùng chung cache.
+def shapefile_cache_path(shapefile_path, cache_dir=SHAPEFILE_CACHE_DIR):
+    sources = shapefile_sources(shapefile_path)
+    fingerprint = {os.path.basename(p): [os.path.getsize(p), os.stat(p).st_mtime_ns] for p in sources}
+    name = os.path.splitext(os.path.basename(shapefile_path))[0]
+    path_key = hashlib.sha256(os.path.abspath(shapefile_path).encode('utf-8')).hexdigest()[:12]
+    parquet_path = os.path.join(cache_dir, f"{name}-{path_key}.parquet")
+    meta_path = parquet_path + '.json'
+
+    meta = None
+    if os.path.exists(parquet_path) and os.path.exists(meta_path):
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('fingerprint') == fingerprint:
+            return parquet_path
+
+    digest = _file_hash(sources)
+    if meta is None or meta.get('sha256') != digest:
+        print(f"📦 Đang chuyển {shapefile_path} sang GeoParquet...")
+        gdf = gpd.read_file(shapefile_path, engine="pyogrio", use_arrow=True)
+        os.makedirs(cache_dir, exist_ok=True)
+        _atomic_write(parquet_path, lambda path: gdf.to_parquet(path, write_covering_bbox=True))
+        print(f"✅ Đã tạo cache {parquet_path}")
+
+    def write_meta(path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'source': shapefile_path, 'fingerprint': fingerprint, 'sha256': digest}, f)
+    _atomic_write(meta_path, write_meta)
+    return parquet_path
+
+# Chuyển filters dạng pyarrow [(cột, '=', giá trị), (cột, 'in', [...])] sang mệnh đề where của GDAL
+def _filters_to_where(filters):
+    def literal(value):
+        return "'" + str(value).replace("'", "''") + "'" if isinstance(value, str) else str(value)
+    clauses = []
+    for column, op, value in filters:
+        if op == 'in':
+            clauses.append(f"{column} IN ({', '.join(literal(v) for v in value)})")
+        else:
+            clauses.append(f"{column} {'=' if op == '==' else op} {literal(value)}")
+    return ' AND '.join(clauses)
+
 # 🌍 Hàm đọc file Shapefile
-def read_shapefile(shapefile_path):
+# Mặc định đọc từ GeoParquet cache (chỉ các cột cần thiết, lọc theo filters/bbox/mask).
+# where (SQL) chỉ áp dụng khi đọc thẳng Shapefile: where/bbox/mask/columns được đẩy xuống pyogrio (GDAL).
+# Lưu ý: cột dùng trong where phải có trong columns (GDAL bỏ qua các cột không được chọn)
+@timed('read_shapefile', rows=len)
+def read_shapefile(shapefile_path, where=None, bbox=None, mask=None, columns=None, use_arrow=True,
+                   filters=None, use_cache=True):
     try:
-        gdf = gpd.read_file(shapefile_path, engine="pyogrio")
-        print(f"✅ Đọc file Shapefile {shapefile_path} thành công!")
+        if use_cache and where is None:
+            parquet_path = shapefile_cache_path(shapefile_path)
+            gdf = gpd.read_parquet(
+                parquet_path,
+                columns=list(columns) + ['geometry'] if columns is not None else None,
+                bbox=mask.bounds if mask is not None else bbox,
+                filters=filters,
+            )
+            if mask is not None:
+                gdf = gdf[gdf.intersects(mask)]
+            print(f"✅ Đọc {shapefile_path} từ cache {parquet_path} thành công! ({len(gdf)} dòng)")
+            return gdf
+
+        read_columns = list(columns) if columns is not None else None
+        if filters:
+            where = ' AND '.join(f"({w})" for w in (where, _filters_to_where(filters)) if w)
+            if read_columns is not None:
+                read_columns += [c for c, _, _ in filters if c not in read_columns]
+        gdf = gpd.read_file(
+            shapefile_path,
+            engine="pyogrio",
+            where=where,
+            bbox=bbox,
+            mask=mask,
+            columns=read_columns,
+            use_arrow=use_arrow,
+        )
+        if columns is not None:
+            gdf = gdf[list(columns) + ['geometry']]
+        print(f"✅ Đọc file Shapefile {shapefile_path} thành công! ({len(gdf)} dòng)")
         return gdf
     except Exception as e:
         print(f"❌ Lỗi khi đọc Shapefile {shapefile_path}: {e}")
         return None
 
+# 🧩 Giải mã cả cột geometry một lần bằng shapely 2 (from_wkt/from_wkb vectorized)
+# Tự nhận dạng WKT/EWKT, hex (E)WKB và WKB nhị phân; giá trị rỗng/không hợp lệ trả về None, không raise
+def decode_geometries(values):
+    series = pd.Series(values, dtype=object).reset_index(drop=True)
+    result = np.full(len(series), None, dtype=object)
+
+    is_binary = series.map(lambda v: isinstance(v, (bytes, bytearray, memoryview))).to_numpy(dtype=bool)
+    if is_binary.any():
+        result[is_binary] = shapely.from_wkb(
+            np.array([bytes(v) for v in series[is_binary]], dtype=object), on_invalid='ignore'
+        )
+
+    is_text = series.map(lambda v: isinstance(v, str)).to_numpy(dtype=bool)
+    text = series[is_text].str.strip()
+    is_hex = text.str.fullmatch(r'(?:[0-9A-Fa-f]{2})+').fillna(False).to_numpy(dtype=bool)
+    text_idx = np.flatnonzero(is_text)
+    if is_hex.any():
+        result[text_idx[is_hex]] = shapely.from_wkb(text[is_hex].to_numpy(dtype=object), on_invalid='ignore')
+    wkt_text = text[~is_hex].str.replace(r'^SRID=\d+;', '', regex=True)
+    wkt_text = wkt_text.where(wkt_text != '', None).to_numpy(dtype=object)
+    if len(wkt_text):
+        result[text_idx[~is_hex]] = shapely.from_wkt(wkt_text, on_invalid='ignore')
+    return result
+
 def insert_data_to_postgres(df, table_name, engine):
     try:
         df.to_sql(table_name, engine, if_exists='replace', index=False)